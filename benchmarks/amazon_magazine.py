@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Amazon の商品名から雑誌の号数などを取り出す処理の速さを測る
+
+tests/data/amazon_magazine_titles.jsonl のタイトルを，
+雑誌としてマッチするものとしないもの (書籍など) に分けて解析し，1 秒あたりの件数を表示する．
+
+    % python benchmarks/amazon_magazine.py --repeat 10
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shoshi.amazon_magazine import parse_magazine_titles
+
+CORPUS = os.path.join(os.path.dirname(__file__), '..',
+                      'tests', 'data', 'amazon_magazine_titles.jsonl')
+
+
+def measure(titles, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_magazine_titles(titles)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--corpus', default=CORPUS)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    with open(args.corpus, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    groups = [
+        ('all', [r['title'] for r in records]),
+        ('magazine', [r['title'] for r in records if r['expected']]),
+        ('other', [r['title'] for r in records if not r['expected']]),
+    ]
+    print('titles\tcount\tseconds\ttitles/s')
+    for name, titles in groups:
+        seconds = measure(titles, args.repeat)
+        print('{0}\t{1}\t{2:.4f}\t{3:.0f}'.format(
+            name, len(titles), seconds, len(titles) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+メタデータ (Metadata) 1件あたりのメモリ使用量を測る
+
+NDL の書誌程度の大きさ (タイトル，シリーズ，著者 2人，出版社，識別子) のメタデータを
+records 件作り，増えた最大常駐メモリ (ru_maxrss) を件数で割って表示する．
+件数ごとに別のプロセスで測るには，--records に 1 つずつ渡して実行する．
+
+    % python benchmarks/metadata_memory.py --records 1000000
+'''
+
+import os
+import sys
+import time
+import argparse
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shoshi.metadata import Metadata, Title, Series, Creator, Publisher
+
+
+def make_metadata(i):
+    return Metadata(
+        title=Title('作品 {0}'.format(i), 'サクヒン {0}'.format(i), [], []),
+        series=[Series(Title('叢書', 'ソウショ', [], []), str(i))],
+        publishers=[Publisher('出版社', 'シュッパンシャ', '東京')],
+        creators=[Creator('著者 {0}'.format(i), 'チョシャ', '著'),
+                  Creator('画家 {0}'.format(i), 'ガカ', 'イラスト')],
+        identifiers={'ISBN13': '978{0:010d}'.format(i)},
+        tags=[],
+        links=[],
+        price='600円',
+        page_count=200)
+
+
+def measure(records):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    batch = [make_metadata(i) for i in range(records)]
+    elapsed = time.perf_counter() - start
+    # Linux では KiB 単位
+    size = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024
+    del batch
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--records', type=int, nargs='+',
+                        default=[1000000])
+    args = parser.parse_args()
+    print('records\tbytes\tbytes/record\tseconds')
+    for records in args.records:
+        size, seconds = measure(records)
+        print('{0}\t{1}\t{2:.0f}\t{3:.2f}'.format(
+            records, size, size / records, seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+メタデータの JSON への書き出しの速さを測る
+
+tests/data の NDL の書誌 (内容細目の多いアンソロジーを含む) を records 件ずつ，
+todict，json.dumps(todict(...)) と tojson でそれぞれ書き出すのに掛かる時間を表示する．
+
+    % python benchmarks/metadata_serialize.py --records 10000
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shoshi import ndl
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+NAMES = ('ndl_haruhi.rdf', 'ndl_bungakushoujo.rdf', 'ndl_anthology.rdf')
+
+METHODS = [
+    ('todict', lambda m, include: m.todict(include)),
+    ('dumps', lambda m, include: json.dumps(m.todict(include),
+                                            ensure_ascii=False)),
+    ('tojson', lambda m, include: m.tojson(include)),
+]
+
+
+def load_records(records):
+    metadata = []
+    for name in NAMES:
+        with open(os.path.join(DATA, name), 'rb') as f:
+            metadata.append(ndl.metadata_from_rdf_content(f.read()))
+    return [metadata[i % len(metadata)] for i in range(records)]
+
+
+def measure(func, records, include, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for metadata in records:
+            func(metadata, include)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    records = load_records(args.records)
+    print('method\tinclude_none\tseconds\trecords/s')
+    for include in (True, False):
+        for name, func in METHODS:
+            seconds = measure(func, records, include, args.repeat)
+            print('{0}\t{1}\t{2:.3f}\t{3:.0f}'.format(
+                name, include, seconds, len(records) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+NDL の DC-NDL (RDF) の解析の速さを測る
+
+内容細目 (partInformation) の多い全集やアンソロジーを模した書誌を作り，
+ndl.metadata_from_rdf_content に掛かる時間を表示する．
+
+    % python benchmarks/ndl_rdf.py --contents 100 1000 --creators 200
+'''
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shoshi import ndl
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+ xmlns:dcterms="http://purl.org/dc/terms/"
+ xmlns:dc="http://purl.org/dc/elements/1.1/"
+ xmlns:dcndl="http://ndl.go.jp/dcndl/terms/"
+ xmlns:foaf="http://xmlns.com/foaf/0.1/">
+<dcndl:BibAdminResource rdf:about="http://iss.ndl.go.jp/books/R100000002-I000000000000-00"/>
+<dcndl:BibResource>
+<dcterms:identifier rdf:datatype="http://ndl.go.jp/dcndl/terms/ISBN">978-4-00-000000-2</dcterms:identifier>
+<dc:title><rdf:Description><rdf:value>作品集 : 全集</rdf:value>
+<dcndl:transcription>サクヒンシュウ : ゼンシュウ</dcndl:transcription></rdf:Description></dc:title>
+<dcndl:volume><rdf:Description><rdf:value>第1巻 (初期作品)</rdf:value>
+<dcndl:transcription>ダイ1カン ショキ サクヒン</dcndl:transcription></rdf:Description></dcndl:volume>
+<dcndl:seriesTitle><rdf:Description><rdf:value>全集叢書 ; 1</rdf:value>
+<dcndl:transcription>ゼンシュウ ソウショ ; 1</dcndl:transcription></rdf:Description></dcndl:seriesTitle>
+<dcterms:description>並列タイトル: Collected works</dcterms:description>
+<dcterms:date>2010.1</dcterms:date>
+<dcndl:price>3000円</dcndl:price>
+<dcterms:extent>800p ; 22cm</dcterms:extent>
+'''
+
+
+def make_rdf(contents, creators):
+    '''内容細目が contents 件，著者 (dcterms:creator) が creators 人の書誌'''
+    lines = [HEADER]
+    for i in range(creators):
+        lines.append(
+            '<dcterms:creator><foaf:Agent>'
+            '<foaf:name>著者, {0}号</foaf:name>'
+            '<dcndl:transcription>チョシャ, {0}ゴウ</dcndl:transcription>'
+            '</foaf:Agent></dcterms:creator>\n'.format(i))
+    lines.append('<dc:creator>著者{0}号 編</dc:creator>\n'.format(0))
+    for i in range(contents):
+        lines.append(
+            '<dcndl:partInformation><rdf:Description>'
+            '<dcterms:title>作品 {0}</dcterms:title>'
+            '<dcndl:transcription>サクヒン {0}</dcndl:transcription>'
+            '<dc:creator>著者{1}号 著</dc:creator>'
+            '</rdf:Description></dcndl:partInformation>\n'.format(
+                i, (i * 7) % max(creators, 1)))
+    lines.append('</dcndl:BibResource>\n</rdf:RDF>\n')
+    return ''.join(lines).encode('utf-8')
+
+
+def measure(content, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ndl.metadata_from_rdf_content(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--contents', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--creators', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print('contents\tcreators\tbytes\tseconds')
+    for contents in args.contents:
+        content = make_rdf(contents, args.creators)
+        seconds = measure(content, args.repeat)
+        print('{0}\t{1}\t{2}\t{3:.4f}'.format(
+            contents, args.creators, len(content), seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+python -m shoshi serve のスループットとレイテンシを測る
+
+各 API への問い合わせの代わりに latency 秒待って NDL の書誌 (tests/data) を返すようにし，
+clients 本の接続 (keep-alive) から GET /isbn/{isbn} を requests 回ずつ送る．
+
+    % python benchmarks/server.py --clients 1 8 32 --latency 0 0.05
+'''
+
+import os
+import sys
+import time
+import argparse
+import threading
+import http.client
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shoshi import batch, ndl, server
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+
+def run(clients, requests, latency):
+    with open(os.path.join(DATA, 'ndl_haruhi.rdf'), 'rb') as f:
+        content = f.read()
+
+    def lookup(isbn, *args):
+        if latency:
+            time.sleep(latency)
+        return ndl.metadata_from_rdf_content(content)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index):
+        connection = http.client.HTTPConnection(*httpd.server_address[:2])
+        times = []
+        for i in range(requests):
+            start = time.perf_counter()
+            connection.request('GET', '/isbn/978404429{0:03d}'.format(
+                (index * requests + i) % 1000) + '1')
+            connection.getresponse().read()
+            times.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(times)
+
+    with mock.patch.object(batch, 'metadata_from_isbn', lookup):
+        httpd = server.make_server(port=0, quiet=True)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            start = time.perf_counter()
+            threads = [threading.Thread(target=client, args=(i,))
+                       for i in range(clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+    latencies.sort()
+    return (len(latencies) / elapsed,
+            latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.99)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per client')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0, 0.05],
+                        help='simulated upstream latency (seconds)')
+    args = parser.parse_args()
+    print('clients\tlatency\trequests/s\tp50_ms\tp99_ms')
+    for latency in args.latency:
+        for clients in args.clients:
+            throughput, p50, p99 = run(clients, args.requests, latency)
+            print('{0}\t{1}\t{2:.0f}\t{3:.2f}\t{4:.2f}'.format(
+                clients, latency, throughput, p50 * 1000, p99 * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+記録した各 API の応答 (benchmarks/corpus と tests/data) を使って，解析と問い合わせ全体の速さを測る
+
+解析: API ごとの応答を解析する関数を繰り返し呼び，1秒あたりの件数を測る．
+問い合わせ全体: 記録した応答を返すスタブの HTTP サーバを立て，各 API への問い合わせを
+全てそこに向けて shoshi.metadata_from_isbn のレイテンシを測る．
+スタブは 1 リクエストごとに --latency 秒待ってから応答する．
+
+    % python benchmarks/suite.py --latency 0 0.05 --output results.json
+    % python benchmarks/suite.py --baseline results.json
+
+結果はタブ区切りで表示し，--output を指定すると JSON でも書き出す．
+--baseline に以前の JSON を渡すと，それに対する比 (大きいほど速い) も表示する．
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import lxml.etree
+from shoshi import __version__
+from shoshi import shoshi, ndl, rakuten, amazon, wikipedia, ratelimit
+from shoshi import transport as transport_module
+from shoshi.amazon_magazine import parse_magazine_title
+from shoshi.util import isbn10to13
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'corpus')
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+RDF_FILES = ['ndl_haruhi.rdf', 'ndl_bungakushoujo.rdf', 'ndl_anthology.rdf']
+ISBN = '9784044292041'
+SERIES_PAGE_TITLE = '涼宮ハルヒシリーズ'
+AMAZON_AUTH_INFO = ('ACCESSKEY', 'SECRETKEY', 'associate-22')
+RAKUTEN_APPLICATION_ID = '1000000000000000000'
+
+
+def read(directory, name):
+    with open(os.path.join(directory, name), 'rb') as f:
+        return f.read()
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def parse_benchmarks():
+    '''(名前, 1回の呼び出しで処理する件数, 関数) のリスト'''
+    rdfs = [read(DATA, name) for name in RDF_FILES]
+    opensearch = read(CORPUS, 'ndl_opensearch.xml')
+    sru = read(DATA, 'ndl_sru_batch.xml')
+    rakuten_content = read(CORPUS, 'rakuten_books_book.json')
+    item_lookup = read(CORPUS, 'amazon_item_lookup.xml')
+    with open(os.path.join(DATA, 'amazon_magazine_titles.jsonl'),
+              encoding='utf-8') as f:
+        magazine_titles = [json.loads(line)['title'] for line in f]
+    revisions = read(CORPUS, 'wikipedia_revisions.json')
+
+    ndl_metadata = ndl.metadata_from_rdf_content(rdfs[0])
+    amazon_metadata = amazon.metadata_from_item_lookup_content(item_lookup)
+    rakuten_metadata = rakuten.metadata_from_book_data(
+        json.loads(rakuten_content), ISBN)
+    wikipedia_metadata = wikipedia.metadata_from_series_info(
+        wikipedia.series_info_from_wikicode(
+            wikipedia.wikicode_from_revisions_content(revisions),
+            SERIES_PAGE_TITLE),
+        ndl_metadata.title.name, ['谷川流'])
+    assert wikipedia_metadata.series
+
+    def ndl_rdf():
+        for content in rdfs:
+            ndl.create_metadata_from_xml_root(
+                lxml.etree.fromstring(content, ndl.RDF_PARSER))
+
+    def ndl_opensearch():
+        ndl.rdf_url_from_opensearch_content(opensearch)
+
+    def ndl_sru():
+        for content in ndl.rdf_contents_from_sru_content(sru)[0]:
+            ndl.metadata_from_rdf_content(content)
+
+    def rakuten_book():
+        rakuten.metadata_from_book_data(json.loads(rakuten_content), ISBN)
+
+    def amazon_item_lookup():
+        amazon.metadata_from_item_lookup_content(item_lookup)
+
+    def amazon_magazine():
+        for title in magazine_titles:
+            parse_magazine_title(title)
+
+    def wikipedia_infobox():
+        wikipedia.series_info_from_wikicode(
+            wikipedia.wikicode_from_revisions_content(revisions),
+            SERIES_PAGE_TITLE)
+
+    def merge():
+        shoshi.merge(ndl_metadata, amazon_metadata, rakuten_metadata,
+                     wikipedia_metadata)
+
+    return [
+        ('ndl_rdf', len(rdfs), ndl_rdf),
+        ('ndl_opensearch', 1, ndl_opensearch),
+        ('ndl_sru', len(ndl.rdf_contents_from_sru_content(sru)[0]), ndl_sru),
+        ('rakuten_book', 1, rakuten_book),
+        ('amazon_item_lookup', 1, amazon_item_lookup),
+        ('amazon_magazine', len(magazine_titles), amazon_magazine),
+        ('wikipedia_infobox', 1, wikipedia_infobox),
+        ('merge', 1, merge),
+    ]
+
+
+def run_parse_benchmarks(number, repeat):
+    results = []
+    for name, items, func in parse_benchmarks():
+        def loop():
+            for _ in range(number):
+                func()
+        elapsed = measure(loop, repeat)
+        results.append({'name': name, 'items': items * number,
+                        'seconds': elapsed,
+                        'items_per_second': items * number / elapsed})
+    return results
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    /{元のホスト}/{元のパス}?{元のクエリ} への GET に記録した応答を返す．
+    server.latency 秒待ってから応答する
+    '''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = dict((key, values[0])
+                     for key, values in parse_qs(parts.query).items())
+        body = self.server.route(parts.path, query)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(404 if body is None else 200)
+        body = body or b''
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.opensearch = read(CORPUS, 'ndl_opensearch.xml')
+        self.rdf = read(DATA, 'ndl_haruhi.rdf')
+        self.rakuten = read(CORPUS, 'rakuten_books_book.json')
+        self.item_lookup = read(CORPUS, 'amazon_item_lookup.xml')
+        self.search = read(CORPUS, 'wikipedia_search.json')
+        self.revisions = json.loads(read(CORPUS, 'wikipedia_revisions.json'))
+
+    def route(self, path, query):
+        with self._lock:
+            self.requests += 1
+        if path == '/iss.ndl.go.jp/api/opensearch':
+            return self.opensearch
+        if path.startswith('/iss.ndl.go.jp/books/') and path.endswith('.rdf'):
+            return self.rdf
+        if path.startswith('/app.rakuten.co.jp/services/api/BooksBook/'):
+            return self.rakuten
+        if path == '/webservices.amazon.co.jp/onca/xml':
+            return self.item_lookup
+        if path == '/ja.wikipedia.org/w/api.php':
+            if query.get('list') == 'search':
+                return self.search
+            if query.get('prop') == 'revisions':
+                return self.revisions_content(query['titles'].split('|'))
+        return None
+
+    def revisions_content(self, titles):
+        # 記録したページ以外は存在しないページとして返す
+        recorded = dict((page['title'], (page_id, page)) for page_id, page
+                        in self.revisions['query']['pages'].items())
+        pages = {}
+        for i, title in enumerate(titles):
+            if title in recorded:
+                page_id, page = recorded[title]
+                pages[page_id] = page
+            else:
+                pages[str(-1 - i)] = {'ns': 0, 'title': title, 'missing': ''}
+        return json.dumps({'query': {'pages': pages}},
+                          ensure_ascii=False).encode('utf-8')
+
+
+class StubTransport(transport_module.Transport):
+    '''全ての URL を http://127.0.0.1:{port}/{元のホスト}/{元のパス} に書き換えて送る'''
+
+    def __init__(self, base, **kwargs):
+        transport_module.Transport.__init__(self, **kwargs)
+        self.base = base
+
+    def _get(self, source, url, params, credential):
+        parts = urlsplit(url)
+        url = self.base + '/' + parts.netloc + parts.path
+        if parts.query:
+            url += '?' + parts.query
+        return transport_module.Transport._get(self, source, url, params,
+                                               credential)
+
+
+def isbns(count):
+    '''チェックディジットの正しい，互いに異なる ISBN13 (同じ問い合わせがまとめられないように)'''
+    return [isbn10to13('404{0:06d}'.format(i) + 'X')
+            for i in range(count)]
+
+
+def run_end_to_end(latency, lookups, concurrency, use_wikipedia=True):
+    '''スタブのサーバに対して lookups 件を concurrency 件ずつ同時に問い合わせる'''
+    httpd = StubServer(latency)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    stub = StubTransport('http://127.0.0.1:{0}'.format(
+        httpd.server_address[1]), pool_maxsize=max(concurrency * 4, 10))
+    latencies = []
+    lock = threading.Lock()
+
+    def lookup(isbn):
+        start = time.perf_counter()
+        metadata = shoshi.metadata_from_isbn(
+            isbn, AMAZON_AUTH_INFO, RAKUTEN_APPLICATION_ID, use_wikipedia,
+            transport=stub)
+        elapsed = time.perf_counter() - start
+        assert metadata.title.name == '涼宮ハルヒの消失', metadata.todict()
+        with lock:
+            latencies.append(elapsed)
+
+    try:
+        start = time.perf_counter()
+        for _ in shoshi.map_as_completed(lookup, isbns(lookups),
+                                          concurrency):
+            pass
+        elapsed = time.perf_counter() - start
+    finally:
+        stub.close()
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+    latencies.sort()
+    return {'name': 'end_to_end', 'latency': latency,
+            'concurrency': concurrency, 'lookups': lookups,
+            'upstream_requests': httpd.requests,
+            'lookups_per_second': lookups / elapsed,
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(int(len(latencies) * 0.95),
+                                 len(latencies) - 1)],
+            'mean': sum(latencies) / len(latencies)}
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'lxml': '.'.join(map(str, lxml.etree.LXML_VERSION)),
+            'shoshi': __version__}
+
+
+def baseline_ratios(results, baseline):
+    '''
+    baseline (以前の結果) に対する比．解析は件数/秒の比，問い合わせ全体は p50 の逆比
+    (どちらも 1 より大きければ速くなった)
+    '''
+    previous = {}
+    for result in baseline['parse']:
+        previous[result['name']] = result['items_per_second']
+    for result in baseline['end_to_end']:
+        previous[('end_to_end', result['latency'],
+                  result['concurrency'])] = result['p50']
+    ratios = {}
+    for result in results['parse']:
+        if result['name'] in previous:
+            ratios[result['name']] = (result['items_per_second'] /
+                                      previous[result['name']])
+    for result in results['end_to_end']:
+        key = ('end_to_end', result['latency'], result['concurrency'])
+        if key in previous:
+            ratios[key] = previous[key] / result['p50']
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--number', type=int, default=100,
+                        help='calls per measurement of each parser')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0, 0.05],
+                        help='seconds the stub server waits per request')
+    parser.add_argument('--lookups', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--skip-end-to-end', action='store_true',
+                        default=False)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='JSON written by --output to '
+                                           'compare with')
+    args = parser.parse_args()
+
+    # スタブに対してはリクエスト数の制限で待つ必要が無い
+    ratelimit.set_rate('amazon', None)
+    ratelimit.set_rate('rakuten', None)
+
+    results = {'environment': environment(), 'parse': [], 'end_to_end': []}
+    print('parser\titems\tseconds\titems/s')
+    for result in run_parse_benchmarks(args.number, args.repeat):
+        results['parse'].append(result)
+        print('{name}\t{items}\t{seconds:.4f}\t{items_per_second:.1f}'.format(
+            **result))
+
+    if not args.skip_end_to_end:
+        print('latency\tconcurrency\tlookups/s\tp50\tp95\tmean\trequests')
+        for latency in args.latency:
+            for concurrency in args.concurrency:
+                result = run_end_to_end(latency, args.lookups, concurrency)
+                results['end_to_end'].append(result)
+                print('{latency}\t{concurrency}\t{lookups_per_second:.1f}\t'
+                      '{p50:.4f}\t{p95:.4f}\t{mean:.4f}\t'
+                      '{upstream_requests}'.format(**result))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print('benchmark\tratio')
+        for key, ratio in baseline_ratios(results, baseline).items():
+            if isinstance(key, tuple):
+                key = 'end_to_end latency={1} concurrency={2}'.format(*key)
+            print('{0}\t{1:.2f}'.format(key, ratio))
+
+
+if __name__ == '__main__':
+    main()
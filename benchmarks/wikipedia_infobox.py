@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Wikipedia のシリーズのページの解析の速さを測る
+
+Infobox animanga の後に長い本文 (節，表，脚注，テンプレート) が続くページを作り，
+ページ全体を mwparserfromhell で解析する場合と，
+wikipedia.parse_infoboxes で Infobox だけを解析する場合を比べる．
+
+    % python benchmarks/wikipedia_infobox.py --sections 10 100 500
+'''
+
+import os
+import sys
+import time
+import argparse
+import mwparserfromhell
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from shoshi import wikipedia
+
+INFOBOXES = '''{{Infobox animanga/Header
+| タイトル = 涼宮ハルヒシリーズ
+| ジャンル = [[学園]]、[[SF]]
+}}
+{{Infobox animanga/Novel
+| 著者 = [[谷川流]]<!-- 著者 -->
+| イラスト = [[いとうのいぢ]]
+| 出版社 = [[角川書店]]
+| 巻数 = 既刊11巻（2011年6月現在）
+}}
+{{Infobox animanga/Manga
+| 作者 = ツガノガク
+| 出版社 = 角川書店
+}}
+{{Infobox animanga/Footer}}
+'''
+
+SECTION = '''== 第{0}節 ==
+{{{{main|関連項目{0}}}}}
+本文{0}．[[リンク{0}|表示]]や''強調''を含む段落<ref>{{{{Cite web|title=出典{0}|url=http://example.com/{0}|accessdate=2013-10-18}}}}</ref>．
+{{| class="wikitable"
+|-
+! 巻 !! タイトル !! ISBN
+|-
+| {0} || 第{0}巻 || ISBN 4-04-42920{1}-3
+|}}
+* 項目 {{{{lang|en|Item {0}}}}}
+'''
+
+
+def make_page(sections):
+    return INFOBOXES + ''.join(SECTION.format(i, i % 10)
+                               for i in range(sections))
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sections', type=int, nargs='+',
+                        default=[10, 100, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    authors = ['谷川流', 'いとうのいぢ']
+    print('sections\tbytes\tfull\tinfobox')
+    for sections in args.sections:
+        text = make_page(sections)
+
+        def full():
+            return wikipedia.metadata_from_series_page(
+                mwparserfromhell.parse(text), 'ページ', '涼宮ハルヒの消失', authors)
+
+        def infobox():
+            return wikipedia.metadata_from_series_page(
+                wikipedia.parse_infoboxes(text), 'ページ', '涼宮ハルヒの消失',
+                authors)
+
+        assert full().todict() == infobox().todict()
+        print('{0}\t{1}\t{2:.4f}\t{3:.4f}'.format(
+            sections, len(text.encode('utf-8')),
+            measure(full, args.repeat), measure(infobox, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,4 +25,7 @@ setup(name='shoshi',
           'bottlenose',
           'requests',
           'lxml',
-      ])
+      ],
+      extras_require={
+          'aio': ['aiohttp'],
+      })
@@ -11,3 +11,7 @@ from . import shoshi
 metadata_from_isbn = shoshi.metadata_from_isbn
 metadata_from_ean = shoshi.metadata_from_ean
 metadata_from_jpno = shoshi.metadata_from_jpno
+metadata_from_isbns = shoshi.metadata_from_isbns
+metadata_from_eans = shoshi.metadata_from_eans
+metadata_from_jpnos = shoshi.metadata_from_jpnos
+map_as_completed = shoshi.map_as_completed
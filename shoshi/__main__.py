@@ -13,8 +13,21 @@ path = os.path.dirname(sys.modules[__name__].__file__)
 path = os.path.join(path, '..')
 sys.path.insert(0, path)
 
+if len(sys.argv) > 1 and sys.argv[1] == 'ingest-ndl':
+    from .ingest import main
+    sys.exit(main(sys.argv[2:]))
+if len(sys.argv) > 1 and sys.argv[1] == 'build-wikipedia-index':
+    from .wikipedia_index import main
+    sys.exit(main(sys.argv[2:]))
+if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+    from .server import main
+    sys.exit(main(sys.argv[2:]))
+
 from .__init__ import metadata_from_isbn, metadata_from_ean, metadata_from_jpno
 from .metadata import Metadata
+from . import cache, ndl, replay, transport, wikipedia
+from .wikipedia_index import SeriesIndex
+from .amazon import CredentialPool
 
 parser = argparse.ArgumentParser(
     description='find book metadata')
@@ -22,27 +35,81 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--isbn', action="store", dest="isbn")
 parser.add_argument('--ean', action="store", dest="ean")
 parser.add_argument('--jpno', action="store", dest="jpno")
+parser.add_argument('--input', action="store", dest="input",
+                    help='file with one ISBN, EAN or JPNO per line '
+                         '(- reads stdin); writes one JSON line per record')
+parser.add_argument('--jobs', action="store", dest="jobs", type=int,
+                    default=4, help='number of records to look up at once '
+                                    'with --input')
 
 parser.add_argument('--rakuten-application-id', action="store",
                     dest="rakuten_application_id")
-parser.add_argument('--amazon-auth-info', action="store",
-                    dest="amazon_auth_info")
+parser.add_argument('--amazon-auth-info', action="append",
+                    dest="amazon_auth_info",
+                    help='ACCESS_KEY,SECRET_KEY,ASSOCIATE_TAG '
+                         '(repeat to use several credentials in turn)')
 parser.add_argument('--use-wikipedia', action="store_true",
                     default=False, dest="use_wikipedia")
 
+parser.add_argument('--deadline', action="store", dest="deadline",
+                    type=float,
+                    help='give up on sources that have not answered '
+                         'within this many seconds')
+parser.add_argument('--cache', action="store", dest="cache",
+                    help='path to an SQLite file to cache API responses in')
+parser.add_argument('--ndl-api', action="store", dest="ndl_api",
+                    choices=('opensearch', 'sru'), default='opensearch',
+                    help='sru fetches DC-NDL records in a single round trip')
+parser.add_argument('--wikipedia-index', action="store",
+                    dest="wikipedia_index",
+                    help='answer --use-wikipedia from an index built by '
+                         'build-wikipedia-index instead of searching online')
+parser.add_argument('--wikipedia-series-cache', action="store",
+                    dest="wikipedia_series_cache",
+                    help='path to an SQLite file to record the ISBNs of the '
+                         'series pages found online in')
+parser.add_argument('--record', action="store", dest="record",
+                    help='path to an SQLite file to record every API '
+                         'response in')
+parser.add_argument('--replay', action="store", dest="replay",
+                    help='answer from responses recorded with --record '
+                         'instead of the network')
+
 parser.add_argument('--prettyprint', action="store_true",
                     default=False, dest="prettyprint")
 parser.add_argument('--include-null-value-field', action='store_true',
                     default=False, dest='include_none_value_field')
 
 args = parser.parse_args()
+if args.record and args.replay:
+    parser.error('--record and --replay cannot be used together')
 amazon_auth_info = None
-if args.amazon_auth_info:
-    amazon_auth_info = args.amazon_auth_info.split(',')
+if args.amazon_auth_info and len(args.amazon_auth_info) == 1:
+    amazon_auth_info = args.amazon_auth_info[0].split(',')
+elif args.amazon_auth_info:
+    amazon_auth_info = CredentialPool(
+        [info.split(',') for info in args.amazon_auth_info])
 rakuten_application_id = None
 if args.rakuten_application_id:
     rakuten_application_id = args.rakuten_application_id
 use_wikipedia = args.use_wikipedia
+if args.cache:
+    cache.set_cache(cache.SQLiteCache(args.cache))
+if args.record:
+    transport.set_transport(replay.RecordingTransport(
+        replay.Archive(args.record)))
+elif args.replay:
+    transport.set_transport(replay.ReplayTransport(
+        replay.Archive(args.replay)))
+ndl.set_api(args.ndl_api)
+if args.wikipedia_index:
+    wikipedia.set_series_index(SeriesIndex(args.wikipedia_index), offline=True)
+elif args.wikipedia_series_cache:
+    wikipedia.set_series_index(SeriesIndex(args.wikipedia_series_cache))
+
+if args.input:
+    from .batch import main
+    sys.exit(main(args, amazon_auth_info, rakuten_application_id))
 
 metadata = Metadata()
 if args.isbn:
@@ -50,13 +117,15 @@ if args.isbn:
         args.isbn,
         amazon_auth_info=amazon_auth_info,
         rakuten_application_id=rakuten_application_id,
-        use_wikipedia=use_wikipedia)
+        use_wikipedia=use_wikipedia,
+        deadline=args.deadline)
 elif args.ean:
     metadata = metadata_from_ean(
         args.ean,
         amazon_auth_info=amazon_auth_info,
         rakuten_application_id=rakuten_application_id,
-        use_wikipedia=use_wikipedia)
+        use_wikipedia=use_wikipedia,
+        deadline=args.deadline)
 elif args.jpno:
     metadata = metadata_from_jpno(
         args.jpno,
@@ -65,5 +134,8 @@ elif args.jpno:
         use_wikipedia=use_wikipedia)
 
 
-print(json.dumps(metadata.todict(args.include_none_value_field),
-                 ensure_ascii=False, indent=2 if args.prettyprint else None))
+if args.prettyprint:
+    print(json.dumps(metadata.todict(args.include_none_value_field),
+                     ensure_ascii=False, indent=2))
+else:
+    print(metadata.tojson(args.include_none_value_field))
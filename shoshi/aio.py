@@ -0,0 +1,361 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+asyncio 版の API (aiohttp が必要)
+
+shoshi.metadata_from_isbn などと同じ処理を，スレッドを使わずにイベントループ上で行う．
+レスポンスの解析には各モジュールの関数をそのまま使う．
+amazon_auth_info には同期版と同じく認証情報か amazon.CredentialPool を渡せる．
+
+例:
+    async with aiohttp.ClientSession() as session:
+        metadata = await shoshi.aio.metadata_from_isbn(
+            '4-04-429204-3', session=session, timeout=10)
+'''
+
+import json
+import asyncio
+import aiohttp
+from .metadata import Metadata
+from .shoshi import merge, is_magazine_code, title_and_creator_names
+from . import ndl, rakuten, amazon, wikipedia, cache, ratelimit, transport
+
+# リトライの回数と間隔 (transport.Transport のデフォルトと同じ)
+RETRIES = 2
+BACKOFF_FACTOR = 0.5
+# 各 API の問い合わせで失敗として空の結果にする例外 (接続エラー，エラーのステータスコード，タイムアウト)
+_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+async def metadata_from_isbn(isbn,
+                             amazon_auth_info=None,
+                             rakuten_application_id=None,
+                             use_wikipedia=False,
+                             session=None,
+                             timeout=None):
+    return await metadata_from_ean(isbn,
+                                   amazon_auth_info,
+                                   rakuten_application_id,
+                                   use_wikipedia,
+                                   session=session,
+                                   timeout=timeout)
+
+
+async def metadata_from_ean(ean,
+                            amazon_auth_info=None,
+                            rakuten_application_id=None,
+                            use_wikipedia=False,
+                            session=None,
+                            timeout=None):
+    '''
+    timeout (秒) を過ぎると asyncio.TimeoutError を送出する．
+    session を省略した場合は呼び出しごとに aiohttp.ClientSession を作る
+    '''
+    return await _run(_metadata_from_ean, session, timeout,
+                      ean, amazon_auth_info,
+                      rakuten_application_id, use_wikipedia)
+
+
+async def metadata_from_jpno(jpno,
+                             amazon_auth_info=None,
+                             rakuten_application_id=None,
+                             use_wikipedia=False,
+                             session=None,
+                             timeout=None):
+    return await _run(_metadata_from_jpno, session, timeout,
+                      jpno, amazon_auth_info,
+                      rakuten_application_id, use_wikipedia)
+
+
+async def _run(func, session, timeout, *args):
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.wait_for(func(session, *args), timeout)
+    return await asyncio.wait_for(func(session, *args), timeout)
+
+
+async def _metadata_from_ean(session, ean, amazon_auth_info,
+                             rakuten_application_id, use_wikipedia):
+    ean = ean.replace('-', '')
+    # 各 API への問い合わせを同時に行う
+    # いずれかが失敗 (またはキャンセル) された場合，残りのタスクもキャンセルされる
+    amazon_task = None
+    rakuten_task = None
+    wikipedia_task = None
+    tasks = []
+    ndl_task = asyncio.ensure_future(_ndl_metadata_from_isbn(session, ean))
+    tasks.append(ndl_task)
+    if amazon_auth_info:
+        amazon_task = asyncio.ensure_future(
+            _amazon_metadata_from_ean(session, ean, amazon_auth_info))
+        tasks.append(amazon_task)
+    if rakuten_application_id:
+        if is_magazine_code(ean):
+            rakuten_task = asyncio.ensure_future(
+                _rakuten_metadata_from_magazine_code(
+                    session, ean, rakuten_application_id))
+        else:
+            rakuten_task = asyncio.ensure_future(
+                _rakuten_metadata_from_isbn(
+                    session, ean, rakuten_application_id))
+        tasks.append(rakuten_task)
+    if use_wikipedia:
+        wikipedia_task = asyncio.ensure_future(
+            _wikipedia_find_series_info(session, ean))
+        tasks.append(wikipedia_task)
+
+    try:
+        ndl_metadata = await ndl_task
+        amazon_metadata = await _result_or_empty(amazon_task)
+        rakuten_metadata = await _result_or_empty(rakuten_task)
+
+        if not ndl_metadata.identifiers:
+            ndl_metadata.identifiers['EAN'] = ean
+
+        wikipedia_metadata = Metadata()
+        if wikipedia_task is not None:
+            title, creator_names = title_and_creator_names(
+                ndl_metadata, amazon_metadata, rakuten_metadata)
+            if title:
+                info = await wikipedia_task
+                wikipedia_metadata = wikipedia.metadata_from_series_info(
+                    info, title, creator_names)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # 使わなかった結果の例外は捨てる
+                task.exception()
+
+    return merge(ndl_metadata, amazon_metadata,
+                 rakuten_metadata, wikipedia_metadata)
+
+
+async def _metadata_from_jpno(session, jpno, amazon_auth_info,
+                              rakuten_application_id, use_wikipedia):
+    jpno = jpno.replace('-', '')
+    metadata = await _ndl_metadata_from_jpno(session, jpno)
+    if not metadata.identifiers:
+        metadata.identifiers['JPNO'] = jpno
+    if 'ISBN13' in metadata.identifiers:
+        return await _metadata_from_ean(session,
+                                        metadata.identifiers['ISBN13'],
+                                        amazon_auth_info,
+                                        rakuten_application_id,
+                                        use_wikipedia)
+    return metadata
+
+
+async def _result_or_empty(task):
+    if task is None:
+        return Metadata()
+    return await task
+
+
+async def _get(session, url, params=None, source=None, credential=None):
+    '''
+    transport.Transport と同じく，接続エラーやタイムアウト，5xx の場合は間隔を倍々に空けて
+    RETRIES 回までリトライする (Retry-After があればそれに従う)．4xx はリトライしない．
+    url は文字列か，URL を返す関数 (Amazon の署名のように送るたびに作り直す場合)
+    '''
+    # requests と同様に値が None のパラメータは送らない
+    if params is not None:
+        params = dict((k, v) for k, v in params.items() if v is not None)
+    attempt = 0
+    while True:
+        # リトライのたびにリクエスト数の制限を守る
+        if source is not None:
+            await ratelimit.acquire_async(source, credential)
+        try:
+            async with session.get(url() if callable(url) else url,
+                                   params=params) as response:
+                if attempt < RETRIES and transport.should_retry_status(
+                        source, credential, response.status):
+                    wait = transport.retry_after(response)
+                else:
+                    response.raise_for_status()
+                    return await response.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt >= RETRIES:
+                raise
+            wait = None
+        await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt)
+                            if wait is None else wait)
+        attempt += 1
+
+
+async def _ndl_metadata_from_isbn(session, isbn):
+    params = ndl.isbn_params(isbn)
+    if ndl.get_api() == 'sru':
+        return await _ndl_metadata_via_sru(session, 'isbn', params['isbn'])
+    return await _ndl_metadata_from_opensearch(session, params)
+
+
+async def _ndl_metadata_from_jpno(session, jpno):
+    params = ndl.jpno_params(jpno)
+    if ndl.get_api() == 'sru':
+        return await _ndl_metadata_via_sru(session, 'jpno', params['jpno'])
+    return await _ndl_metadata_from_opensearch(session, params)
+
+
+async def _ndl_metadata_via_sru(session, index, value):
+    async def fetch():
+        content = await _get(session, ndl.SRU_URL,
+                             ndl.sru_params(index, [value]), 'ndl')
+        contents, _ = ndl.rdf_contents_from_sru_content(content)
+        return contents[0] if contents else b''
+
+    try:
+        content = await cache.cached_async(
+            'ndl', ndl.sru_cache_key(index, value), fetch,
+            ndl.classify_rdf_content)
+    except _ERRORS:
+        return Metadata()
+    return ndl.metadata_from_rdf_content(content) if content else Metadata()
+
+
+async def _ndl_metadata_from_opensearch(session, params):
+    try:
+        content = await cache.cached_async(
+            'ndl', cache.make_key(ndl.OPENSEARCH_URL, params),
+            lambda: _get(session, ndl.OPENSEARCH_URL, params, 'ndl'),
+            ndl.classify_opensearch_content)
+    except _ERRORS:
+        return Metadata()
+    dcndl_rdf_url = ndl.rdf_url_from_opensearch_content(content)
+    if dcndl_rdf_url is None:
+        return Metadata()
+    try:
+        content = await cache.cached_async(
+            'ndl', dcndl_rdf_url, lambda: _get(session, dcndl_rdf_url, None,
+                                               'ndl'))
+    except _ERRORS:
+        return Metadata()
+    return ndl.metadata_from_rdf_content(content)
+
+
+async def _rakuten_fetch(session, url, params):
+    return await cache.cached_async(
+        'rakuten', rakuten.cache_key(url, params),
+        lambda: _get(session, url, params,
+                     'rakuten', params['applicationId']),
+        rakuten.classify_content)
+
+
+async def _rakuten_metadata_from_isbn(session, isbn, application_id):
+    params = rakuten.isbn_params(isbn, application_id)
+    try:
+        content = await _rakuten_fetch(session, rakuten.BOOKS_BOOK_URL, params)
+    except _ERRORS:
+        return Metadata()
+    return rakuten.metadata_from_book_data(json.loads(content), params['isbn'])
+
+
+async def _rakuten_metadata_from_magazine_code(session, jan, application_id):
+    params = rakuten.magazine_code_params(jan, application_id)
+    try:
+        content = await _rakuten_fetch(session, rakuten.BOOKS_MAGAZINE_URL,
+                                       params)
+    except _ERRORS:
+        return Metadata()
+    return rakuten.metadata_from_magazine_data(json.loads(content),
+                                               params['jan'])
+
+
+async def _amazon_metadata_from_ean(session, EAN, amazon_auth_info):
+    # amazon_auth_info は認証情報か amazon.CredentialPool
+    if isinstance(amazon_auth_info, amazon.CredentialPool):
+        acquire = amazon_auth_info.acquire
+    else:
+        credential = tuple(amazon_auth_info)
+        acquire = lambda: credential
+
+    async def item_lookup():
+        # 認証情報はキャッシュに無かった場合だけ取り出す (キャッシュにあれば回数の上限を使わない)
+        access_key_id, secret_access_key, associate_tag = acquire()
+
+        def url():
+            # 署名にはタイムスタンプが含まれるので，リトライのたびに作り直す
+            return amazon.item_lookup_url(EAN, access_key_id,
+                                          secret_access_key, associate_tag)
+
+        return await _get(session, url, None, 'amazon', access_key_id)
+
+    try:
+        content = await cache.cached_async(
+            'amazon',
+            amazon.item_lookup_cache_key(amazon.item_lookup_params(EAN)),
+            item_lookup, amazon.classify_item_lookup_content)
+    except _ERRORS + (amazon.QuotaExceededError,):
+        return Metadata()
+    return amazon.metadata_from_item_lookup_content(content)
+
+
+async def _wikipedia_fetch(session, params, classify=None):
+    return await cache.cached_async(
+        'wikipedia', cache.make_key(wikipedia.URL, params),
+        lambda: _get(session, wikipedia.URL, params, 'wikipedia'), classify)
+
+
+async def _wikipedia_find_series_info(session, isbn):
+    loop = asyncio.get_running_loop()
+    index = wikipedia.get_series_index()
+    if index is not None:
+        # 索引 (SQLite) の読み書きはイベントループを止めないようにスレッドプールで行う
+        infos = await loop.run_in_executor(None, index.lookup, isbn)
+        if infos:
+            return infos[0]
+        if wikipedia.is_offline():
+            return None
+    wikicode, page_title, content = await _wikipedia_find_series_page(session,
+                                                                       isbn)
+    if not wikicode:
+        return None
+    info = wikipedia.series_info_from_wikicode(wikicode, page_title)
+    if index is not None:
+        await loop.run_in_executor(None, wikipedia.harvest_series_page,
+                                   page_title, content, info)
+    return info
+
+
+async def _wikipedia_find_series_page(session, isbn):
+    content = await _wikipedia_fetch(session, wikipedia.search_params(isbn),
+                                     wikipedia.classify_search_content)
+    titles = wikipedia.titles_from_search_data(json.loads(content))
+    contents = await _wikipedia_fetch_revisions(session, titles)
+    for title in titles:
+        wikicode = wikipedia.wikicode_from_revisions_content(contents[title])
+        if wikicode:
+            return wikicode, title, contents[title]
+    return None, None, None
+
+
+async def _wikipedia_fetch_revisions(session, titles):
+    # wikipedia.fetch_revisions と同様に，候補のページの本文をまとめて取得する
+    contents = {}
+    pending = []
+    for title in dict.fromkeys(titles):
+        content = await cache.lookup_async('wikipedia', cache.make_key(
+            wikipedia.URL, wikipedia.revisions_params(title)))
+        if content is None:
+            pending.append(title)
+        else:
+            contents[title] = content
+    for i in range(0, len(pending), wikipedia.MAX_TITLES):
+        chunk = pending[i:i + wikipedia.MAX_TITLES]
+        content = await _get(session, wikipedia.URL,
+                             wikipedia.revisions_params('|'.join(chunk)),
+                             'wikipedia')
+        for title, page_content in wikipedia.split_revisions_content(
+                content, chunk).items():
+            contents[title] = page_content
+            await cache.store_async('wikipedia', cache.make_key(
+                wikipedia.URL, wikipedia.revisions_params(title)),
+                page_content)
+    for title in pending:
+        if title not in contents:
+            contents[title] = await _wikipedia_fetch(
+                session, wikipedia.revisions_params(title))
+    return contents
@@ -2,10 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import re
-import bottlenose
 import time
+import threading
+import bottlenose
 from lxml import objectify
+import lxml.etree
 import lxml.html
+from . import cache, ratelimit
+from .transport import get_transport
 from .util import isbn10to13, isbn13to10, normalize
 from .metadata import Metadata, Title, Creator, Publisher
 from .metadata import Volume
@@ -16,35 +20,227 @@ def normalize_author(author):
     return re.sub(r'\s+', '', normalize(author))
 
 
-def metadata_from_asin(ASIN, access_key_id, secret_access_key, associate_tag):
+def metadata_from_asin(ASIN, access_key_id, secret_access_key, associate_tag,
+                       transport=None):
     return metadata_from_ean(ASIN,
                              access_key_id,
                              secret_access_key,
-                             associate_tag)
+                             associate_tag,
+                             transport)
+
+
+def metadata_from_ean(EAN, access_key_id, secret_access_key, associate_tag,
+                      transport=None):
+    credential = (access_key_id, secret_access_key, associate_tag)
+    return _metadata_from_ean(EAN, lambda: credential, transport)
+
+
+def metadata_from_ean_with_pool(EAN, credentials, transport=None):
+    '''
+    credentials (CredentialPool) の認証情報で EAN のメタデータを取得する．
+    認証情報はキャッシュに無かった場合だけ取り出すので，キャッシュにあれば回数の上限を使わない
+    '''
+    return _metadata_from_ean(EAN, credentials.acquire, transport)
+
+
+def _metadata_from_ean(EAN, acquire, transport):
+    params = item_lookup_params(EAN)
+    try:
+        content = cache.cached(
+            'amazon', item_lookup_cache_key(params),
+            lambda: item_lookup(params, *acquire(), transport=transport),
+            classify_item_lookup_content)
+    except:
+        return Metadata()
+    return metadata_from_item_lookup_content(content)
+
+
+_clients = {}
 
 
-def metadata_from_ean(EAN, access_key_id, secret_access_key, associate_tag):
+def client(access_key_id, secret_access_key, associate_tag):
+    '''認証情報ごとの bottlenose.Amazon (リクエストの署名に使う)'''
+    key = (str(access_key_id), str(secret_access_key), str(associate_tag))
+    amazon = _clients.get(key)
+    if amazon is None:
+        amazon = _clients[key] = bottlenose.Amazon(*key, Region='JP')
+    return amazon
+
+
+def item_lookup(params, access_key_id, secret_access_key, associate_tag,
+                transport=None):
+    transport = transport or get_transport()
+    # 署名にはタイムスタンプが含まれるので，送る直前に作る
+    # リトライやリクエスト数の制限はトランスポートが行う
+    url = client(access_key_id, secret_access_key,
+                 associate_tag).ItemLookup.api_url(**params)
+    return transport.get('amazon', url, credential=access_key_id)
+
+
+def item_lookup_params(EAN):
     EAN = EAN.replace('-', '')
     if re.match(r'^\d{9}(\d|X|x)$', EAN):
         EAN = isbn10to13(EAN)
+    return {
+        'ItemId': EAN,
+        'SearchIndex': 'Books',
+        'IdType': 'ISBN',
+        'ResponseGroup': 'EditorialReview,Images,ItemAttributes',
+    }
+
+
+def item_lookup_cache_key(params):
+    # 認証情報を含まないキー
+    return cache.make_key('ItemLookup', params)
+
+
+def item_lookup_url(EAN, access_key_id, secret_access_key, associate_tag):
+    '''署名済みの ItemLookup の URL を作成する (bottlenose 以外の HTTP クライアント用)'''
+    amazon = client(access_key_id, secret_access_key, associate_tag)
+    return amazon.ItemLookup.api_url(**item_lookup_params(EAN))
+
+
+# ItemLookup 1回で問い合わせられる ItemId の数
+MAX_ITEM_IDS = 10
 
-    # 十分 (だと思われる) 待ち時間を入れてもたまに失敗するねん ...
-    for i in range(3):
+
+class CredentialPool(object):
+    '''
+    複数の認証情報 (access_key_id, secret_access_key, associate_tag) を順に使う
+    リクエスト数の制限 (ratelimit) は認証情報ごとなので，すぐに使えるものを選ぶ．
+    daily_quota を指定すると，1日にその回数使った認証情報は翌日まで使わない
+    '''
+
+    def __init__(self, credentials, daily_quota=None):
+        self.credentials = [tuple(str(c) for c in credential)
+                            for credential in credentials]
+        self.daily_quota = daily_quota
+        self.usage = dict((credential[0], 0)
+                          for credential in self.credentials)
+        self._day = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def acquire(self):
+        '''次に使う認証情報を選ぶ．全て使い切っている場合は例外'''
+        with self._lock:
+            today = time.strftime('%Y-%m-%d', time.gmtime())
+            if today != self._day:
+                self._day = today
+                self.usage = dict((key, 0) for key in self.usage)
+            candidates = [
+                credential for credential in self.credentials
+                if (self.daily_quota is None or
+                    self.usage[credential[0]] < self.daily_quota)]
+            if not candidates:
+                raise QuotaExceededError('all Amazon credentials exhausted')
+            credential = min(candidates, key=self._wait_time)
+            self.usage[credential[0]] += 1
+            return credential
+
+    def _wait_time(self, credential):
+        bucket = ratelimit.limiter('amazon', credential[0])
+        return bucket.wait_time() if bucket is not None else 0
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+def metadata_from_eans(EANs, credentials, transport=None):
+    '''
+    複数の EAN のメタデータを，ItemLookup 1回あたり MAX_ITEM_IDS 件ずつまとめて取得する
+    credentials は CredentialPool か認証情報のリスト．
+    返り値は EAN (引数で与えたもの) からメタデータへの辞書
+    '''
+    if not isinstance(credentials, CredentialPool):
+        credentials = CredentialPool(credentials)
+    results = {}
+    pending = []
+    for EAN in EANs:
+        params = item_lookup_params(EAN)
+        content = cache.lookup('amazon', item_lookup_cache_key(params))
+        if content is not None:
+            results[EAN] = metadata_from_item_lookup_content(content)
+        else:
+            pending.append((EAN, params['ItemId']))
+
+    for i in range(0, len(pending), MAX_ITEM_IDS):
+        chunk = pending[i:i + MAX_ITEM_IDS]
+        item_ids = [item_id for _, item_id in chunk]
         try:
-            amazon = bottlenose.Amazon(str(access_key_id),
-                                       str(secret_access_key),
-                                       str(associate_tag), Region='JP')
-            root = objectify.fromstring(amazon.ItemLookup(
-                ItemId=EAN,
-                SearchIndex='Books',
-                IdType='ISBN',
-                ResponseGroup='EditorialReview,Images,ItemAttributes'))
-            break
+            content = item_lookup(batch_item_lookup_params(item_ids),
+                                  *credentials.acquire(), transport=transport)
+            contents = split_item_lookup_content(content, item_ids)
         except:
-            time.sleep(5)
-    else:
-        return Metadata()
+            for EAN, _ in chunk:
+                results[EAN] = Metadata()
+            continue
+        for EAN, item_id in chunk:
+            content = contents[item_id]
+            cache.store('amazon',
+                        item_lookup_cache_key(item_lookup_params(item_id)),
+                        content, classify_item_lookup_content)
+            results[EAN] = metadata_from_item_lookup_content(content)
+    return results
+
+
+def batch_item_lookup_params(item_ids):
+    params = item_lookup_params(item_ids[0])
+    params['ItemId'] = ','.join(item_ids)
+    return params
+
+
+def item_ids_from_item(item, namespace):
+    '''Item が指す書籍の ISBN13 (EAN) の集合'''
+    ids = set()
+    for tag in ('ItemAttributes/EAN',
+                'ItemAttributes/EANList/EANListElement',
+                'ItemAttributes/ISBN', 'ASIN'):
+        path = '/'.join('{%s}%s' % (namespace, t) for t in tag.split('/'))
+        for elem in item.findall(path):
+            value = (elem.text or '').strip()
+            if re.match(r'^\d{9}(\d|X|x)$', value):
+                value = isbn10to13(value)
+            ids.add(value)
+    return ids
+
+
+def split_item_lookup_content(content, item_ids):
+    '''
+    複数の ItemId をまとめて問い合わせた ItemLookup の結果 (XML) を，
+    ItemId ごとの (1件だけ問い合わせた場合と同じ形の) 結果に分ける
+    '''
+    root = lxml.etree.fromstring(content)
+    namespace = root.nsmap[None]
+    items_elem = root.find('{%s}Items' % namespace)
+    items = items_elem.findall('{%s}Item' % namespace)
+    for item in items:
+        items_elem.remove(item)
+    ids = [item_ids_from_item(item, namespace) for item in items]
+    contents = {}
+    for item_id in item_ids:
+        matched = [item for item, i in zip(items, ids) if item_id in i]
+        for item in matched:
+            items_elem.append(item)
+        contents[item_id] = lxml.etree.tostring(root, encoding='utf-8')
+        for item in matched:
+            items_elem.remove(item)
+    return contents
+
+
+def classify_item_lookup_content(content):
+    root = objectify.fromstring(content)
+    if hasattr(root.Items, 'Item'):
+        return cache.FOUND
+    return cache.NOT_FOUND
+
 
+def metadata_from_item_lookup_content(content):
+    '''ItemLookup の結果 (XML) からメタデータを作成する'''
+    root = objectify.fromstring(content)
     if not hasattr(root.Items, 'Item'):
         return Metadata()
 
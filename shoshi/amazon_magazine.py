@@ -100,11 +100,28 @@ $ # 行末
 '''
 
 
+MAGAZINE_REGEX = re.compile(MAGAZINE_PATTERN, re.U | re.VERBOSE)
+
+# MAGAZINE_PATTERN にマッチするタイトルは (NFKC で正規化した後に) 必ず "号" を含み，
+# "年" か "[雑誌]" のどちらかを含む．これらを含まないタイトル (ほとんどの書籍) は
+# 正規化も正規表現も使わずに弾く．
+# 正規化して "号" や "雑誌" になる文字は無く，"年" になるのは U+F98E だけ
+YEAR_CHARACTERS = ('年', '\uf98e')
+
+
+def is_magazine_title_candidate(title):
+    if '号' not in title:
+        return False
+    return '雑誌' in title or any(c in title for c in YEAR_CHARACTERS)
+
+
 def parse_magazine_title(title):
+    if not is_magazine_title_candidate(title):
+        return {}
     # 全角数字や全角括弧の取り扱いが面倒なので，
     # タイトルの文字列は事前に正規化しておく
     normalized_title = unicodedata.normalize('NFKC', title)
-    r = re.search(MAGAZINE_PATTERN, normalized_title, re.U | re.VERBOSE)
+    r = MAGAZINE_REGEX.search(normalized_title)
     if r is None:
         return {}
     d = r.groupdict()
@@ -120,3 +137,8 @@ def parse_magazine_title(title):
         if subtitle:
             metadata['subtitle'] = subtitle
     return metadata
+
+
+def parse_magazine_titles(titles):
+    '''複数のタイトルを解析し，parse_magazine_title の結果のリストを返す'''
+    return [parse_magazine_title(title) for title in titles]
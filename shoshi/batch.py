@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ISBN，EAN (JAN) や JPNO を 1 行に 1 つずつ並べたファイルのメタデータをまとめて取得する
+
+    % python -m shoshi --input identifiers.txt --jobs 8 > metadata.jsonl
+
+種類は行ごとに判定するので，ISBN と雑誌の JAN と JPNO が混ざっていてもよい．
+結果は終わったものから順に 1 行ずつ書き出す (順番は入力と一致しない):
+
+    {"input": "4-04-429204-3", "metadata": {...}}
+    {"input": "hoge", "error": "unrecognized identifier"}
+'''
+
+import re
+import sys
+import json
+import time
+from .util import isbn10to13, isbn13to10
+from .shoshi import metadata_from_isbn, metadata_from_ean, metadata_from_jpno
+from .shoshi import map_as_completed
+
+# 進捗を表示する間隔 (秒)
+PROGRESS_INTERVAL = 5
+
+
+def identifier_type(identifier):
+    '''
+    identifier の種類 ('isbn'，'ean'，'jpno') を返す．どれでもなければ None
+    ISBN10 はチェックディジットが正しいものだけ，JPNO は数字 8 桁とみなす
+    '''
+    identifier = re.sub(r'[-\s]', '', identifier).upper()
+    if re.match(r'^\d{9}[\dX]$', identifier):
+        if isbn13to10(isbn10to13(identifier)) == identifier:
+            return 'isbn'
+    elif re.match(r'^\d{13}$', identifier):
+        if identifier.startswith(('978', '979')):
+            return 'isbn'
+        return 'ean'
+    elif re.match(r'^\d{8}$', identifier):
+        return 'jpno'
+    return None
+
+
+def lookup(identifier,
+           amazon_auth_info=None,
+           rakuten_application_id=None,
+           use_wikipedia=False,
+           deadline=None,
+           kind=None):
+    '''
+    identifier の種類を判定してメタデータを取得する．判定できなければ ValueError
+    kind ('isbn'，'ean'，'jpno') を指定した場合は判定しない
+    '''
+    kind = kind or identifier_type(identifier)
+    identifier = re.sub(r'\s', '', identifier)
+    if kind == 'isbn':
+        return metadata_from_isbn(identifier, amazon_auth_info,
+                                  rakuten_application_id, use_wikipedia,
+                                  deadline)
+    elif kind == 'ean':
+        return metadata_from_ean(identifier, amazon_auth_info,
+                                 rakuten_application_id, use_wikipedia,
+                                 deadline)
+    elif kind == 'jpno':
+        return metadata_from_jpno(identifier, amazon_auth_info,
+                                  rakuten_application_id, use_wikipedia)
+    raise ValueError('unrecognized identifier')
+
+
+def _lookup_json(identifier, include_none_value_field, kwargs):
+    # JSON への変換も問い合わせと同じスレッドで行う
+    return lookup(identifier, **kwargs).tojson(include_none_value_field)
+
+
+def read_identifiers(lines):
+    '''空行と # で始まる行を除き，前後の空白を取り除いた行を返す'''
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def iter_results(identifiers, jobs=4, include_none_value_field=False,
+                 **kwargs):
+    '''
+    identifiers のメタデータを jobs 件ずつ同時に取得し，終わったものから順に
+    (識別子, メタデータの JSON, エラーのメッセージ) を返す (JSON とエラーのどちらかは None)．
+    kwargs は lookup に渡す
+    '''
+    # 1件の失敗で全体を止めないように，例外はエラーのメッセージにする
+    for identifier, content, error in map_as_completed(
+            _lookup_json, identifiers, jobs, include_none_value_field, kwargs):
+        if error is not None:
+            error = str(error) or type(error).__name__
+        yield identifier, content, error
+
+
+def format_result(identifier, content, error):
+    '''iter_results の結果を JSON Lines の 1 行にする'''
+    if error is None:
+        return '{{"input": {0}, "metadata": {1}}}\n'.format(
+            json.dumps(identifier, ensure_ascii=False), content)
+    return json.dumps({'input': identifier, 'error': error},
+                      ensure_ascii=False) + '\n'
+
+
+def run_batch(lines, output, jobs=4, include_none_value_field=False,
+              progress=None, **kwargs):
+    '''
+    lines の各識別子のメタデータを jobs 件ずつ同時に取得し，output に JSON Lines で書き出す．
+    progress (ファイル) を渡すと PROGRESS_INTERVAL 秒ごとに進捗を書き出す．
+    kwargs は lookup に渡す．返り値は (書き出した件数, そのうちエラーの件数)
+    '''
+    count = 0
+    errors = 0
+    started_at = reported_at = time.monotonic()
+    for identifier, content, error in iter_results(
+            read_identifiers(lines), jobs, include_none_value_field,
+            **kwargs):
+        if error is not None:
+            errors += 1
+        output.write(format_result(identifier, content, error))
+        output.flush()
+        count += 1
+        now = time.monotonic()
+        if progress is not None and now - reported_at >= PROGRESS_INTERVAL:
+            reported_at = now
+            print('{0} records ({1} errors), {2:.1f} records/s'.format(
+                count, errors, count / (now - started_at)), file=progress)
+    return count, errors
+
+
+def main(args, amazon_auth_info=None, rakuten_application_id=None):
+    '''__main__ の --input の処理．エラーがあれば 1 を返す'''
+    lines = sys.stdin if args.input == '-' else open(args.input,
+                                                     encoding='utf-8')
+    try:
+        count, errors = run_batch(
+            lines, sys.stdout, args.jobs, args.include_none_value_field,
+            progress=sys.stderr,
+            amazon_auth_info=amazon_auth_info,
+            rakuten_application_id=rakuten_application_id,
+            use_wikipedia=args.use_wikipedia,
+            deadline=args.deadline)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+    print('{0} records ({1} errors)'.format(count, errors), file=sys.stderr)
+    return 1 if errors else 0
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+各 API のレスポンス (加工前のバイト列) のキャッシュ
+
+キャッシュはデフォルトでは無効．set_cache で有効にする:
+
+    from shoshi import cache
+    cache.set_cache(cache.SQLiteCache('~/.cache/shoshi.sqlite3'))
+
+SQLite のファイルは同じホスト上の複数のプロセスから共有できる．
+"見つからなかった" という結果 (楽天の count == 0 など) も，
+通常より短い期間だけキャッシュする．
+
+統合済みのメタデータをプロセス内に保持する MetadataCache もある:
+
+    cache.set_metadata_cache(cache.MetadataCache(maxsize=10000, ttl=3600))
+'''
+
+import os
+import copy
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+# 保存期間 (秒)
+DAY = 24 * 60 * 60
+DEFAULT_TTLS = {
+    'ndl': 30 * DAY,
+    'amazon': 1 * DAY,
+    'rakuten': 1 * DAY,
+    'wikipedia': 7 * DAY,
+}
+DEFAULT_TTL = 1 * DAY
+# "見つからなかった" という結果の保存期間 (秒)
+# 発売前の書籍などは後から登録されるので短めにしておく
+DEFAULT_NEGATIVE_TTLS = {}
+DEFAULT_NEGATIVE_TTL = 60 * 60
+
+# classify の返り値
+FOUND = 'found'
+NOT_FOUND = 'not_found'
+
+
+def make_key(url, params=None, exclude=()):
+    '''URL とパラメータからキャッシュのキーを作る．exclude に含まれるパラメータ (認証情報など) は無視する'''
+    if not params:
+        return url
+    pairs = sorted((k, v) for k, v in params.items()
+                   if k not in exclude and v is not None)
+    return url + '?' + urlencode(pairs)
+
+
+class Cache(object):
+    '''キャッシュのインターフェイス．別のバックエンドを使う場合はこれを継承する'''
+
+    def get(self, source, key):
+        '''キャッシュされたレスポンスを返す．無い (または期限切れの) 場合は None'''
+        raise NotImplementedError
+
+    def set(self, source, key, payload, negative=False):
+        raise NotImplementedError
+
+
+class SQLiteCache(Cache):
+    def __init__(self, path, ttls=None, negative_ttls=None):
+        self.path = os.path.expanduser(path)
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.negative_ttls = dict(DEFAULT_NEGATIVE_TTLS,
+                                  **(negative_ttls or {}))
+        # sqlite3 の接続はスレッド間で共有できないので，スレッドごとに作る
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            # 読み込みと書き込みを別プロセスから同時に行えるようにする
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' source TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' payload BLOB NOT NULL,'
+                ' negative INTEGER NOT NULL,'
+                ' stored_at REAL NOT NULL,'
+                ' PRIMARY KEY (source, key))')
+            self._local.connection = connection
+        return connection
+
+    def ttl(self, source, negative=False):
+        if negative:
+            return self.negative_ttls.get(source, DEFAULT_NEGATIVE_TTL)
+        return self.ttls.get(source, DEFAULT_TTL)
+
+    def get(self, source, key):
+        row = self._connect().execute(
+            'SELECT payload, negative, stored_at FROM responses'
+            ' WHERE source = ? AND key = ?', (source, key)).fetchone()
+        if row is None:
+            return None
+        payload, negative, stored_at = row
+        if time.time() - stored_at > self.ttl(source, bool(negative)):
+            return None
+        return bytes(payload)
+
+    def set(self, source, key, payload, negative=False):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        self._connect().execute(
+            'INSERT OR REPLACE INTO responses'
+            ' (source, key, payload, negative, stored_at)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (source, key, payload, int(negative), time.time()))
+
+    def purge(self):
+        '''期限切れのレスポンスを削除する'''
+        now = time.time()
+        connection = self._connect()
+        for source, negative in connection.execute(
+                'SELECT DISTINCT source, negative FROM responses').fetchall():
+            connection.execute(
+                'DELETE FROM responses'
+                ' WHERE source = ? AND negative = ? AND stored_at < ?',
+                (source, negative, now - self.ttl(source, bool(negative))))
+
+
+_cache = None
+
+
+def get_cache():
+    return _cache
+
+
+def set_cache(cache):
+    '''各 API のレスポンスを cache に保存するようにする．None を渡すと無効になる'''
+    global _cache
+    _cache = cache
+
+
+def lookup(source, key):
+    '''キャッシュされたレスポンスを返す．無い場合やキャッシュが無効な場合は None'''
+    cache = _cache
+    if cache is None:
+        return None
+    return cache.get(source, key)
+
+
+def store(source, key, payload, classify=None):
+    '''payload を保存する (キャッシュが無効な場合は何もしない)'''
+    cache = _cache
+    if cache is not None:
+        _store(cache, source, key, payload, classify)
+
+
+def _store(cache, source, key, payload, classify):
+    status = classify(payload) if classify else FOUND
+    if status in (FOUND, NOT_FOUND):
+        cache.set(source, key, payload, negative=(status == NOT_FOUND))
+
+
+def cached(source, key, fetch, classify=None):
+    '''
+    キャッシュにあればそれを返し，無ければ fetch() の結果を保存して返す
+    classify(payload) は FOUND か NOT_FOUND を返す．
+    それ以外 (エラーなど) を返した場合は保存しない
+    '''
+    cache = _cache
+    if cache is None:
+        return fetch()
+    payload = cache.get(source, key)
+    if payload is not None:
+        return payload
+    payload = fetch()
+    _store(cache, source, key, payload, classify)
+    return payload
+
+
+# SQLiteCache はロックの解放を待つ間ブロックするので，asyncio 版ではスレッドプールで読み書きする
+# (イベントループを止めると，実行中の他の問い合わせも全て止まる)
+
+async def _run_in_executor(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def lookup_async(source, key):
+    '''lookup の asyncio 版'''
+    cache = _cache
+    if cache is None:
+        return None
+    return await _run_in_executor(cache.get, source, key)
+
+
+async def store_async(source, key, payload, classify=None):
+    '''store の asyncio 版'''
+    cache = _cache
+    if cache is not None:
+        await _run_in_executor(_store, cache, source, key, payload, classify)
+
+
+async def cached_async(source, key, fetch, classify=None):
+    '''cached の asyncio 版．fetch はコルーチンを返す関数'''
+    cache = _cache
+    if cache is None:
+        return await fetch()
+    payload = await _run_in_executor(cache.get, source, key)
+    if payload is not None:
+        return payload
+    payload = await fetch()
+    await _run_in_executor(_store, cache, source, key, payload, classify)
+    return payload
+
+
+class MetadataCache(object):
+    '''
+    統合済みのメタデータ (Metadata) の LRU キャッシュ
+    maxsize 件を超えると最も古く使われたものから，ttl 秒を過ぎたものは次の参照時に捨てる．
+    merge() は引数を書き換えるので，出し入れの際はコピーを渡す
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, metadata = entry
+                if self.ttl is not None and time.time() - stored_at > self.ttl:
+                    del self._entries[key]
+                    self.evictions += 1
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(metadata)
+
+    def set(self, key, metadata):
+        metadata = copy.deepcopy(metadata)
+        with self._lock:
+            self._entries[key] = (time.time(), metadata)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache():
+    return _metadata_cache
+
+
+def set_metadata_cache(metadata_cache):
+    '''shoshi.metadata_from_ean などの結果を metadata_cache に保持する．None を渡すと無効になる'''
+    global _metadata_cache
+    _metadata_cache = metadata_cache
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+国立国会図書館の DC-NDL (RDF/XML) の一括ダウンロード用のファイルを読み込み，
+書誌ごとのメタデータを JSON Lines で書き出す (API には問い合わせない)
+
+    % python -m shoshi ingest-ndl dump.xml.gz --output catalog.jsonl
+'''
+
+import bz2
+import sys
+import gzip
+import argparse
+from . import ndl
+from .metadata import write_jsonl
+
+
+def open_dump(path):
+    '''.gz と .bz2 は展開しながら読む．'-' は標準入力'''
+    if path == '-':
+        return sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def ingest_ndl(paths, output, include_none_value_field=False):
+    '''paths の各ファイルの書誌を output に 1 行ずつ書き出し，書き出した件数を返す'''
+    count = 0
+    for path in paths:
+        f = open_dump(path)
+        try:
+            count += write_jsonl(ndl.iter_metadata_from_rdf_dump(f), output,
+                                 include_none_value_field)
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m shoshi ingest-ndl',
+        description='convert NDL DC-NDL RDF/XML dumps to JSON Lines')
+    parser.add_argument('paths', nargs='+', metavar='DUMP',
+                        help='RDF/XML file (.gz and .bz2 are decompressed, '
+                             '- reads stdin)')
+    parser.add_argument('--output', action="store", dest="output",
+                        default='-', help='JSONL file to write (default: stdout)')
+    parser.add_argument('--include-null-value-field', action='store_true',
+                        default=False, dest='include_none_value_field')
+    args = parser.parse_args(argv)
+
+    if args.output == '-':
+        count = ingest_ndl(args.paths, sys.stdout,
+                           args.include_none_value_field)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            count = ingest_ndl(args.paths, output,
+                               args.include_none_value_field)
+    print('{0} records'.format(count), file=sys.stderr)
+    return 0
@@ -1,38 +1,103 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import json
+
+
+def snake2camel(snake_str):
+    components = snake_str.split('_')
+    return components[0] + "".join(x.title() for x in components[1:])
+
+
+class Record(object):
+    '''
+    メタデータの各クラスの基底クラス
+    属性は __slots__ で宣言し (インスタンスごとの __dict__ を持たない)，
+    同じクラスで属性の値が全て等しければ等しいとみなす
+    '''
+    __slots__ = ()
+    # None の場合は include_none_value_field に関係なく todict などで出力しない属性
+    _omit_none = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # todict などで使う (属性名, キー) の表はクラスを作るときに一度だけ作る
+        cls._keys = {
+            True: tuple((name, snake2camel(name)) for name in cls.__slots__),
+            False: tuple((name, name) for name in cls.__slots__),
+        }
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash((type(self).__name__, _hashable(self._values())))
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+def _hashable(value):
+    # リストや辞書を含む属性もハッシュできるようにする
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return frozenset((k, _hashable(v)) for k, v in value.items())
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class Title(Record):
+    __slots__ = ('name', 'transcription', 'parallels', 'related_information')
 
-class Title(object):
     def __init__(self, name, transcription=None,
-                 parallels=[], related_information=[]):
+                 parallels=None, related_information=None):
         self.name = name
         self.transcription = transcription
-        self.parallels = parallels
-        self.related_information = related_information
+        self.parallels = [] if parallels is None else parallels
+        self.related_information = ([] if related_information is None
+                                    else related_information)
+
 
+class TitleElement(Record):
+    __slots__ = ('name', 'transcription', 'parallels')
 
-class TitleElement(object):
-    def __init__(self, name, transcription=None, parallels=[]):
+    def __init__(self, name, transcription=None, parallels=None):
         self.name = name
         self.transcription = transcription
-        self.parallels = parallels
+        self.parallels = [] if parallels is None else parallels
+
 
+class Publisher(Record):
+    __slots__ = ('name', 'transcription', 'location')
 
-class Publisher(object):
     def __init__(self, name, transcription=None, location=None):
         self.name = name
         self.transcription = transcription
         self.location = location
 
 
-class Volume(object):
+class Volume(Record):
+    __slots__ = ('name', 'transcription', 'title')
+
     def __init__(self, name, transcription=None, title=None):
         self.name = name
         self.transcription = transcription
         self.title = title
 
 
-class Creator(object):
+class Creator(Record):
+    __slots__ = ('name', 'transcription', 'role',
+                 'date_of_birth', 'date_of_death')
+
     def __init__(self,
                  name,
                  transcription=None,
@@ -46,78 +111,142 @@ class Creator(object):
         self.date_of_death = date_of_death
 
 
-class Content(object):
-    def __init__(self, title, creators=[]):
+class Content(Record):
+    __slots__ = ('title', 'creators')
+
+    def __init__(self, title, creators=None):
         self.title = title
-        self.creators = creators
+        self.creators = [] if creators is None else creators
+
 
+class Series(Record):
+    __slots__ = ('title', 'number')
 
-class Series(object):
     def __init__(self, title, number=None):
         self.title = title
         self.number = number
 
 
-class Metadata(object):
+class Metadata(Record):
+    # 省略したリストや辞書の属性は，インスタンスごとに新しく作る
+    # (デフォルト引数のリストを共有すると，merge などで書き換えた内容が他の書誌に漏れる)
+    __slots__ = ('title', 'volume', 'series', 'publishers', 'creators',
+                 'contents', 'identifiers', 'description', 'tags',
+                 'thumbnails', 'price', 'published_date', 'page_count',
+                 'links', 'missing_sources')
+    # missing_sources は締め切りを指定した場合だけ出力する (それ以外の出力は変えない)
+    _omit_none = frozenset(['missing_sources'])
+
     def __init__(self,
                  title=None,
                  volume=None,
-                 series=[],
-                 publishers=[],
-                 creators=[],
-                 contents=[],
-                 identifiers={},
+                 series=None,
+                 publishers=None,
+                 creators=None,
+                 contents=None,
+                 identifiers=None,
                  description=None,
-                 tags=[],
-                 thumbnails={},
+                 tags=None,
+                 thumbnails=None,
                  price=None,
                  published_date=None,
                  page_count=None,
-                 links=[]):
+                 links=None,
+                 missing_sources=None):
         self.title = title
         self.volume = volume
-        self.series = series
-        self.publishers = publishers
-        self.creators = creators
-        self.contents = contents
-        self.identifiers = identifiers
+        self.series = [] if series is None else series
+        self.publishers = [] if publishers is None else publishers
+        self.creators = [] if creators is None else creators
+        self.contents = [] if contents is None else contents
+        self.identifiers = {} if identifiers is None else identifiers
         self.description = description
-        self.tags = tags
-        self.thumbnails = thumbnails
+        self.tags = [] if tags is None else tags
+        self.thumbnails = {} if thumbnails is None else thumbnails
         self.price = price
         self.published_date = published_date
         self.page_count = page_count
-        self.links = links
+        self.links = [] if links is None else links
+        # 締め切り (deadline) までに結果が得られなかった API の名前
+        self.missing_sources = missing_sources
 
     def todict(self, include_none_value_field=True, to_camel_case=True):
         return object2dict(self, include_none_value_field, to_camel_case)
 
+    def tojson(self, include_none_value_field=True, to_camel_case=True):
+        '''json.dumps(self.todict(...), ensure_ascii=False) と同じ文字列を返す'''
+        return object2json(self, include_none_value_field, to_camel_case)
+
+
+# 辞書 (identifiers など) のキーの camelCase
+_camel_keys = {}
+
+
+def _camel_key(key):
+    camel = _camel_keys.get(key)
+    if camel is None:
+        camel = _camel_keys[key] = snake2camel(key)
+    return camel
 
-def snake2camel(snake_str):
-    components = snake_str.split('_')
-    return components[0] + "".join(x.title() for x in components[1:])
+
+# 変換せずにそのまま使える値の型
+_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
 
 
 def object2dict(o, include_none_value_field, to_camel_case):
-    if hasattr(o, '__dict__'):
-        return object2dict(o.__dict__,
-                           include_none_value_field,
-                           to_camel_case)
+    '''
+    o を辞書やリストにする．Record はクラスごとに作っておいた (属性名, キー) の表を引き，
+    値が None の属性は辞書を作りながら除く (作った後に消したりはしない)
+    '''
+    if type(o) in _SCALAR_TYPES:
+        return o
+    if isinstance(o, Record):
+        d = {}
+        for name, key in o._keys[to_camel_case]:
+            value = getattr(o, name)
+            if value is None:
+                if include_none_value_field and name not in o._omit_none:
+                    d[key] = None
+            elif type(value) in _SCALAR_TYPES:
+                d[key] = value
+            else:
+                d[key] = object2dict(value, include_none_value_field,
+                                     to_camel_case)
+        return d
     elif isinstance(o, (list, set)):
         return [object2dict(item, include_none_value_field, to_camel_case)
                 for item in o]
     elif isinstance(o, dict):
-        pairs = []
-        for key in o:
-            value = object2dict(o[key], include_none_value_field, to_camel_case)
+        d = {}
+        for key, value in o.items():
+            if value is None and not include_none_value_field:
+                continue
             if to_camel_case:
-                key = snake2camel(key)
-            pairs.append((key, value))
-        d = dict(pairs)
-        if not include_none_value_field:
-            delete_keys = [k for k in d if d[k] is None]
-            for k in delete_keys:
-                d.pop(k)
+                key = _camel_key(key)
+            d[key] = object2dict(value, include_none_value_field,
+                                 to_camel_case)
         return d
-    else:
-        return o
+    return o
+
+
+def object2json(o, include_none_value_field=True, to_camel_case=True):
+    '''json.dumps(object2dict(o, ...), ensure_ascii=False) と同じ文字列を返す'''
+    return _encode(object2dict(o, include_none_value_field, to_camel_case))
+
+
+# json.dumps(..., ensure_ascii=False) と同じ設定のエンコーダ．呼び出しごとに作らない
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def write_jsonl(records, fp, include_none_value_field=True):
+    '''
+    records (イテレータでもよい) の各メタデータを 1 行ずつ fp に書き出し，書き出した件数を返す．
+    全件の辞書やリストを作ってから書くのではなく，1 件ずつ変換して書く
+    '''
+    count = 0
+    for metadata in records:
+        fp.write(_encode(object2dict(metadata, include_none_value_field,
+                                     True)))
+        fp.write('\n')
+        count += 1
+    return count
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+1件ずつの問い合わせを，API ごとにまとめて 1 回のリクエストにする (マイクロバッチ)
+
+Amazon の ItemLookup は ItemId を 10 件まで，NDL の SRU は OR でつないだ検索を，
+Wikipedia は titles=A|B|C を受け付ける．
+同時に来た metadata_from_ean の呼び出しを API ごとに window 秒 (または上限の件数まで) 溜め，
+まとめて問い合わせた結果をそれぞれの呼び出し元に返す．
+1件あたり数ミリ秒遅くなる代わりに，混んでいる時の API へのリクエスト数が減る．
+
+    from shoshi import microbatch
+    microbatch.set_scheduler(microbatch.Scheduler(window=0.005))
+'''
+
+import copy
+import threading
+from concurrent.futures import Future
+from . import amazon, ndl, wikipedia
+
+
+class _Batch(object):
+    def __init__(self):
+        self.futures = {}
+        # 2 番目以降の呼び出し元がいるキー
+        self.shared = set()
+        self.full = False
+
+
+class Batcher(object):
+    '''
+    call(key) を window 秒か max_size 種類のキーが集まるまで溜め，func(keys) 1回で処理する．
+    func は keys の各要素をキーとする辞書を返す．
+    最初に来た呼び出し元のスレッドが待って func を呼ぶので，専用のスレッドは作らない．
+    同じキーの 2 番目以降の呼び出し元には，copy を渡していれば copy(result) を返す
+    (複製の元は最初の呼び出し元に返す前に作っておくので，最初の呼び出し元が書き換えても影響しない)．
+    func の結果に無いキーの呼び出し元には KeyError を送出する
+    '''
+
+    def __init__(self, func, max_size, window=0.005, copy=None):
+        self.func = func
+        self.max_size = max_size
+        self.window = window
+        self.copy = copy
+        self.calls = 0
+        self.batches = 0
+        self._batch = _Batch()
+        self._condition = threading.Condition()
+
+    def call(self, key):
+        with self._condition:
+            self.calls += 1
+            batch = self._batch
+            leader = not batch.futures
+            future = batch.futures.get(key)
+            first = future is None
+            if first:
+                future = batch.futures[key] = Future()
+            else:
+                batch.shared.add(key)
+            if len(batch.futures) >= self.max_size:
+                # 一杯になったら次の呼び出しからは新しいバッチに入れ，先頭の呼び出し元を起こす
+                batch.full = True
+                self._batch = _Batch()
+                self._condition.notify_all()
+            if leader:
+                self._condition.wait_for(lambda: batch.full, self.window)
+                if self._batch is batch:
+                    self._batch = _Batch()
+                self.batches += 1
+        if leader:
+            self._run(batch)
+        result, shared = future.result()
+        if first or self.copy is None:
+            return result
+        return self.copy(shared)
+
+    def _run(self, batch):
+        # 先頭の呼び出し元が起きた後はこのバッチに呼び出し元は増えない
+        keys = list(batch.futures)
+        try:
+            results = self.func(keys)
+            for key, future in batch.futures.items():
+                if key not in results:
+                    future.set_exception(KeyError(key))
+                    continue
+                result = results[key]
+                shared = result
+                if self.copy is not None and key in batch.shared:
+                    shared = self.copy(result)
+                future.set_result((result, shared))
+        except BaseException as e:
+            # どの呼び出し元も待ち続けないように，残りは全て例外にする
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+    def stats(self):
+        return {'calls': self.calls, 'batches': self.batches}
+
+
+class Scheduler(object):
+    '''
+    API ごと (とトランスポートや認証情報ごと) の Batcher を持つ
+    NDL は SRU を使う設定 (ndl.set_api('sru')) の場合だけまとめる
+    '''
+
+    def __init__(self, window=0.005):
+        self.window = window
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def _batcher(self, key, func, max_size):
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            with self._lock:
+                batcher = self._batchers.get(key)
+                if batcher is None:
+                    batcher = self._batchers[key] = Batcher(
+                        func, max_size, self.window, copy.deepcopy)
+        return batcher
+
+    def ndl_metadata_from_isbn(self, isbn, transport=None):
+        if ndl.get_api() != 'sru':
+            return ndl.metadata_from_isbn(isbn, transport)
+        batcher = self._batcher(
+            ('ndl', transport),
+            lambda isbns: ndl.metadata_from_isbns_via_sru(isbns, transport),
+            ndl.MAX_SRU_QUERY_ITEMS)
+        return batcher.call(isbn)
+
+    def amazon_metadata_from_ean(self, ean, amazon_auth_info, transport=None):
+        # amazon_auth_info は認証情報か amazon.CredentialPool
+        if isinstance(amazon_auth_info, amazon.CredentialPool):
+            credentials = amazon_auth_info
+            key = ('amazon', transport, id(credentials))
+        else:
+            credentials = [amazon_auth_info]
+            key = ('amazon', transport, tuple(amazon_auth_info))
+        batcher = self._batcher(
+            key,
+            lambda eans: amazon.metadata_from_eans(eans, credentials,
+                                                   transport),
+            amazon.MAX_ITEM_IDS)
+        return batcher.call(ean)
+
+    def wikipedia_find_series_info(self, isbn, transport=None):
+        batcher = self._batcher(
+            ('wikipedia', transport),
+            lambda isbns: wikipedia.find_series_infos(isbns, transport),
+            wikipedia.MAX_TITLES)
+        return batcher.call(isbn)
+
+    def stats(self):
+        '''API ごとの呼び出しの数とまとめて問い合わせた回数'''
+        stats = {}
+        for key, batcher in list(self._batchers.items()):
+            counts = stats.setdefault(key[0], {'calls': 0, 'batches': 0})
+            for name, value in batcher.stats().items():
+                counts[name] += value
+        return stats
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    '''shoshi.metadata_from_ean などが scheduler を通して各 API に問い合わせるようにする．None で無効'''
+    global _scheduler
+    _scheduler = scheduler
@@ -2,21 +2,102 @@
 # -*- coding: utf-8 -*-
 
 import re
-import requests
+import copy
+import itertools
+import lxml.etree
 import lxml.objectify
+from . import cache
+from .transport import get_transport
 from .metadata import Metadata, Title, TitleElement, Creator
 from .metadata import Publisher, Series, Volume, Content
 from .util import isbn13to10, isbn10to13, normalize
 
 
+NAMESPACES = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'dcterms': 'http://purl.org/dc/terms/',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'dcndl': 'http://ndl.go.jp/dcndl/terms/',
+    'foaf': 'http://xmlns.com/foaf/0.1/',
+}
+
+# lxml.objectify と同じく要素間の空白を取り除く
+RDF_PARSER = lxml.etree.XMLParser(remove_blank_text=True)
+
+
+def _xpath(path):
+    return lxml.etree.XPath(path, namespaces=NAMESPACES)
+
+
+def _tag(name):
+    prefix, local_name = name.split(':')
+    return '{{{0}}}{1}'.format(NAMESPACES[prefix], local_name)
+
+
+# 書誌 1 件につき各 XPath を 1 回ずつ評価する
+_TAGS = _xpath('//dcterms:subject/rdf:Description/rdf:value/text()')
+_LINKS = _xpath('//dcndl:BibAdminResource/@rdf:about')
+_DATES = _xpath('//dcterms:date//text()')
+_PRICES = _xpath('//dcndl:price//text()')
+_EXTENTS = _xpath('//dcterms:extent//text()')
+_TITLE_VALUES = _xpath('dcndl:BibResource/dc:title/rdf:Description/rdf:value')
+_DCTERMS_TITLES = _xpath('dcndl:BibResource/dcterms:title')
+_TITLE_TRANSCRIPTIONS = _xpath(
+    'dcndl:BibResource/dc:title/rdf:Description/dcndl:transcription')
+_PUBLISHERS = _xpath('dcndl:BibResource/dcterms:publisher/foaf:Agent')
+_VOLUME_VALUES = _xpath(
+    'dcndl:BibResource/dcndl:volume/rdf:Description/rdf:value')
+_VOLUME_TRANSCRIPTIONS = _xpath(
+    'dcndl:BibResource/dcndl:volume/rdf:Description/dcndl:transcription')
+_DCTERMS_CREATORS = _xpath('dcndl:BibResource/dcterms:creator')
+_DC_CREATORS = _xpath('dcndl:BibResource/dc:creator/text()')
+_SERIES_DESCRIPTIONS = _xpath(
+    'dcndl:BibResource/dcndl:seriesTitle/rdf:Description')
+_PART_DESCRIPTIONS = _xpath('//dcndl:partInformation//rdf:Description')
+_PART_CREATORS = _xpath('dc:creator/text()')
+_ISBNS = _xpath('//dcterms:identifier'
+                '[@rdf:datatype="http://ndl.go.jp/dcndl/terms/ISBN"]//text()')
+_JPNOS = _xpath('//dcterms:identifier'
+                '[@rdf:datatype="http://ndl.go.jp/dcndl/terms/JPNO"]//text()')
+_ALTERNATIVES = _xpath(
+    'dcndl:BibResource/dcndl:alternative/rdf:Description/rdf:value/text()')
+_DESCRIPTIONS = _xpath('dcndl:BibResource/dcterms:description/text()')
+
+_RDF = _tag('rdf:RDF')
+_BIB_RESOURCE = _tag('dcndl:BibResource')
+_BIB_ADMIN_RESOURCE = _tag('dcndl:BibAdminResource')
+_RDF_VALUE = _tag('rdf:value')
+_DCTERMS_TITLE = _tag('dcterms:title')
+_DCNDL_TRANSCRIPTION = _tag('dcndl:transcription')
+_DCNDL_LOCATION = _tag('dcndl:location')
+_FOAF_NAME = _tag('foaf:name')
+
+# lxml.objectify では数値や真偽値として解釈できるテキストの要素は "0" などが偽になる
+_FALSY_TEXT_PATTERN = re.compile(r'\s*[+-]?(?:0+\.?0*|\.0+)\s*|false')
+
+
+def _first_text(nodes, default=None):
+    return nodes[0].text if nodes else default
+
+
+def _is_true_text(text):
+    return bool(text) and _FALSY_TEXT_PATTERN.fullmatch(text) is None
+
+
 def create_metadata_from_xml_root(root):
+    # 複数の項目で使うものは 1 度だけ取り出す
+    descriptions = descriptions_from_root(root)
+    alternatives = alternatives_from_root(root)
+    dcterms_creators = index_dcterms_creators(
+        create_dcterms_creators_from_root(root))
     return Metadata(
-        title=create_title_from_root(root),
-        volume=create_volume_from_root(root),
-        creators=create_creators_from_root(root),
-        series=create_series_from_root(root),
+        title=create_title_from_root(root, descriptions, alternatives),
+        volume=create_volume_from_root(root, descriptions, alternatives),
+        creators=create_creators_from_root(root, descriptions,
+                                           dcterms_creators),
+        series=create_series_from_root(root, descriptions, alternatives),
         publishers=create_publishers_from_root(root),
-        contents=create_contents_from_root(root),
+        contents=create_contents_from_root(root, dcterms_creators),
         identifiers=create_identifiers_from_root(root),
         price=price_from_root(root),
         page_count=page_count_from_root(root),
@@ -27,55 +108,47 @@ def create_metadata_from_xml_root(root):
 
 def tags_from_root(root):
     tags = []
-    for sub in root.xpath('//dcterms:subject/rdf:Description/rdf:value/text()',
-                          namespaces=root.nsmap):
+    for sub in _TAGS(root):
         tags.extend(sub.split('--'))
     return tags
 
 
 def links_from_root(root):
-    return root.xpath('//dcndl:BibAdminResource/@rdf:about', namespaces=root.nsmap)
+    return _LINKS(root)
 
 
 def published_date_from_root(root):
-    for d in root.xpath('//dcterms:date//text()', namespaces=root.nsmap):
+    for d in _DATES(root):
         if re.match(r'(\d+)(.\d+)*', d):
             return '-'.join(x for x in re.split(r'\D+', d) if d)
     return None
 
 
 def price_from_root(root):
-    prices = root.xpath('//dcndl:price//text()', namespaces=root.nsmap)
+    prices = _PRICES(root)
     if len(prices) == 0:
         return None
     return normalize(re.sub(r'\D', '', prices[0])) if len(prices) != 0 else None
 
 
 def page_count_from_root(root):
-    for es in root.xpath('//dcterms:extent//text()', namespaces=root.nsmap):
+    for es in _EXTENTS(root):
         for e in es.split(' ; '):
             if re.match(r'\d+p', e):
                 return re.sub(r'\D', '', e)
     return None
 
 
-def create_title_from_root(root):
-    title_value_elem = root.find(
-        'dcndl:BibResource/dc:title/rdf:Description/rdf:value', root.nsmap)
-    title_value_elem = (title_value_elem if title_value_elem is not None
-                        else root.find('dcndl:BibResource/dcterms:title',
-                                       root.nsmap))
-    title_value = title_value_elem.text if title_value_elem is not None else ''
-    title_transcription_elem = root.find(
-        'dcndl:BibResource/dc:title/rdf:Description/dcndl:transcription',
-        root.nsmap)
-    title_transcription = (title_transcription_elem.text
-                           if title_transcription_elem is not None else '')
+def create_title_from_root(root, descriptions=None, alternatives=None):
+    title_value = _first_text(_TITLE_VALUES(root) or _DCTERMS_TITLES(root), '')
+    title_transcription = _first_text(_TITLE_TRANSCRIPTIONS(root), '')
     title = create_title_from_strings(title_value, title_transcription)
 
-    parallel_candidates = (alternatives_from_root(root) +
-                           descriptions_from_root(root))
-    for p in parallel_candidates:
+    if descriptions is None:
+        descriptions = descriptions_from_root(root)
+    if alternatives is None:
+        alternatives = alternatives_from_root(root)
+    for p in alternatives + descriptions:
         if p.startswith('並列タイトル:') or p.startswith('原タイトル:'):
             for parallel in map(str.strip, p.split(':')[1:]):
                 if parallel not in title.parallels:
@@ -85,11 +158,10 @@ def create_title_from_root(root):
 
 def create_publishers_from_root(root):
     publishers = []
-    for agent in root.xpath('dcndl:BibResource/dcterms:publisher/foaf:Agent',
-                            namespaces=root.nsmap):
-        name_elem = agent.find('foaf:name', root.nsmap)
-        transcription_elem = agent.find('dcndl:transcription', root.nsmap)
-        location_elem = agent.find('dcndl:location', root.nsmap)
+    for agent in _PUBLISHERS(root):
+        name_elem = agent.find(_FOAF_NAME)
+        transcription_elem = agent.find(_DCNDL_TRANSCRIPTION)
+        location_elem = agent.find(_DCNDL_LOCATION)
         name = name_elem.text if name_elem is not None else None
         transcription = (transcription_elem.text
                          if transcription_elem is not None else None)
@@ -102,20 +174,17 @@ def create_publishers_from_root(root):
     return publishers
 
 
-def create_volume_from_root(root):
-    volume_value_elem = root.find(
-        'dcndl:BibResource/dcndl:volume/rdf:Description/rdf:value',
-        root.nsmap)
-    value = volume_value_elem.text if volume_value_elem is not None else ''
-    volume_transcription_elem = root.find(
-        'dcndl:BibResource/dcndl:volume/rdf:Description/dcndl:transcription',
-        root.nsmap)
-    transcription = (volume_transcription_elem.text
-                     if volume_transcription_elem is not None else '')
+def create_volume_from_root(root, descriptions=None, alternatives=None):
+    value = _first_text(_VOLUME_VALUES(root), '')
+    transcription = _first_text(_VOLUME_TRANSCRIPTIONS(root), '')
     volume = create_volume_from_strings(value, transcription)
 
     if volume and volume.title:
-        for p in descriptions_from_root(root) + alternatives_from_root(root):
+        if descriptions is None:
+            descriptions = descriptions_from_root(root)
+        if alternatives is None:
+            alternatives = alternatives_from_root(root)
+        for p in descriptions + alternatives:
             if p.startswith('各巻の並列タイトル:'):
                 for parallel in map(str.strip, p.split(':')[1:]):
                     if parallel not in volume.title.parallels:
@@ -125,10 +194,9 @@ def create_volume_from_root(root):
 
 def create_dcterms_creators_from_root(root):
     dcterms_creators = []
-    for creator in root.xpath('dcndl:BibResource/dcterms:creator',
-                              namespaces=root.nsmap):
-        name_elem = creator.find('.//foaf:name', root.nsmap)
-        transcription_elem = creator.find('.//dcndl:transcription', root.nsmap)
+    for creator in _DCTERMS_CREATORS(root):
+        name_elem = creator.find('.//' + _FOAF_NAME)
+        transcription_elem = creator.find('.//' + _DCNDL_TRANSCRIPTION)
         name = (normalize(re.sub(r'\s+', '', name_elem.text))
                 if name_elem is not None else '')
         transcription = (transcription_elem.text
@@ -138,15 +206,26 @@ def create_dcterms_creators_from_root(root):
     return dcterms_creators
 
 
-def create_creators_from_root(root):
-    dcterms_creators = create_dcterms_creators_from_root(root)
+def index_dcterms_creators(dcterms_creators):
+    '''名前から dcterms:creator の著者を引く辞書 (同じ名前があれば先に現れたもの)'''
+    index = {}
+    for c in dcterms_creators:
+        index.setdefault(c.name, c)
+    return index
+
+
+def create_creators_from_root(root, descriptions=None, dcterms_creators=None):
+    if dcterms_creators is None:
+        dcterms_creators = index_dcterms_creators(
+            create_dcterms_creators_from_root(root))
     creators = []
-    for creator in root.xpath('dcndl:BibResource/dc:creator/text()',
-                              namespaces=root.nsmap):
+    for creator in _DC_CREATORS(root):
         creators.extend(
             create_creators_from_dc_creator(creator, dcterms_creators))
 
-    for p in descriptions_from_root(root):
+    if descriptions is None:
+        descriptions = descriptions_from_root(root)
+    for p in descriptions:
         if p.startswith('イラスト:'):
             name = re.sub(r'\s+', '', p.split(':', 1)[1].strip())
             creators.append(Creator(name=name, transcription=None, role='イラスト',
@@ -154,21 +233,23 @@ def create_creators_from_root(root):
     return creators
 
 
-def create_series_from_root(root):
-    series_description_elem = root.find(
-        'dcndl:BibResource/dcndl:seriesTitle/rdf:Description', root.nsmap)
-    if series_description_elem is None:
+def create_series_from_root(root, descriptions=None, alternatives=None):
+    series_descriptions = _SERIES_DESCRIPTIONS(root)
+    if not series_descriptions:
         return []
-    value_elem = series_description_elem.find('rdf:value', root.nsmap)
-    transcription_elem = series_description_elem.find('dcndl:transcription',
-                                                      root.nsmap)
+    value_elem = series_descriptions[0].find(_RDF_VALUE)
+    transcription_elem = series_descriptions[0].find(_DCNDL_TRANSCRIPTION)
     value = value_elem.text if value_elem is not None else ''
     transcription = (transcription_elem.text
                      if transcription_elem is not None else '')
     series = create_series_from_strings(value, transcription)
 
     if len(series) == 1:
-        for p in descriptions_from_root(root) + alternatives_from_root(root):
+        if descriptions is None:
+            descriptions = descriptions_from_root(root)
+        if alternatives is None:
+            alternatives = alternatives_from_root(root)
+        for p in descriptions + alternatives:
             if p.startswith('並列シリーズ名:'):
                 for parallel in map(str.strip, p.split(':')[1:]):
                     if parallel not in series[0].title.parallels:
@@ -176,31 +257,31 @@ def create_series_from_root(root):
     return series
 
 
-def create_contents_from_root(root):
+def create_contents_from_root(root, dcterms_creators=None):
     contents = []
-    dcterms_creators = create_dcterms_creators_from_root(root)
-    for desc in root.xpath('//dcndl:partInformation//rdf:Description',
-                           namespaces=root.nsmap):
-        title_elem = desc.find('dcterms:title', root.nsmap)
-        transcription_elem = desc.find('dcndl:transcription', root.nsmap)
+    if dcterms_creators is None:
+        dcterms_creators = index_dcterms_creators(
+            create_dcterms_creators_from_root(root))
+    for desc in _PART_DESCRIPTIONS(root):
+        title_elem = desc.find(_DCTERMS_TITLE)
+        transcription_elem = desc.find(_DCNDL_TRANSCRIPTION)
         title = title_elem.text if title_elem is not None else None
-        transcription = transcription_elem.text if transcription_elem else None
-        creators = desc.xpath('./dc:creator/text()', namespaces=root.nsmap)
+        transcription = (transcription_elem.text
+                         if transcription_elem is not None and
+                         _is_true_text(transcription_elem.text) else None)
         if not title:
             continue
         contents.append(create_content_from_strings(
             title,
             transcription,
-            creators,
+            _PART_CREATORS(desc),
             dcterms_creators))
     return contents
 
 
 def create_identifiers_from_root(root):
     identifiers = {}
-    path = ('//dcterms:identifier' +
-            '[@rdf:datatype="http://ndl.go.jp/dcndl/terms/ISBN"]//text()')
-    for isbn in root.xpath(path, namespaces=root.nsmap):
+    for isbn in _ISBNS(root):
         isbn = re.sub(r'-', '', isbn)
         if len(isbn) == 10:
             identifiers['ISBN10'] = isbn
@@ -208,9 +289,7 @@ def create_identifiers_from_root(root):
         if len(isbn) == 13:
             identifiers['ISBN13'] = isbn
             identifiers['ISBN10'] = isbn13to10(isbn)
-    path = ('//dcterms:identifier' +
-            '[@rdf:datatype="http://ndl.go.jp/dcndl/terms/JPNO"]//text()')
-    for jpno in root.xpath(path, namespaces=root.nsmap):
+    for jpno in _JPNOS(root):
         identifiers['JPNO'] = jpno
     return identifiers
 
@@ -267,17 +346,19 @@ def create_series_from_strings(value, transcription):
     return series
 
 
+# 巻次タイトルには括弧() の入れ子を一重まで許可する
+NO_PAREN = r'[^\(\)]'
+VOLUME_TITLE_PATTERN = re.compile(
+    r'\(({0}+(\({0}*\){0}*)*)\)$'.format(NO_PAREN), re.U)
+
+
 def create_volume_from_strings(value, transcription):
     value = normalize(value or '')
     transcription = normalize(transcription or '')
     if not value:
         return None
-    # 巻次タイトルには括弧() の入れ子を一重まで許可する
-    NO_PAREN = r'[^\(\)]'
-    volume_title_pattern = re.compile(
-        r'\(({0}+(\({0}*\){0}*)*)\)$'.format(NO_PAREN), re.U)
-    value_match = volume_title_pattern.search(value)
-    transcription_match = volume_title_pattern.search(transcription)
+    value_match = VOLUME_TITLE_PATTERN.search(value)
+    transcription_match = VOLUME_TITLE_PATTERN.search(transcription)
     title = None
     if (value_match is not None) and (transcription_match is not None):
         title = create_title_from_strings(value_match.groups()[0],
@@ -299,18 +380,23 @@ def create_volume_from_strings(value, transcription):
     return Volume(name=value, transcription=transcription, title=title)
 
 
+ROLE_PATTERN = re.compile(
+    r'(?: |／)' +
+    r'(?:\[ほか\])?' +
+    r'(?P<bracket>\[|\［)?' +
+    r'(?P<role>[一-龠ぁ-んァ-ヶ]+?)' +
+    r'(?(bracket)(?:\]|\］))$', re.U)
+
+
 def create_creators_from_dc_creator(value, dcterms_creators):
-    role_pattern = re.compile(
-        r'(?: |／)' +
-        r'(?:\[ほか\])?' +
-        r'(?P<bracket>\[|\［)?' +
-        r'(?P<role>[一-龠ぁ-んァ-ヶ]+?)' +
-        r'(?(bracket)(?:\]|\］))$', re.U)
-    role_match = role_pattern.search(value)
+    '''dcterms_creators は著者のリストか index_dcterms_creators で作った辞書'''
+    if not isinstance(dcterms_creators, dict):
+        dcterms_creators = index_dcterms_creators(dcterms_creators)
+    role_match = ROLE_PATTERN.search(value)
     role = None
     if role_match is not None:
         role = role_match.group('role')
-        value = role_pattern.sub('', value)
+        value = ROLE_PATTERN.sub('', value)
     name_delimiter = ', '
     creators = []
     for v in value.split(name_delimiter):
@@ -318,12 +404,11 @@ def create_creators_from_dc_creator(value, dcterms_creators):
         transcription = None
         date_of_birth = None
         date_of_death = None
-        for c in dcterms_creators:
-            if c.name == v:
-                transcription = c.transcription
-                date_of_birth = c.date_of_birth
-                date_of_death = c.date_of_death
-                break
+        c = dcterms_creators.get(v)
+        if c is not None:
+            transcription = c.transcription
+            date_of_birth = c.date_of_birth
+            date_of_death = c.date_of_death
         transcription = None if transcription == '' else transcription
         creators.append(Creator(
             name=normalize(v).replace(' ', ''),
@@ -334,19 +419,21 @@ def create_creators_from_dc_creator(value, dcterms_creators):
     return creators
 
 
+NAME_PATTERN = re.compile(
+    r'^(?P<name>.+?)' +
+    r'(, (?P<date_of_birth>\d{4})-(?P<date_of_death>\d{4})?)?$',
+    re.U)
+NAME_DELIMITER_PATTERN = re.compile(r'‖|,\s*')
+
+
 def create_creator_from_dcterms_creator(name, transcription):
     name, transcription = normalize(name), normalize(transcription)
-    name_pattern = re.compile(
-        r'^(?P<name>.+?)' +
-        r'(, (?P<date_of_birth>\d{4})-(?P<date_of_death>\d{4})?)?$',
-        re.U)
-    name_delimiter_pattern = re.compile(r'‖|,\s*')
-    match = name_pattern.match(name)
+    match = NAME_PATTERN.match(name)
     if match is None:
         return Creator(name, transcription, '', '', '')
     return Creator(
-        name=name_delimiter_pattern.sub('', match.group('name')),
-        transcription=' '.join(name_delimiter_pattern.split(transcription)),
+        name=NAME_DELIMITER_PATTERN.sub('', match.group('name')),
+        transcription=' '.join(NAME_DELIMITER_PATTERN.split(transcription)),
         role=None,
         date_of_birth=match.group('date_of_birth'),
         date_of_death=match.group('date_of_death'))
@@ -354,6 +441,8 @@ def create_creator_from_dcterms_creator(name, transcription):
 
 def create_content_from_strings(title, transcription,
                                 creators, dcterms_creators):
+    if not isinstance(dcterms_creators, dict):
+        dcterms_creators = index_dcterms_creators(dcterms_creators)
     cs = []
     for c in creators:
         cs.extend(create_creators_from_dc_creator(c, dcterms_creators))
@@ -364,41 +453,109 @@ def create_content_from_strings(title, transcription,
 
 
 def alternatives_from_root(root):
-    return root.xpath(
-        'dcndl:BibResource/dcndl:alternative/rdf:Description/rdf:value/text()',
-        namespaces=root.nsmap)
+    return _ALTERNATIVES(root)
 
 
 def descriptions_from_root(root):
-    return root.xpath(
-        'dcndl:BibResource/dcterms:description/text()',
-        namespaces=root.nsmap)
+    return _DESCRIPTIONS(root)
 
 
-def metadata_from_jpno(jpno):
-    URL = 'http://iss.ndl.go.jp/api/opensearch'
-    jpno = re.sub(r'-', '', normalize(jpno))
+OPENSEARCH_URL = 'http://iss.ndl.go.jp/api/opensearch'
+SRU_URL = 'http://iss.ndl.go.jp/api/sru'
+# SRU で問い合わせるデータプロバイダ (国立国会図書館蔵書)
+SRU_DPID = 'iss-ndl-opac'
+# 1 回の SRU のクエリに OR でまとめる ISBN (JP 番号) の数
+MAX_SRU_QUERY_ITEMS = 50
+SRU_MAXIMUM_RECORDS = 200
+# 1 回の検索で続きを取得するページ数の上限 (応答がおかしくても問い合わせ続けないように)
+MAX_SRU_PAGES = 10
+
+# 'opensearch': OpenSearch で探してから DC-NDL (RDF) を取得する (2 往復)
+# 'sru': SRU で DC-NDL の書誌を直接取得する (1 往復)
+_api = 'opensearch'
+
+
+def get_api():
+    '''metadata_from_isbn と metadata_from_jpno が使う API ('opensearch' か 'sru')'''
+    return _api
+
+
+def set_api(api):
+    '''metadata_from_isbn と metadata_from_jpno が使う API を切り替える'''
+    global _api
+    if api not in ('opensearch', 'sru'):
+        raise ValueError('unknown NDL API: {0}'.format(api))
+    _api = api
+
+
+def metadata_from_jpno(jpno, transport=None):
+    if _api == 'sru':
+        return metadata_from_jpno_via_sru(jpno, transport)
     try:
-        response = requests.get(URL, params={'jpno': jpno})
+        content = fetch_opensearch(jpno_params(jpno), transport)
     except:
         return Metadata()
-    return metadata_from_opensearch_response(response)
+    return metadata_from_opensearch_content(content, transport)
+
+
+def metadata_from_isbn(isbn, transport=None):
+    if _api == 'sru':
+        return metadata_from_isbn_via_sru(isbn, transport)
+    try:
+        content = fetch_opensearch(isbn_params(isbn), transport)
+    except:
+        return Metadata()
+    return metadata_from_opensearch_content(content, transport)
+
+
+def jpno_params(jpno):
+    jpno = re.sub(r'-', '', normalize(jpno))
+    return {'jpno': jpno}
 
 
-def metadata_from_isbn(isbn):
-    URL = 'http://iss.ndl.go.jp/api/opensearch'
+def isbn_params(isbn):
     isbn = re.sub(r'-', '', normalize(isbn))
     if len(isbn) == 10:
         isbn = isbn10to13(isbn)
+    return {'isbn': isbn}
+
+
+def fetch_opensearch(params, transport=None):
+    transport = transport or get_transport()
+    return cache.cached('ndl', cache.make_key(OPENSEARCH_URL, params),
+                        lambda: transport.get('ndl', OPENSEARCH_URL, params),
+                        classify_opensearch_content)
+
+
+def fetch_rdf(url, transport=None):
+    transport = transport or get_transport()
+    return cache.cached('ndl', url, lambda: transport.get('ndl', url))
+
+
+def classify_opensearch_content(content):
+    if rdf_url_from_opensearch_content(content) is None:
+        return cache.NOT_FOUND
+    return cache.FOUND
+
+
+def metadata_from_opensearch_response(response, transport=None):
+    return metadata_from_opensearch_content(response.content, transport)
+
+
+def metadata_from_opensearch_content(content, transport=None):
+    dcndl_rdf_url = rdf_url_from_opensearch_content(content)
+    if dcndl_rdf_url is None:
+        return Metadata()
     try:
-        response = requests.get(URL, params={'isbn': isbn})
+        content = fetch_rdf(dcndl_rdf_url, transport)
     except:
         return Metadata()
-    return metadata_from_opensearch_response(response)
+    return metadata_from_rdf_content(content)
 
 
-def metadata_from_opensearch_response(response):
-    root = lxml.objectify.fromstring(response.content)
+def rdf_url_from_opensearch_content(content):
+    '''OpenSearch の結果から，採用する書誌の DC-NDL (RDF) の URL を選ぶ'''
+    root = lxml.objectify.fromstring(content)
     item = None
     # 国立国会図書館を優先
     bib_record_categories = ['R100000002', 'R100000001']
@@ -412,14 +569,169 @@ def metadata_from_opensearch_response(response):
     else:
         item = getattr(root.channel, 'item', None)
     if item is None:
-        return Metadata()
-    dcndl_rdf_url = item.guid.text + '.rdf'
-    try:
-        response = requests.get(dcndl_rdf_url)
-    except:
-        return Metadata()
+        return None
+    return item.guid.text + '.rdf'
+
+
+def metadata_from_rdf_content(content):
     return create_metadata_from_xml_root(
-        lxml.objectify.fromstring(response.content))
+        lxml.etree.fromstring(content, RDF_PARSER))
+
+
+def iter_metadata_from_rdf_dump(source):
+    '''
+    DC-NDL (RDF/XML) の一括ダウンロード用のファイルから書誌を 1 件ずつ読み出す．
+    source はファイル名かファイルオブジェクト．
+    読み終えた書誌の要素はツリーから切り離すので，ファイルが大きくてもメモリの使用量は一定
+    '''
+    admin = None
+    for _, elem in lxml.etree.iterparse(
+            source, events=('end',),
+            tag=(_BIB_ADMIN_RESOURCE, _BIB_RESOURCE),
+            remove_blank_text=True, huge_tree=True):
+        # 処理済みの要素 (書誌の間にある他の要素も含む) を捨てる
+        for e in itertools.chain([elem], elem.iterancestors()):
+            while e.getprevious() is not None:
+                del e.getparent()[0]
+        if elem.tag == _BIB_ADMIN_RESOURCE:
+            admin = elem
+            continue
+        # 抽出処理は // で文書全体を探すので，この書誌だけの文書を作る
+        root = lxml.etree.Element(_RDF)
+        if admin is not None:
+            root.append(admin)
+        root.append(elem)
+        admin = None
+        yield create_metadata_from_xml_root(root)
+
+
+def metadata_from_isbn_via_sru(isbn, transport=None):
+    return metadata_from_isbns_via_sru([isbn], transport)[isbn]
+
+
+def metadata_from_jpno_via_sru(jpno, transport=None):
+    return metadata_from_jpnos_via_sru([jpno], transport)[jpno]
+
+
+def metadata_from_isbns_via_sru(isbns, transport=None):
+    '''
+    複数の ISBN の書誌を SRU でまとめて取得する．
+    返り値は isbns の各要素をキーとする辞書 (見つからなかったものは空の Metadata)
+    '''
+    return _metadata_via_sru('isbn', isbns,
+                             lambda isbn: isbn_params(isbn)['isbn'],
+                             _ISBNS, transport)
+
+
+def metadata_from_jpnos_via_sru(jpnos, transport=None):
+    return _metadata_via_sru('jpno', jpnos,
+                             lambda jpno: jpno_params(jpno)['jpno'],
+                             _JPNOS, transport)
+
+
+def _metadata_via_sru(index, identifiers, normalize_identifier,
+                      identifiers_from_root, transport):
+    # キャッシュには書誌ごとの DC-NDL (RDF) を保存する．
+    # まとめて取得した場合も 1 件ずつ取得した場合も同じキーになる
+    # identifiers_from_root は書誌に含まれる番号 (_ISBNS か _JPNOS)．
+    # セットの ISBN と各巻の ISBN のように複数ある場合は，どれで問い合わせたものにも対応させる
+    keys = dict((i, normalize_identifier(i)) for i in identifiers)
+    metadata = {}
+    pending = []
+    for key in dict.fromkeys(keys[i] for i in identifiers):
+        content = cache.lookup('ndl', sru_cache_key(index, key))
+        if content is None:
+            pending.append(key)
+        else:
+            metadata[key] = (metadata_from_rdf_content(content)
+                             if content else Metadata())
+
+    for i in range(0, len(pending), MAX_SRU_QUERY_ITEMS):
+        chunk = pending[i:i + MAX_SRU_QUERY_ITEMS]
+        try:
+            contents = fetch_sru_records(sru_params(index, chunk), transport)
+        except:
+            for key in chunk:
+                metadata[key] = Metadata()
+            continue
+        found = {}
+        for content in contents:
+            root = lxml.etree.fromstring(content, RDF_PARSER)
+            m = None
+            for key in dict.fromkeys(normalize_identifier(value.strip())
+                                     for value in identifiers_from_root(root)):
+                # 同じ番号の書誌が複数ある場合は先頭のものを使う
+                if key in chunk and key not in found:
+                    if m is None:
+                        m = create_metadata_from_xml_root(root)
+                    found[key] = content
+                    metadata[key] = m
+        for key in chunk:
+            if key not in found:
+                metadata[key] = Metadata()
+            cache.store('ndl', sru_cache_key(index, key),
+                        found.get(key, b''), classify_rdf_content)
+    return dict((i, metadata[keys[i]]) for i in identifiers)
+
+
+def sru_params(index, values):
+    '''values のいずれかに一致する書誌を探す CQL のクエリ'''
+    query = ' OR '.join('{0}="{1}"'.format(index, v) for v in values)
+    return {
+        'operation': 'searchRetrieve',
+        'version': '1.2',
+        'recordSchema': 'dcndl',
+        'recordPacking': 'xml',
+        'maximumRecords': SRU_MAXIMUM_RECORDS,
+        'query': '({0}) AND dpid={1}'.format(query, SRU_DPID),
+    }
+
+
+def sru_cache_key(index, value):
+    return cache.make_key(SRU_URL, {index: value, 'dpid': SRU_DPID})
+
+
+def fetch_sru_records(params, transport=None):
+    '''SRU で検索し，各書誌の DC-NDL (RDF) のリストを返す．結果が多い場合は続きも取得する'''
+    transport = transport or get_transport()
+    contents = []
+    start_record = 1
+    for _ in range(MAX_SRU_PAGES):
+        params = dict(params, startRecord=start_record)
+        content = transport.get('ndl', SRU_URL, params)
+        records, next_position = rdf_contents_from_sru_content(content)
+        contents.extend(records)
+        # 次の開始位置が進まない場合は同じページを繰り返し取得することになるので止める
+        if next_position is None or next_position <= start_record:
+            break
+        start_record = next_position
+    return contents
+
+
+def rdf_contents_from_sru_content(content):
+    '''
+    SRU の検索結果から各書誌の DC-NDL (RDF) を取り出す．
+    返り値は (RDF のバイト列のリスト, 次の開始位置 (無ければ None))
+    '''
+    root = lxml.etree.fromstring(content)
+    contents = []
+    for data in root.iter('{*}recordData'):
+        if len(data):
+            # SRU の応答の名前空間 (デフォルト名前空間) を引き継がないようにする
+            rdf = copy.deepcopy(data[0])
+            lxml.etree.cleanup_namespaces(rdf)
+            contents.append(lxml.etree.tostring(rdf, encoding='utf-8'))
+        elif data.text and data.text.strip():
+            # recordPacking=string の場合は RDF がエスケープされた文字列で入っている
+            contents.append(data.text.strip().encode('utf-8'))
+    next_position = root.findtext('{*}nextRecordPosition')
+    if next_position and next_position.strip().isdigit():
+        return contents, int(next_position) or None
+    return contents, None
+
+
+def classify_rdf_content(content):
+    return cache.FOUND if content else cache.NOT_FOUND
 
 
 if __name__ == '__main__':
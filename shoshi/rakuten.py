@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import re
-import requests
+import json
+from . import cache
+from .transport import get_transport
 from .util import isbn10to13, isbn13to10, normalize
 from .metadata import Metadata, Title, Creator, Volume, Series
 from .metadata import TitleElement, Publisher
@@ -12,20 +14,30 @@ def normalize_author(author):
     return normalize(author).replace(' ', '')
 
 
-def metadata_from_isbn(isbn, application_id):
+BOOKS_BOOK_URL = 'https://app.rakuten.co.jp/services/api/BooksBook/Search/20130522'
+BOOKS_MAGAZINE_URL = 'https://app.rakuten.co.jp/services/api/BooksMagazine/Search/20130522'
+
+
+def metadata_from_isbn(isbn, application_id, transport=None):
+    params = isbn_params(isbn, application_id)
+    try:
+        content = fetch(BOOKS_BOOK_URL, params, transport)
+    except:
+        return Metadata()
+    return metadata_from_book_data(json.loads(content), params['isbn'])
+
+
+def isbn_params(isbn, application_id):
     isbn = isbn.replace('-', '')
+    return {'isbn': isbn, 'applicationId': application_id}
+
+
+def metadata_from_book_data(data, isbn):
+    '''楽天ブックス書籍検索 API の結果 (data) からメタデータを作成する'''
     if len(isbn) == 10:
         isbn10, isbn13 = isbn, isbn10to13(isbn)
     else:
         isbn10, isbn13 = isbn13to10(isbn), isbn
-
-    URL = 'https://app.rakuten.co.jp/services/api/BooksBook/Search/20130522'
-    params = {'isbn': isbn, 'applicationId': application_id}
-    try:
-        response = requests.get(URL, params=params)
-    except:
-        return Metadata()
-    data = response.json()
     if 'error' in data or data['count'] == 0:
         return Metadata()
     item = data['Items'][0]['Item']
@@ -75,15 +87,45 @@ def metadata_from_isbn(isbn, application_id):
         links=links)
 
 
-def metadata_from_magazine_code(jan, application_id):
-    jan = re.sub('\D', '', jan)
-    URL = 'https://app.rakuten.co.jp/services/api/BooksMagazine/Search/20130522'
-    params = {'jan': jan, 'applicationId': application_id}
+def metadata_from_magazine_code(jan, application_id, transport=None):
+    params = magazine_code_params(jan, application_id)
     try:
-        response = requests.get(URL, params=params)
+        content = fetch(BOOKS_MAGAZINE_URL, params, transport)
     except:
         return Metadata()
-    data = response.json()
+    return metadata_from_magazine_data(json.loads(content), params['jan'])
+
+
+def fetch(url, params, transport=None):
+    transport = transport or get_transport()
+    # リクエスト数の制限はアプリ ID ごと
+    return cache.cached('rakuten', cache_key(url, params),
+                        lambda: transport.get('rakuten', url, params,
+                                              params['applicationId']),
+                        classify_content)
+
+
+def cache_key(url, params):
+    # アプリ ID が違っても結果は同じなのでキャッシュのキーには含めない
+    return cache.make_key(url, params, exclude=('applicationId',))
+
+
+def classify_content(content):
+    data = json.loads(content)
+    if 'error' in data:
+        return None
+    if data['count'] == 0:
+        return cache.NOT_FOUND
+    return cache.FOUND
+
+
+def magazine_code_params(jan, application_id):
+    jan = re.sub('\D', '', jan)
+    return {'jan': jan, 'applicationId': application_id}
+
+
+def metadata_from_magazine_data(data, jan):
+    '''楽天ブックス雑誌検索 API の結果 (data) からメタデータを作成する'''
     if 'error' in data or data['count'] == 0:
         return Metadata()
     item = data['Items'][0]['Item']
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+API ごと (と認証情報ごと) のリクエスト数の制限
+
+楽天や Amazon の API は認証情報ごとに秒間のリクエスト数が決められている．
+制限を超えてからエラーを受けて待つのではなく，送る前に待つ (トークンバケット)．
+バケットはスレッド間で共有されるので，同時に問い合わせても制限は守られる．
+
+    from shoshi import ratelimit
+    ratelimit.set_rate('rakuten', rate=5, burst=5)
+'''
+
+import time
+import asyncio
+import threading
+
+# API ごとの (秒間のリクエスト数, バースト) のデフォルト値．None は制限なし
+DEFAULT_RATES = {
+    'amazon': (1, 1),
+    'rakuten': (1, 1),
+    'ndl': None,
+    'wikipedia': None,
+}
+
+
+class TokenBucket(object):
+    '''rate 個/秒でトークンが補充され，最大で burst 個まで溜まるバケット'''
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait_time(self, tokens=1):
+        '''トークンを予約せずに，使えるようになるまでの待ち時間 (秒) を返す'''
+        with self._lock:
+            elapsed = time.monotonic() - self._updated_at
+            available = min(self.burst, self._tokens + elapsed * self.rate)
+            return max(0.0, (tokens - available) / self.rate)
+
+    def reserve(self, tokens=1):
+        '''
+        トークンを予約し，使えるようになるまでの待ち時間 (秒) を返す．
+        予約したトークンは待ち時間が過ぎれば使ってよい
+        '''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+_rates = dict(DEFAULT_RATES)
+_buckets = {}
+_lock = threading.Lock()
+
+
+def set_rate(source, rate, burst=None):
+    '''source へのリクエストを秒間 rate 回までにする．rate が None なら制限しない'''
+    with _lock:
+        _rates[source] = None if rate is None else (rate, burst or 1)
+        for key in [key for key in _buckets if key[0] == source]:
+            del _buckets[key]
+
+
+def limiter(source, credential=None):
+    '''source と認証情報 (credential) に対応するバケットを返す．制限が無ければ None'''
+    key = (source, credential)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _lock:
+            bucket = _buckets.get(key)
+            if bucket is None and _rates.get(source) is not None:
+                rate, burst = _rates[source]
+                bucket = _buckets[key] = TokenBucket(rate, burst)
+    return bucket
+
+
+def acquire(source, credential=None):
+    '''source へのリクエストを送ってよくなるまで待つ'''
+    bucket = limiter(source, credential)
+    if bucket is not None:
+        bucket.acquire()
+
+
+async def acquire_async(source, credential=None):
+    bucket = limiter(source, credential)
+    if bucket is not None:
+        await bucket.acquire_async()
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+各 API とのやりとりを記録し，後からネットワークを使わずに再生するトランスポート
+
+RecordingTransport は送ったリクエストと応答を Archive (SQLite のファイル) に記録する．
+ReplayTransport は記録した応答を返し，記録に無いリクエストは NotRecordedError にする:
+
+    from shoshi import replay, transport
+    transport.set_transport(replay.RecordingTransport(replay.Archive('day.sqlite3')))
+    ...
+    transport.set_transport(replay.ReplayTransport(replay.Archive('day.sqlite3')))
+
+リクエストは API の名前と，URL とパラメータを正規化したキーで区別する．
+Amazon の署名やタイムスタンプのようにリクエストごとに変わるパラメータや認証情報はキーに含めないので，
+別の認証情報でも再生できる．
+'''
+
+import os
+import time
+import zlib
+import sqlite3
+import threading
+import requests
+from urllib.parse import urlsplit, urlunsplit, parse_qsl
+from . import cache
+from .transport import Transport
+
+# API ごとにキーに含めないパラメータ
+EXCLUDED_PARAMS = {
+    'amazon': ('Signature', 'Timestamp', 'AWSAccessKeyId', 'AssociateTag'),
+    'rakuten': ('applicationId',),
+}
+
+
+class NotRecordedError(Exception):
+    pass
+
+
+def exchange_key(source, url, params=None):
+    '''
+    リクエストのキー．URL に含まれるクエリ (Amazon の署名済み URL など) も params と合わせて並べ替え，
+    EXCLUDED_PARAMS に含まれるパラメータを除く
+    '''
+    scheme, netloc, path, query, _ = urlsplit(url)
+    pairs = dict(parse_qsl(query, keep_blank_values=True))
+    pairs.update(params or {})
+    return cache.make_key(urlunsplit((scheme, netloc, path, '', '')), pairs,
+                          EXCLUDED_PARAMS.get(source, ()))
+
+
+class Archive(object):
+    '''
+    やりとりを保存する SQLite のファイル．
+    (API の名前, キー) ごとにステータスコードと zlib で圧縮した本文を持つ (同じキーは後のもので置き換える)
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        # sqlite3 の接続はスレッド間で共有できないので，スレッドごとに作る
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS exchanges ('
+                ' source TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' status INTEGER NOT NULL,'
+                ' body BLOB NOT NULL,'
+                ' recorded_at REAL NOT NULL,'
+                ' PRIMARY KEY (source, key)) WITHOUT ROWID')
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM exchanges').fetchone()[0]
+
+    def add(self, source, key, status, body):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO exchanges'
+            ' (source, key, status, body, recorded_at)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (source, key, status, zlib.compress(body), time.time()))
+
+    def get(self, source, key):
+        '''記録した (ステータスコード, 本文)．無ければ None'''
+        row = self._connect().execute(
+            'SELECT status, body FROM exchanges WHERE source = ? AND key = ?',
+            (source, key)).fetchone()
+        if row is None:
+            return None
+        return row[0], zlib.decompress(row[1])
+
+
+class RecordingTransport(Transport):
+    '''
+    Transport と同じようにリクエストを送り，応答を archive に記録する．
+    エラーのステータスコードの応答も記録する (接続エラーなど応答の無いものは記録しない)．
+    その他の引数は Transport と同じ
+    '''
+
+    def __init__(self, archive, **kwargs):
+        Transport.__init__(self, **kwargs)
+        self.archive = archive
+
+    def _get(self, source, url, params, credential):
+        key = exchange_key(source, url, params)
+        try:
+            content = Transport._get(self, source, url, params, credential)
+        except requests.HTTPError as e:
+            if e.response is not None:
+                self.archive.add(source, key, e.response.status_code,
+                                 e.response.content)
+            raise
+        self.archive.add(source, key, 200, content)
+        return content
+
+
+class ReplayTransport(Transport):
+    '''
+    archive に記録した応答を返す．ネットワークには接続せず，リクエスト数の制限 (ratelimit) でも待たない．
+    記録に無いリクエストは NotRecordedError，エラーのステータスコードは requests.HTTPError にする
+    '''
+
+    def __init__(self, archive, **kwargs):
+        Transport.__init__(self, **kwargs)
+        self.archive = archive
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, source, url, params, credential):
+        exchange = self.archive.get(source, exchange_key(source, url, params))
+        if exchange is None:
+            self.misses += 1
+            raise NotRecordedError('{0}: {1}'.format(source, url))
+        self.hits += 1
+        status, content = exchange
+        if status >= 400:
+            response = requests.Response()
+            response.status_code = status
+            response._content = content
+            response.url = url
+            raise requests.HTTPError('{0} (recorded)'.format(status),
+                                     response=response)
+        return content
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+メタデータを HTTP で返すサーバ
+
+    % python -m shoshi serve --port 8080 --cache ~/.cache/shoshi.sqlite3
+
+1つのプロセスが起動し続けるので，各 API への接続やキャッシュを使い回せる．
+
+    GET  /isbn/{isbn}    Metadata.todict() の JSON
+    GET  /ean/{ean}
+    GET  /jpno/{jpno}
+    POST /bulk           {"identifiers": [...]} (または識別子のリスト) を受け取り，
+                         終わったものから順に --input と同じ形式の JSON Lines で返す
+'''
+
+import re
+import sys
+import json
+import hashlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote
+from . import __version__, batch, cache, microbatch, ndl, replay, transport
+from . import wikipedia
+from .amazon import CredentialPool
+
+# 見つかった書誌の Cache-Control の max-age (秒)
+MAX_AGE = cache.DAY
+# 見つからなかった (タイトルの無い) 書誌の max-age (秒)．後から登録されることがあるので短め
+NEGATIVE_MAX_AGE = cache.DEFAULT_NEGATIVE_TTL
+# /bulk で一度に受け付ける識別子の数の上限
+MAX_BULK_IDENTIFIERS = 1000
+
+PATH_PATTERN = re.compile(r'^/(isbn|ean|jpno)/([^/]+)$')
+# パスの種類ごとに受け付ける識別子の種類
+ACCEPTED_TYPES = {
+    'isbn': ('isbn',),
+    'ean': ('isbn', 'ean'),
+    'jpno': ('jpno',),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''server.options は batch.lookup に渡す引数 (認証情報など)'''
+    protocol_version = 'HTTP/1.1'
+    server_version = 'shoshi/' + __version__
+    # ヘッダと本文を別々に書くので，Nagle アルゴリズムと遅延 ACK で 40ms 待たされないようにする
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        m = PATH_PATTERN.match(urlsplit(self.path).path)
+        if m is None:
+            return self.send_json(404, {'error': 'not found'})
+        kind, identifier = m.group(1), unquote(m.group(2))
+        if batch.identifier_type(identifier) not in ACCEPTED_TYPES[kind]:
+            return self.send_json(400, {'error': 'invalid ' + kind})
+        try:
+            metadata = batch.lookup(identifier, kind=kind,
+                                    **self.server.options)
+        except Exception as e:
+            self.log_error('%s %s: %r', kind, identifier, e)
+            return self.send_json(502, {'error': str(e) or type(e).__name__})
+
+        body = metadata.tojson(self.server.include_none_value_field).encode(
+            'utf-8')
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if metadata.missing_sources:
+            # --deadline に間に合わなかった API がある不完全な結果は共有キャッシュに残さない
+            cache_control = 'no-store'
+        else:
+            cache_control = 'public, max-age={0}'.format(
+                MAX_AGE if metadata.title else NEGATIVE_MAX_AGE)
+        headers = {'Cache-Control': cache_control, 'ETag': etag}
+        if etag in self.headers.get('If-None-Match', ''):
+            return self.send_body(304, None, headers)
+        self.send_body(200 if metadata.title else 404, body, headers)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/bulk':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            if isinstance(data, dict):
+                data = data['identifiers']
+            identifiers = [str(identifier) for identifier in data]
+        except (ValueError, KeyError, TypeError):
+            return self.send_json(400, {'error': 'expected '
+                                                 '{"identifiers": [...]}'})
+        if len(identifiers) > MAX_BULK_IDENTIFIERS:
+            return self.send_json(413, {'error': 'too many identifiers'})
+
+        # 終わったものから順に chunked で返す
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for identifier, content, error in batch.iter_results(
+                identifiers, self.server.jobs,
+                self.server.include_none_value_field, **self.server.options):
+            chunk = batch.format_result(identifier, content, error).encode(
+                'utf-8')
+            self.wfile.write('{0:x}\r\n'.format(len(chunk)).encode('ascii'))
+            self.wfile.write(chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode('utf-8'),
+                       {'Cache-Control': 'no-store'})
+
+    def send_body(self, status, body, headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def make_server(host='127.0.0.1', port=8080, jobs=4,
+                include_none_value_field=False, quiet=False, **options):
+    '''options は batch.lookup に渡す (amazon_auth_info など)'''
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.options = options
+    server.jobs = jobs
+    server.include_none_value_field = include_none_value_field
+    server.quiet = quiet
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m shoshi serve',
+        description='serve book metadata over HTTP')
+    parser.add_argument('--host', action="store", dest="host",
+                        default='127.0.0.1')
+    parser.add_argument('--port', action="store", dest="port", type=int,
+                        default=8080)
+    parser.add_argument('--rakuten-application-id', action="store",
+                        dest="rakuten_application_id")
+    parser.add_argument('--amazon-auth-info', action="append",
+                        dest="amazon_auth_info",
+                        help='ACCESS_KEY,SECRET_KEY,ASSOCIATE_TAG '
+                             '(repeat to use several credentials in turn)')
+    parser.add_argument('--use-wikipedia', action="store_true",
+                        default=False, dest="use_wikipedia")
+    parser.add_argument('--deadline', action="store", dest="deadline",
+                        type=float)
+    parser.add_argument('--jobs', action="store", dest="jobs", type=int,
+                        default=4, help='records looked up at once per '
+                                        'bulk request')
+    parser.add_argument('--cache', action="store", dest="cache",
+                        help='path to an SQLite file to cache API responses in')
+    parser.add_argument('--metadata-cache-size', action="store",
+                        dest="metadata_cache_size", type=int, default=10000,
+                        help='merged records kept in memory (0 disables)')
+    parser.add_argument('--pool-maxsize', action="store", dest="pool_maxsize",
+                        type=int, default=32,
+                        help='connections kept per upstream host')
+    parser.add_argument('--record', action="store", dest="record",
+                        help='path to an SQLite file to record every API '
+                             'response in')
+    parser.add_argument('--replay', action="store", dest="replay",
+                        help='answer from responses recorded with --record '
+                             'instead of the network')
+    parser.add_argument('--ndl-api', action="store", dest="ndl_api",
+                        choices=('opensearch', 'sru'), default='opensearch')
+    parser.add_argument('--wikipedia-index', action="store",
+                        dest="wikipedia_index")
+    parser.add_argument('--batch-window', action="store", dest="batch_window",
+                        type=float,
+                        help='hold lookups this many seconds to send them to '
+                             'Amazon, NDL (sru) and Wikipedia in batches')
+    parser.add_argument('--include-null-value-field', action='store_true',
+                        default=False, dest='include_none_value_field')
+    parser.add_argument('--quiet', action='store_true', default=False,
+                        dest='quiet', help='do not log each request')
+    args = parser.parse_args(argv)
+    if args.record and args.replay:
+        parser.error('--record and --replay cannot be used together')
+
+    amazon_auth_info = None
+    if args.amazon_auth_info and len(args.amazon_auth_info) == 1:
+        amazon_auth_info = args.amazon_auth_info[0].split(',')
+    elif args.amazon_auth_info:
+        amazon_auth_info = CredentialPool(
+            [info.split(',') for info in args.amazon_auth_info])
+    if args.cache:
+        cache.set_cache(cache.SQLiteCache(args.cache))
+    if args.metadata_cache_size:
+        cache.set_metadata_cache(cache.MetadataCache(
+            maxsize=args.metadata_cache_size, ttl=NEGATIVE_MAX_AGE))
+    if args.record:
+        transport.set_transport(replay.RecordingTransport(
+            replay.Archive(args.record), pool_maxsize=args.pool_maxsize))
+    elif args.replay:
+        transport.set_transport(replay.ReplayTransport(
+            replay.Archive(args.replay)))
+    else:
+        transport.set_transport(transport.Transport(
+            pool_maxsize=args.pool_maxsize))
+    ndl.set_api(args.ndl_api)
+    if args.wikipedia_index:
+        from .wikipedia_index import SeriesIndex
+        wikipedia.set_series_index(SeriesIndex(args.wikipedia_index),
+                                   offline=True)
+
+    if args.batch_window:
+        microbatch.set_scheduler(microbatch.Scheduler(args.batch_window))
+
+    server = make_server(args.host, args.port, args.jobs,
+                         args.include_none_value_field, args.quiet,
+                         amazon_auth_info=amazon_auth_info,
+                         rakuten_application_id=args.rakuten_application_id,
+                         use_wikipedia=args.use_wikipedia,
+                         deadline=args.deadline)
+    print('listening on http://{0}:{1}/'.format(*server.server_address[:2]),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -1,74 +1,305 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import copy
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from .metadata import Metadata, Creator
-from . import ndl, rakuten, amazon, wikipedia
+from .util import normalize_ean
+from . import ndl, rakuten, amazon, wikipedia, cache, singleflight, microbatch
 
 
 def metadata_from_isbn(isbn,
                        amazon_auth_info=None,
                        rakuten_application_id=None,
-                       use_wikipedia=False):
+                       use_wikipedia=False,
+                       deadline=None,
+                       transport=None):
     return metadata_from_ean(isbn,
                              amazon_auth_info,
                              rakuten_application_id,
-                             use_wikipedia)
+                             use_wikipedia,
+                             deadline,
+                             transport)
 
 
 def metadata_from_ean(ean,
                       amazon_auth_info=None,
                       rakuten_application_id=None,
-                      use_wikipedia=False):
-    ean = ean.replace('-', '')
-    amazon_metadata = Metadata()
-    rakuten_metadata = Metadata()
-    wikipedia_metadata = Metadata()
-    ndl_metadata = ndl.metadata_from_isbn(ean)
-    if not ndl_metadata.identifiers:
-        ndl_metadata.identifiers['EAN'] = ean
+                      use_wikipedia=False,
+                      deadline=None,
+                      transport=None):
+    '''
+    deadline (秒) を指定すると，それまでに返ってこなかった API の結果は諦めて，
+    返ってきた結果だけを統合する．諦めた API の名前は missing_sources に入る
+    transport を省略した場合はデフォルトのトランスポートを使う
+    '''
+    key = _metadata_cache_key('EAN', normalize_ean(ean), amazon_auth_info,
+                              rakuten_application_id, use_wikipedia)
+    return _cached(key, key + (deadline, transport), _metadata_from_ean, ean,
+                   amazon_auth_info, rakuten_application_id, use_wikipedia,
+                   deadline, transport)
+
+
+# 各 API への問い合わせに使うスレッドプール．呼び出しごとに作らずに使い回す
+# (スレッドを作り直すと，cache や wikipedia_index がスレッドごとに持つ SQLite の接続も作り直すことになる)
+SOURCE_WORKERS = 32
+_executor = ThreadPoolExecutor(max_workers=SOURCE_WORKERS,
+                               thread_name_prefix='shoshi-source')
+
 
+def _metadata_from_ean(ean,
+                       amazon_auth_info=None,
+                       rakuten_application_id=None,
+                       use_wikipedia=False,
+                       deadline=None,
+                       transport=None):
+    ean = ean.replace('-', '')
+    expires_at = None if deadline is None else time.monotonic() + deadline
+    missing_sources = []
+    # 各 API は互いに独立しているので，スレッドプールで同時に問い合わせる
+    # Wikipedia の検索も ISBN しか必要ないので最初から投げておき，
+    # タイトルと著者による絞り込みだけを他の結果が揃ってから行う
+    # マイクロバッチが有効なら，同時に来た他の呼び出しとまとめて問い合わせる
+    scheduler = microbatch.get_scheduler()
+    if scheduler is None:
+        ndl_lookup = ndl.metadata_from_isbn
+        amazon_lookup = _amazon_metadata_from_ean
+        wikipedia_lookup = wikipedia.find_series_info
+    else:
+        ndl_lookup = scheduler.ndl_metadata_from_isbn
+        amazon_lookup = scheduler.amazon_metadata_from_ean
+        wikipedia_lookup = scheduler.wikipedia_find_series_info
+    # 使わなかった Wikipedia の検索結果や，締め切りに間に合わなかった結果は待たずに返る
+    ndl_future = _executor.submit(ndl_lookup, ean, transport)
+    amazon_future = None
+    rakuten_future = None
+    wikipedia_future = None
     if amazon_auth_info:
-        amazon_metadata = amazon.metadata_from_ean(
-            ean, *amazon_auth_info)
+        amazon_future = _executor.submit(
+            amazon_lookup, ean, amazon_auth_info, transport)
     if rakuten_application_id:
-        if ean.startswith('491') and len(ean) == 13:
-            rakuten_metadata = rakuten.metadata_from_magazine_code(
-                ean, rakuten_application_id)
+        if is_magazine_code(ean):
+            rakuten_future = _executor.submit(
+                rakuten.metadata_from_magazine_code,
+                ean, rakuten_application_id, transport)
         else:
-            rakuten_metadata = rakuten.metadata_from_isbn(
-                ean, rakuten_application_id)
+            rakuten_future = _executor.submit(
+                rakuten.metadata_from_isbn,
+                ean, rakuten_application_id, transport)
     if use_wikipedia:
-        title = None
-        creator_names = []
-        for M in (ndl_metadata, amazon_metadata, rakuten_metadata):
-            if M.title:
-                title = M.title.name
-                creator_names = [c.name for c in M.creators]
-                break
+        wikipedia_future = _executor.submit(wikipedia_lookup, ean, transport)
+
+    ndl_metadata = _result_or_empty(
+        ndl_future, 'ndl', expires_at, missing_sources)
+    amazon_metadata = _result_or_empty(
+        amazon_future, 'amazon', expires_at, missing_sources)
+    rakuten_metadata = _result_or_empty(
+        rakuten_future, 'rakuten', expires_at, missing_sources)
+
+    if not ndl_metadata.identifiers:
+        ndl_metadata.identifiers['EAN'] = ean
+
+    wikipedia_metadata = Metadata()
+    if wikipedia_future is not None:
+        title, creator_names = title_and_creator_names(
+            ndl_metadata, amazon_metadata, rakuten_metadata)
+        # タイトルが得られなかった場合は検索結果を捨てる
         if title:
-            wikipedia_metadata = wikipedia.metadata_from_isbn(
-                ean, title, creator_names)
+            info = _result_or_empty(wikipedia_future, 'wikipedia',
+                                    expires_at, missing_sources, dict)
+            wikipedia_metadata = wikipedia.metadata_from_series_info(
+                info, title, creator_names)
+
+    metadata = merge(ndl_metadata, amazon_metadata,
+                     rakuten_metadata, wikipedia_metadata)
+    if deadline is not None:
+        metadata.missing_sources = missing_sources
+    return metadata
+
+
+def _amazon_metadata_from_ean(ean, amazon_auth_info, transport):
+    # amazon_auth_info は認証情報か amazon.CredentialPool
+    if isinstance(amazon_auth_info, amazon.CredentialPool):
+        return amazon.metadata_from_ean_with_pool(ean, amazon_auth_info,
+                                                  transport=transport)
+    return amazon.metadata_from_ean(ean, *amazon_auth_info,
+                                    transport=transport)
+
+
+def _remaining(expires_at):
+    if expires_at is None:
+        return None
+    return max(0, expires_at - time.monotonic())
+
+
+def _result_or_empty(future, source, expires_at, missing_sources,
+                     empty=Metadata):
+    '''
+    future の結果．締め切りに間に合わなかったか例外を送出した場合は，
+    source を missing_sources に加えて empty() を返す (他の API の結果は捨てない)
+    '''
+    if future is None:
+        return empty()
+    try:
+        return future.result(_remaining(expires_at))
+    except Exception:
+        missing_sources.append(source)
+        return empty()
+
 
-    return merge(ndl_metadata, amazon_metadata,
-                 rakuten_metadata, wikipedia_metadata)
+def is_magazine_code(ean):
+    return ean.startswith('491') and len(ean) == 13
+
+
+def title_and_creator_names(ndl_metadata, amazon_metadata, rakuten_metadata):
+    '''Wikipedia の検索結果を絞り込むためのタイトルと著者名を選ぶ'''
+    for M in (ndl_metadata, amazon_metadata, rakuten_metadata):
+        if M.title:
+            return M.title.name, [c.name for c in M.creators]
+    return None, []
 
 
 def metadata_from_jpno(jpno,
                        amazon_auth_info=None,
                        rakuten_application_id=None,
-                       use_wikipedia=False):
+                       use_wikipedia=False,
+                       transport=None):
+    key = _metadata_cache_key('JPNO', jpno.replace('-', ''), amazon_auth_info,
+                              rakuten_application_id, use_wikipedia)
+    return _cached(key, key + (None, transport), _metadata_from_jpno, jpno,
+                   amazon_auth_info, rakuten_application_id, use_wikipedia,
+                   transport)
+
+
+def _metadata_from_jpno(jpno,
+                        amazon_auth_info=None,
+                        rakuten_application_id=None,
+                        use_wikipedia=False,
+                        transport=None):
     jpno = jpno.replace('-', '')
-    metadata = ndl.metadata_from_jpno(jpno)
+    metadata = ndl.metadata_from_jpno(jpno, transport)
     if not metadata.identifiers:
         metadata.identifiers['JPNO'] = jpno
     if 'ISBN13' in metadata.identifiers:
         return metadata_from_isbn(metadata.identifiers['ISBN13'],
                                   amazon_auth_info,
                                   rakuten_application_id,
-                                  use_wikipedia)
+                                  use_wikipedia,
+                                  transport=transport)
     return metadata
 
 
+def _metadata_cache_key(id_type, identifier, amazon_auth_info,
+                        rakuten_application_id, use_wikipedia):
+    # 結果は認証情報の値ではなく，どの API を使ったかにだけ依存する
+    return (id_type, identifier, bool(amazon_auth_info),
+            bool(rakuten_application_id), bool(use_wikipedia))
+
+
+# 実行中の同じ問い合わせをまとめる
+# merge() などは結果を書き換えるので，待っていた呼び出し元にはコピーを返す
+_flights = singleflight.Group(copy=copy.deepcopy)
+
+
+def _cached(key, flight_key, func, *args):
+    '''
+    key (_metadata_cache_key) で統合済みのメタデータのキャッシュを引き，無ければ func(*args) を呼ぶ．
+    flight_key には key に締め切りとトランスポートを加えたものを渡す
+    (締め切りの短い呼び出しの不完全な結果や，別のトランスポートの結果を共有しないように)
+    '''
+    metadata_cache = cache.get_metadata_cache()
+    if metadata_cache is None:
+        return _flights.do(flight_key, func, *args)
+    metadata = metadata_cache.get(key)
+    if metadata is None:
+        metadata = _flights.do(flight_key, func, *args)
+        # 締め切りに間に合わなかった API がある場合は保持しない
+        if not metadata.missing_sources:
+            metadata_cache.set(key, metadata)
+    return metadata
+
+
+def metadata_from_isbns(isbns,
+                        amazon_auth_info=None,
+                        rakuten_application_id=None,
+                        use_wikipedia=False,
+                        concurrency=4,
+                        on_error=None):
+    '''
+    複数の ISBN のメタデータを concurrency 件ずつ同時に取得する．
+    終わったものから順に (isbn, metadata) を yield する (順番は入力と一致しない)
+    isbns は必要になった分だけ読み進めるので，ジェネレータなど長い入力を渡してもよい
+    on_error を渡すと，失敗した ISBN は on_error(isbn, exception) を呼んで読み飛ばし，残りの取得を続ける．
+    省略した場合は例外をそのまま送出する
+    '''
+    return _metadata_as_completed(metadata_from_isbn, isbns, concurrency,
+                                  on_error, amazon_auth_info,
+                                  rakuten_application_id, use_wikipedia)
+
+
+def metadata_from_eans(eans,
+                       amazon_auth_info=None,
+                       rakuten_application_id=None,
+                       use_wikipedia=False,
+                       concurrency=4,
+                       on_error=None):
+    return _metadata_as_completed(metadata_from_ean, eans, concurrency,
+                                  on_error, amazon_auth_info,
+                                  rakuten_application_id, use_wikipedia)
+
+
+def metadata_from_jpnos(jpnos,
+                        amazon_auth_info=None,
+                        rakuten_application_id=None,
+                        use_wikipedia=False,
+                        concurrency=4,
+                        on_error=None):
+    return _metadata_as_completed(metadata_from_jpno, jpnos, concurrency,
+                                  on_error, amazon_auth_info,
+                                  rakuten_application_id, use_wikipedia)
+
+
+def _metadata_as_completed(func, identifiers, concurrency, on_error, *args):
+    for identifier, metadata, error in map_as_completed(
+            func, identifiers, concurrency, *args):
+        if error is None:
+            yield identifier, metadata
+        elif on_error is None:
+            raise error
+        else:
+            on_error(identifier, error)
+
+
+def map_as_completed(func, identifiers, concurrency, *args):
+    '''
+    identifiers の各要素について func(identifier, *args) を concurrency 件ずつ同時に実行し，
+    終わったものから順に (identifier, 結果, 例外) を yield する (結果と例外のどちらかは None)．
+    1件が失敗しても残りの実行は続ける
+    '''
+    # 同時に実行中の問い合わせは高々 concurrency 件．
+    # 1件終わるごとに入力を1件読んで次の問い合わせを始めるので，
+    # 入力がどれだけ長くても使うメモリは一定
+    identifiers = iter(identifiers)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for identifier in itertools.islice(identifiers, concurrency):
+            pending[executor.submit(func, identifier, *args)] = identifier
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                identifier = pending.pop(future)
+                for next_identifier in itertools.islice(identifiers, 1):
+                    next_future = executor.submit(func, next_identifier, *args)
+                    pending[next_future] = next_identifier
+                error = future.exception()
+                if error is None:
+                    yield identifier, future.result(), None
+                else:
+                    yield identifier, None, error
+
+
 def merge(ndl_metadata, amazon_metadata, rakuten_metadata, wikipedia_metadata):
     nm = ndl_metadata
     am = amazon_metadata
@@ -89,7 +320,7 @@ def merge(ndl_metadata, amazon_metadata, rakuten_metadata, wikipedia_metadata):
     series = nm.series
     if not nm.title:
         series = series or rm.series
-    series.extend(wm.series)
+    series = series + wm.series
     # 出版社
     publishers = (nm.publishers or rm.publishers or am.publishers)
     # 内容細目はNDLにしか存在しない
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+同じ問い合わせの同時実行をまとめる (single flight)
+
+新刊の発売直後などに同じ ISBN の問い合わせが同時にいくつも来た場合，
+最初の呼び出しだけが実際に問い合わせ，実行中に来た同じキーの呼び出しはその結果を待って共有する．
+終わった結果は保持しない (保持するのは cache の役割)．
+
+    group = singleflight.Group()
+    metadata = group.do(('EAN', '9784044292041'), lookup, '9784044292041')
+'''
+
+import threading
+from concurrent.futures import Future
+
+
+class Group(object):
+    '''
+    copy を渡すと，後から来た呼び出しには結果を copy(result) して返す
+    (結果を書き換える呼び出し元どうしが影響し合わないようにする)．
+    最初の呼び出しが結果を受け取る前に複製を作っておき，後から来た呼び出しはそれを複製する
+    '''
+
+    def __init__(self, copy=None):
+        self.copy = copy
+        self.calls = 0
+        self.shared = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        '''key が同じ呼び出しが実行中ならその結果 (または例外) を，無ければ func(*args) を返す'''
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            result = future.result()
+            return result if self.copy is None else self.copy(result)
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            # 最初の呼び出し元が結果を書き換えている間に後から来た呼び出しが複製しないように，
+            # 共有するのは返す前に作った複製
+            future.set_result(result if self.copy is None
+                              else self.copy(result))
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+    def stats(self):
+        return {'calls': self.calls, 'shared': self.shared,
+                'in_flight': len(self._futures)}
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+各 API への HTTP リクエストを送るトランスポート
+
+ホストごとに requests.Session を持ち，接続 (TCP/TLS) を使い回す．
+各モジュールの関数は transport 引数で受け取ったトランスポートを使い，
+省略した場合は get_transport() が返すデフォルトのものを使う．
+
+    from shoshi import transport
+    transport.set_transport(transport.Transport(pool_maxsize=32, retries=5))
+'''
+
+import time
+import threading
+import email.utils
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from . import cache, ratelimit, singleflight
+
+# リクエストのタイムアウト (接続, 読み込み) (秒)
+# 応答の無いサーバを永遠に待たないようにする
+DEFAULT_TIMEOUT = (10, 30)
+# 一時的なエラーとみなしてリトライするステータスコード
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# Retry-After で指定された待ち時間の上限 (秒)
+MAX_RETRY_AFTER = 60
+
+
+def retry_after(response):
+    '''Retry-After ヘッダ (秒数か日時) が指定する待ち時間 (秒)．無ければ None'''
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+    return min(max(0.0, date.timestamp() - time.time()), MAX_RETRY_AFTER)
+
+
+def should_retry_status(source, credential, status):
+    '''ステータスコードが status の応答をリトライするか (Transport と aio で共通)'''
+    if status not in RETRY_STATUS_CODES:
+        return False
+    # 制限を超えたという応答に，すぐ次のリクエストを送っても仕方がない
+    if status == 503 and ratelimit.limiter(source, credential) is not None:
+        return False
+    return True
+
+
+class Transport(object):
+    '''
+    pool_maxsize: ホストごとに保持する接続の数 (同時に問い合わせる数以上にする)
+    retries: 接続エラーや 5xx の場合のリトライ回数 (間隔は backoff_factor 秒から倍々に増える．
+             Retry-After があればそれに従う)．
+             リトライのたびにリクエスト数の制限 (ratelimit) を守る．
+             制限のある API (Amazon など) の 503 は制限を超えたという応答なのでリトライしない
+    single_flight: 同じ URL とパラメータへの GET が実行中なら，新たに送らずにその結果を待つ
+    '''
+
+    def __init__(self, pool_maxsize=10, retries=2, backoff_factor=0.5,
+                 timeout=DEFAULT_TIMEOUT, single_flight=True):
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.flights = singleflight.Group() if single_flight else None
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        session = requests.Session()
+        # リトライは _get で行う (urllib3 のリトライはリクエスト数の制限を通らないので使わない)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        session.headers['Connection'] = 'keep-alive'
+        return session
+
+    def session(self, url):
+        '''url のホスト用のセッション'''
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = self._sessions[host] = self._create_session()
+        return session
+
+    def get(self, source, url, params=None, credential=None):
+        '''
+        source (API の名前) へのリクエスト数の制限を守って GET し，本文 (バイト列) を返す．
+        エラーのステータスコードの場合は例外
+        '''
+        if self.flights is None:
+            return self._get(source, url, params, credential)
+        # ISBN と JPNO の問い合わせが同じ書誌の .rdf を同時に取得する場合など
+        key = (source, credential, cache.make_key(url, params))
+        return self.flights.do(key, self._get, source, url, params,
+                               credential)
+
+    def _get(self, source, url, params, credential):
+        attempt = 0
+        while True:
+            ratelimit.acquire(source, credential)
+            try:
+                response = self.session(url).get(url, params=params,
+                                                 timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            if attempt < self.retries and self.should_retry(
+                    source, credential, response):
+                wait = retry_after(response)
+                time.sleep(self.backoff(attempt) if wait is None else wait)
+                attempt += 1
+                continue
+            response.raise_for_status()
+            return response.content
+
+    def backoff(self, attempt):
+        '''attempt 回目 (0 から) のリトライまでの待ち時間 (秒)'''
+        return self.backoff_factor * (2 ** attempt)
+
+    def should_retry(self, source, credential, response):
+        return should_retry_status(source, credential, response.status_code)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_transport = Transport()
+
+
+def get_transport():
+    return _transport
+
+
+def set_transport(transport):
+    '''各モジュールがデフォルトで使うトランスポートを変更する'''
+    global _transport
+    _transport = transport
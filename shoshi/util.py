@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 
 import re
-from collections import Mapping
 import unicodedata
 
 
@@ -24,6 +23,22 @@ def isbn10to13(isbn10):
     return digits + str(checkdigit)
 
 
+def is_valid_isbn13(isbn13):
+    '''978 か 979 で始まり，チェックディジットが正しい ISBN13 (ハイフン無し) か'''
+    if (len(isbn13) != 13 or not isbn13.isdigit() or
+            isbn13[:3] not in ('978', '979')):
+        return False
+    return sum(int(isbn13[i]) * (1 + 2 * (i % 2)) for i in range(13)) % 10 == 0
+
+
+def normalize_ean(ean):
+    '''ハイフンを除き，ISBN10 は ISBN13 に変換する'''
+    ean = re.sub(r'[^\dxX]', '', ean).upper()
+    if len(ean) == 10:
+        return isbn10to13(ean)
+    return ean
+
+
 def normalize(text):
     if not isinstance(text, str):
         return text
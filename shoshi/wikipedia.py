@@ -5,27 +5,36 @@ from __future__ import division, print_function
 from __future__ import absolute_import, unicode_literals
 
 import re
+import json
 import requests
 import mwparserfromhell
+from mwparserfromhell.nodes import Template, Text
 import unicodedata
 import itertools
-from .util import isbn10to13, isbn13to10
+from . import cache
+from .transport import get_transport
+from .util import isbn10to13, isbn13to10, is_valid_isbn13
 from .metadata import Metadata, Series, Title
 
 
-def make_search_keyword_from_isbn(isbn):
-    '''与えられた ISBN (isbn) で wikipedia のページを検索するためのクエリを作成する'''
+def isbn10_and_isbn13(isbn):
+    '''ハイフン等を除いた (ISBN10, ISBN13) を返す．ISBN でなければ None'''
     # ハイフン等(-)を一旦削除
     isbn = re.sub(r'[^xX\d]', '', isbn)
     # wikipedia のページには ISBN10 や ISBN13 が入り交じっている
     if len(isbn) == 10:
-        isbn10 = isbn
-        isbn13 = isbn10to13(isbn10)
+        return isbn, isbn10to13(isbn)
     elif len(isbn) == 13:
-        isbn13 = isbn
-        isbn10 = isbn13to10(isbn13)
-    else:
+        return isbn13to10(isbn), isbn
+    return None
+
+
+def make_search_keyword_from_isbn(isbn):
+    '''与えられた ISBN (isbn) で wikipedia のページを検索するためのクエリを作成する'''
+    isbns = isbn10_and_isbn13(isbn)
+    if isbns is None:
         return None
+    isbn10, isbn13 = isbns
 
     # wikipedia のページに書かれている ISBN には，ハイフンの入れ方が数パターンある模様
     candidates = [
@@ -38,46 +47,380 @@ def make_search_keyword_from_isbn(isbn):
     return ' OR '.join('"ISBN {0}"'.format(c) for c in candidates)
 
 
-def find_page_about_series(isbn):
+def make_isbn_pattern(isbn):
+    '''ページの本文に ISBN10 か ISBN13 (ハイフンや空白の有無は問わない) が含まれるかを調べる正規表現'''
+    isbns = isbn10_and_isbn13(isbn)
+    if isbns is None:
+        return None
+    return re.compile(r'(?<![\dX])(?:{0})(?![\dX])'.format(
+        '|'.join(r'[-\s]?'.join(isbn) for isbn in isbns)), re.I)
+
+
+# 本文中の ISBN ("ISBN 4-04-429204-3"，"{{ISBN2|978-4-...}}"，"isbn = ..." など)
+ISBN_IN_TEXT_PATTERN = re.compile(
+    r'ISBN2?[^\dA-Za-z\n]{0,5}(\d[\d-]{8,15}[\dX])(?![\dX])', re.I)
+
+
+def isbns_from_text(text):
+    '''本文に含まれる ISBN をハイフンの入れ方によらず ISBN13 にして返す (チェックディジットが正しいものだけ)'''
+    isbns = []
+    for m in ISBN_IN_TEXT_PATTERN.finditer(text):
+        isbn = m.group(1).replace('-', '').upper()
+        if len(isbn) == 10 and isbn13to10(isbn10to13(isbn)) == isbn:
+            isbn = isbn10to13(isbn)
+        elif not is_valid_isbn13(isbn):
+            continue
+        if isbn not in isbns:
+            isbns.append(isbn)
+    return isbns
+
+
+URL = 'http://ja.wikipedia.org/w/api.php'
+# srsearch の最大の長さ (CirrusSearch の制限)
+MAX_SEARCH_LENGTH = 300
+# 1 回の検索で ISBN 1 つあたりに取得する結果の数
+SEARCH_LIMIT_PER_ISBN = 10
+# titles に指定できるページの数の上限
+MAX_TITLES = 50
+
+
+def find_page_about_series(isbn, transport=None):
     '''与えられたISBN (isbn) が指す書籍のシリーズに関係する Wikipedia のページを取得する'''
-    URL = 'http://ja.wikipedia.org/w/api.php'
+    wikicode, title, _ = find_series_page(isbn, transport)
+    return wikicode, title
+
+
+def find_series_page(isbn, transport=None):
+    '''find_page_about_series と同じだが，ページを取得した結果 (JSON) も合わせて返す'''
     # ISBN を用いて Wikipedia のページを検索し，ページのタイトルを取得
-    search_keyword = make_search_keyword_from_isbn(isbn)
-    res = requests.get(URL, params={
+    content = fetch(search_params(isbn), classify_search_content, transport)
+    titles = titles_from_search_data(json.loads(content))
+    # 候補のページの本文はまとめて取得する
+    contents = fetch_revisions(titles, transport)
+    for title in titles:
+        wikicode = wikicode_from_revisions_content(contents[title])
+        if wikicode:
+            return wikicode, title, contents[title]
+    return None, None, None
+
+
+def find_pages_about_series(isbns, transport=None):
+    '''
+    複数の ISBN について find_page_about_series を行う．
+    検索は srsearch の長さの上限まで OR でまとめ，ページの本文もまとめて取得する．
+    返り値は isbns の各要素をキーとする辞書
+    '''
+    return dict((isbn, (wikicode, title)) for isbn, (wikicode, title, _)
+                in find_series_pages(isbns, transport).items())
+
+
+def find_series_pages(isbns, transport=None):
+    '''find_pages_about_series と同じだが，ページを取得した結果 (JSON) も合わせて返す'''
+    # ISBN ごとの (調べるページのタイトル, 他の ISBN と一緒に検索したか)
+    candidates = {}
+    for group in group_search_keywords(
+            [isbn for isbn in dict.fromkeys(isbns)
+             if make_search_keyword_from_isbn(isbn)]):
+        content = fetch(search_params_from_keywords(
+            [make_search_keyword_from_isbn(isbn) for isbn in group]),
+            classify_search_content, transport)
+        data = json.loads(content)
+        for isbn in group:
+            if len(group) == 1:
+                candidates[isbn] = (titles_from_search_data(data), False)
+            else:
+                candidates[isbn] = (
+                    [page['title'] for page in data['query']['search']], True)
+
+    contents = fetch_revisions(
+        [title for titles, _ in candidates.values() for title in titles],
+        transport)
+
+    pages = {}
+    for isbn in isbns:
+        pages[isbn] = (None, None, None)
+        if isbn not in candidates:
+            continue
+        titles, shared = candidates[isbn]
+        if shared:
+            # どの ISBN にヒットしたのかは分からないので，本文にこの ISBN を含むページを選ぶ
+            pattern = make_isbn_pattern(isbn)
+            search = [{'title': title} for title in titles
+                      if text_from_revisions_content(contents[title], pattern)]
+            titles = titles_from_search_data({'query': {'search': search}})
+        for title in titles:
+            wikicode = wikicode_from_revisions_content(contents[title])
+            if wikicode:
+                pages[isbn] = (wikicode, title, contents[title])
+                break
+    return pages
+
+
+def group_search_keywords(isbns):
+    '''OR でつないだ検索語が MAX_SEARCH_LENGTH を超えないように isbns を分ける'''
+    groups = []
+    group = []
+    length = 0
+    for isbn in isbns:
+        keyword = make_search_keyword_from_isbn(isbn)
+        if group and length + len(' OR ') + len(keyword) > MAX_SEARCH_LENGTH:
+            groups.append(group)
+            group = []
+        length = (length + len(' OR ') if group else 0) + len(keyword)
+        group.append(isbn)
+    if group:
+        groups.append(group)
+    return groups
+
+
+def fetch(params, classify=None, transport=None):
+    transport = transport or get_transport()
+    return cache.cached('wikipedia', cache.make_key(URL, params),
+                        lambda: transport.get('wikipedia', URL, params),
+                        classify)
+
+
+def classify_search_content(content):
+    if json.loads(content)['query']['search']:
+        return cache.FOUND
+    return cache.NOT_FOUND
+
+
+def search_params(isbn):
+    return search_params_from_keywords([make_search_keyword_from_isbn(isbn)])
+
+
+def search_params_from_keywords(keywords):
+    '''複数の ISBN の検索語を OR でまとめて検索する'''
+    params = {
         'format': 'json',
         'action': 'query',
         'list': 'search',
-        'srsearch': search_keyword,
+        'srsearch': ' OR '.join(keywords),
         'srprop': 'timestamp',
-    })
-    # 面倒なので最大5タイトルしか調べない方向で
-    titles = [page['title'] for page in res.json()['query']['search']][:5]
+    }
+    if len(keywords) > 1:
+        params['srlimit'] = SEARCH_LIMIT_PER_ISBN * len(keywords)
+    return params
+
 
+def titles_from_search_data(data):
+    '''検索結果から，調べるページのタイトルを調べる順に返す'''
+    # 面倒なので最大5タイトルしか調べない方向で
+    titles = [page['title'] for page in data['query']['search']][:5]
     # "hogehogeシリーズ" というタイトルのページがあるならそちらを優先する
     # NOTE: 有名な小説や漫画のシリーズだと単巻ごとにページが存在することがある
-    for title in itertools.chain((title for title in titles if title.endswith('シリーズ')),
-                                 (title for title in titles if not title.endswith('シリーズ'))):
-        res = requests.get(URL, params={
-            'format': 'json',
-            'action': 'query',
-            'titles': title,
-            'prop': 'revisions',
-            'rvprop': 'content',
-        })
-        # Infobox animanga を含まなければ無視
-        try:
-            response_data = res.json()
-            pages = response_data['query']['pages']
-            content = list(pages.values())[0]['revisions'][0]['*']
-            wikicode = mwparserfromhell.parse(content)
-            if wikicode.filter_templates(matches=r'{{Infobox\s+animanga/(Novel|Manga)'):
-                return wikicode, title
-        except:
-            pass
-    return None, None
+    return list(itertools.chain(
+        (title for title in titles if title.endswith('シリーズ')),
+        (title for title in titles if not title.endswith('シリーズ'))))
+
+
+def revisions_params(title):
+    return {
+        'format': 'json',
+        'action': 'query',
+        'titles': title,
+        'prop': 'revisions',
+        'rvprop': 'content|ids',
+    }
+
+
+def fetch_revisions(titles, transport=None):
+    '''
+    titles の各ページの本文を MAX_TITLES 件ずつまとめて取得する．
+    返り値はタイトルから (1 ページ分の) revisions の結果 (JSON) への辞書．
+    キャッシュにはページごとに revisions_params(title) のキーで保存する
+    '''
+    contents = {}
+    pending = []
+    for title in dict.fromkeys(titles):
+        content = cache.lookup('wikipedia',
+                               cache.make_key(URL, revisions_params(title)))
+        if content is None:
+            pending.append(title)
+        else:
+            contents[title] = content
+
+    transport = transport or get_transport()
+    for i in range(0, len(pending), MAX_TITLES):
+        chunk = pending[i:i + MAX_TITLES]
+        content = transport.get('wikipedia', URL,
+                                revisions_params('|'.join(chunk)))
+        for title, page_content in split_revisions_content(
+                content, chunk).items():
+            contents[title] = page_content
+            cache.store('wikipedia',
+                        cache.make_key(URL, revisions_params(title)),
+                        page_content)
+    # 応答が大きすぎて続きに回されたページは 1 つずつ取得する
+    for title in pending:
+        if title not in contents:
+            contents[title] = fetch(revisions_params(title),
+                                    transport=transport)
+    return contents
+
+
+def split_revisions_content(content, titles):
+    '''複数ページの revisions の結果を，1 ページずつの結果 (JSON のバイト列) に分ける'''
+    query = json.loads(content).get('query', {})
+    # "ほげ_ふが" は "ほげ ふが" のように正規化されて返ってくる
+    requested = dict((title, title) for title in titles)
+    for normalized in query.get('normalized', []):
+        requested[normalized['to']] = normalized['from']
+    contents = {}
+    for page_id, page in query.get('pages', {}).items():
+        title = requested.get(page.get('title'))
+        if title is None:
+            continue
+        if 'revisions' not in page and 'missing' not in page:
+            continue
+        contents[title] = json.dumps(
+            {'query': {'pages': {page_id: page}}},
+            ensure_ascii=False).encode('utf-8')
+    return contents
+
+
+def text_from_revisions_content(content, pattern=None):
+    '''ページの本文を返す．pattern を指定した場合は，それを含まなければ None'''
+    _, text = revision_from_revisions_content(content)
+    if text is None:
+        return None
+    if pattern is not None and pattern.search(text) is None:
+        return None
+    return text
+
+
+def revision_from_revisions_content(content):
+    '''ページの (版 ID, 本文) を返す．取得できなかった場合は None'''
+    try:
+        pages = json.loads(content)['query']['pages']
+        revision = list(pages.values())[0]['revisions'][0]
+        return revision.get('revid'), revision['*']
+    except (ValueError, KeyError, IndexError):
+        return None, None
+
+
+def wikicode_from_revisions_content(content):
+    '''ページ本文を取得した結果 (JSON) を解析する．Infobox animanga を含まなければ None'''
+    try:
+        response_data = json.loads(content)
+        pages = response_data['query']['pages']
+        content = list(pages.values())[0]['revisions'][0]['*']
+        return wikicode_from_text(content)
+    except:
+        pass
+    return None
 
 
-def metadata_from_isbn(isbn, title, authors):
+def wikicode_from_text(text):
+    '''ページの本文を解析する．Infobox animanga を含まなければ None'''
+    wikicode = parse_infoboxes(text)
+    if wikicode.filter_templates(matches=r'{{Infobox\s+animanga/(Novel|Manga)'):
+        return wikicode
+    return None
+
+
+# シリーズのページの解析に必要なのは Infobox animanga/Header|Novel|Manga だけ．
+# ページ全体 (数百 KB になることもある) を mwparserfromhell で解析する代わりに，
+# 文字列の走査でこれらのテンプレートの範囲を探し，その部分だけを解析する
+INFOBOX_START_PATTERN = re.compile(
+    r'\{\{Infobox\s+animanga/(?:Header|Novel|Manga)', re.I)
+# 中身がテンプレートとして解釈されないタグ．含まれている場合はページ全体を解析する
+UNPARSED_TAG_PATTERN = re.compile(
+    r'<\s*(?:nowiki|pre|math|source|syntaxhighlight)\b', re.I)
+BRACE_OR_COMMENT_PATTERN = re.compile(r'\{\{+|\}\}+|<!--.*?(?:-->|\Z)', re.S)
+# HTML のタグ (属性に括弧を含むもの) と，閉じタグまでの中身．
+# mwparserfromhell はタグの中の括弧ではテンプレートを閉じないので，
+# 中の括弧が釣り合っていない場合はページ全体を解析する
+BRACED_ATTRIBUTE_PATTERN = re.compile(r'<\s*[A-Za-z/][^<>]*[{}][^<>]*>')
+TAG_CONTENT_PATTERN = re.compile(
+    r'<\s*(?!(?:br|hr|img|wbr)\b)([A-Za-z][\w:-]*)\b[^<>]*(?<!/)>'
+    r'(.*?)<\s*/\s*\1\s*>', re.S | re.I)
+BRACES_PATTERN = re.compile(r'\{+|\}+')
+
+
+def _balanced_braces(text):
+    depth = 0
+    for m in BRACES_PATTERN.finditer(text):
+        token = m.group()
+        depth += len(token) if token[0] == '{' else -len(token)
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def _has_braces_in_tags(text, start, end):
+    # 範囲の中で始まるタグを調べる (タグの中の "}}" で範囲が途中で終わっている場合もある)
+    m = BRACED_ATTRIBUTE_PATTERN.search(text, start)
+    if m is not None and m.start() < end:
+        return True
+    for m in TAG_CONTENT_PATTERN.finditer(text, start):
+        if m.start() >= end:
+            break
+        if not _balanced_braces(m.group(2)):
+            return True
+    return False
+
+
+def infobox_regions(text):
+    '''
+    Infobox animanga/Header|Novel|Manga の範囲 ((開始, 終了) のリスト) を返す．
+    入れ子になっている場合は外側だけを返す．範囲を確実に判定できない場合は None
+    '''
+    if UNPARSED_TAG_PATTERN.search(text):
+        return None
+    regions = []
+    depth = 0
+    start = None
+    start_depth = 0
+    for m in BRACE_OR_COMMENT_PATTERN.finditer(text):
+        token = m.group()
+        if token.startswith('<!--'):
+            if not token.endswith('-->'):
+                return None
+            continue
+        if token[0] == '{':
+            if start is None and INFOBOX_START_PATTERN.match(
+                    text, m.end() - 2):
+                if len(token) > 2:
+                    # "{{{{Infobox" は引数 ({{{...}}}) との組み合わせで解釈が変わる
+                    return None
+                start = m.end() - 2
+                start_depth = depth + len(token) - 2
+            depth += len(token)
+            continue
+        if start is not None and depth - len(token) <= start_depth:
+            # "}}}}" のように外側のテンプレートも一緒に閉じている場合がある
+            regions.append((start, m.start() + depth - start_depth))
+            start = None
+        depth -= len(token)
+    if start is not None:
+        return None
+    if any(_has_braces_in_tags(text, start, end) for start, end in regions):
+        return None
+    return regions
+
+
+def parse_infoboxes(text):
+    '''
+    text のうち Infobox animanga の部分だけを解析した Wikicode を返す．
+    テンプレートの検索結果はページ全体を解析した場合と同じになる
+    '''
+    regions = infobox_regions(text)
+    if regions is None:
+        return mwparserfromhell.parse(text)
+    wikicode = mwparserfromhell.parse(
+        '\n'.join(text[start:end] for start, end in regions))
+    # 範囲の判定が mwparserfromhell の解釈と食い違っていたらページ全体を解析する
+    templates = [node for node in wikicode.nodes
+                 if not (isinstance(node, Text) and node.value == '\n')]
+    if (len(templates) != len(regions) or
+            not all(isinstance(node, Template) for node in templates)):
+        return mwparserfromhell.parse(text)
+    return wikicode
+
+
+def metadata_from_isbn(isbn, title, authors, transport=None):
     '''
     Wikipedia の API を利用して，与えられたISBN (isbn) が指す書籍のメタデータを取得する
     タイトルや著者情報が必要な理由はファンブックや解説書対策
@@ -85,11 +428,123 @@ def metadata_from_isbn(isbn, title, authors):
       『化物語アニメコンプリートガイドブック ひたぎクラブ』のISBN (ISBN 978-4-06-216226-5) が
       「〈物語〉シリーズ」のページに含まれているが，この書籍を "〈物語〉シリーズ" 見なしたくない．
     '''
-    authors_set = set([re.sub(r'\s', '', a) for a in authors])
-    wikicode, page_title = find_page_about_series(isbn)
+    info = find_series_info(isbn, transport)
+    return metadata_from_series_info(info, title, authors)
+
+
+_series_index = None
+_offline = False
+
+
+def get_series_index():
+    '''set_series_index で設定した索引．無ければ None'''
+    return _series_index
+
+
+def is_offline():
+    '''索引に無い ISBN を Wikipedia に問い合わせないか (set_series_index の offline)'''
+    return _offline
+
+
+def set_series_index(index, offline=False):
+    '''
+    find_series_info が最初に index (wikipedia_index.SeriesIndex) を引くようにする．
+    offline が True なら index に無い ISBN は Wikipedia に問い合わせずに "見つからない" とする．
+    False なら問い合わせて見つけたシリーズのページを，そこに書かれている全ての ISBN で index に登録する．
+    None を渡すと無効になる
+    '''
+    global _series_index, _offline
+    _series_index = index
+    _offline = offline
+
 
+def find_series_info(isbn, transport=None):
+    '''
+    与えられた ISBN (isbn) が指す書籍のシリーズのページを探し，
+    series_info_from_wikicode の結果を返す．見つからなければ None
+    '''
+    index = _series_index
+    if index is not None:
+        infos = index.lookup(isbn)
+        if infos:
+            return infos[0]
+        if _offline:
+            return None
+    wikicode, page_title, content = find_series_page(isbn, transport)
+    if not wikicode:
+        return None
+    info = series_info_from_wikicode(wikicode, page_title)
+    harvest_series_page(page_title, content, info)
+    return info
+
+
+def find_series_infos(isbns, transport=None):
+    '''
+    複数の ISBN について find_series_info を行う．索引に無いものは find_series_pages でまとめて調べる．
+    返り値は isbns の各要素をキーとする辞書
+    '''
+    infos = {}
+    pending = []
+    index = _series_index
+    for isbn in isbns:
+        found = index.lookup(isbn) if index is not None else None
+        if found:
+            infos[isbn] = found[0]
+        elif index is not None and _offline:
+            infos[isbn] = None
+        else:
+            pending.append(isbn)
+    if not pending:
+        return infos
+
+    # 同じシリーズの巻が並ぶことが多いので，ページごとに一度だけ解析する
+    by_title = {}
+    for isbn, (wikicode, title, content) in find_series_pages(
+            pending, transport).items():
+        if not wikicode:
+            infos[isbn] = None
+            continue
+        if title not in by_title:
+            by_title[title] = series_info_from_wikicode(wikicode, title)
+            harvest_series_page(title, content, by_title[title])
+        infos[isbn] = by_title[title]
+    return infos
+
+
+def harvest_series_page(page_title, content, info):
+    '''
+    取得したシリーズのページ (content) に書かれている ISBN をすべて索引に登録し，
+    同じシリーズの他の巻は検索せずに済むようにする (索引が無効なら何もしない)
+    '''
+    index = _series_index
+    if index is None:
+        return
+    revid, text = revision_from_revisions_content(content)
+    if text is None:
+        return
+    # 登録済みの版と同じなら ISBN を取り出し直すまでもない
+    if revid is not None and index.revid(page_title) == revid:
+        return
+    index.add(page_title, revid, info, isbns_from_text(text))
+
+
+def metadata_from_series_page(wikicode, page_title, title, authors):
+    '''
+    find_page_about_series で取得したページ (wikicode, page_title) から，
+    タイトル (title) と著者 (authors) が一致する書籍のメタデータを作成する
+    ページの検索には ISBN しか必要ないので，タイトルや著者の取得と並行して検索できる
+    '''
     if not wikicode:
         return Metadata()
+    return metadata_from_series_info(
+        series_info_from_wikicode(wikicode, page_title), title, authors)
+
+
+def series_info_from_wikicode(wikicode, page_title):
+    '''
+    シリーズのページから，ジャンルと各メディア (小説や漫画) のタイトルと著者を取り出す．
+    返り値は JSON にできる辞書で，書籍ごとの絞り込みは metadata_from_series_info で行う
+    '''
 
     def remove_tags(code):
         for tag in code.ifilter_tags():
@@ -166,6 +621,25 @@ def metadata_from_isbn(isbn, title, authors):
             'authors': adaptation_authors,
         })
 
+    return {
+        'title': page_title,
+        'genre': genre,
+        'adaptations': adaptations,
+    }
+
+
+def metadata_from_series_info(info, title, authors):
+    '''
+    series_info_from_wikicode で取り出したシリーズの情報 (info) から，
+    タイトル (title) と著者 (authors) が一致する書籍のメタデータを作成する
+    '''
+    authors_set = set([re.sub(r'\s', '', a) for a in authors])
+    if not info:
+        return Metadata()
+    page_title = info['title']
+    genre = list(info['genre'])
+    adaptations = info['adaptations']
+
     def contais_adaptation_title(title, adaptation_title):
         # 括弧で囲まれた補足情報とか面倒なので消す
         pattern = re.compile(r'(\(.+?\))|(（.+?）)|(【.+?】)|\W')
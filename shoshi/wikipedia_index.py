@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ISBN からシリーズのページ (Infobox animanga を含むページ) を引く索引
+
+Wikipedia の全ページのダンプ (jawiki-latest-pages-articles.xml.bz2) から作る:
+
+    % python -m shoshi build-wikipedia-index jawiki-latest-pages-articles.xml.bz2 \\
+        --output wikipedia-series.sqlite3
+
+作った索引を set_series_index で設定すると，wikipedia.metadata_from_isbn は
+検索 API に問い合わせずに索引から答える:
+
+    from shoshi import wikipedia
+    from shoshi.wikipedia_index import SeriesIndex
+    wikipedia.set_series_index(SeriesIndex('wikipedia-series.sqlite3'), offline=True)
+'''
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import lxml.etree
+from . import wikipedia
+from .util import isbn10to13
+
+# ダンプから索引を作る際に，何ページごとにコミットするか
+COMMIT_INTERVAL = 1000
+
+
+class SeriesIndex(object):
+    '''
+    SQLite のファイルに保存する ISBN → シリーズの索引
+    ページごとにタイトル，版 ID (revid) と series_info_from_wikicode の結果を持つ
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        # sqlite3 の接続はスレッド間で共有できないので，スレッドごとに作る
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                ' title TEXT PRIMARY KEY,'
+                ' revid INTEGER,'
+                ' info TEXT NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS isbns ('
+                ' isbn TEXT NOT NULL,'
+                ' title TEXT NOT NULL,'
+                ' PRIMARY KEY (isbn, title)) WITHOUT ROWID')
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def add(self, title, revid, info, isbns, commit=True):
+        '''ページを登録する (既にあれば置き換える)．isbns は ISBN13 のリスト'''
+        connection = self._connect()
+        connection.execute(
+            'INSERT OR REPLACE INTO pages (title, revid, info) VALUES (?, ?, ?)',
+            (title, revid, json.dumps(info, ensure_ascii=False)))
+        connection.execute('DELETE FROM isbns WHERE title = ?', (title,))
+        connection.executemany(
+            'INSERT OR IGNORE INTO isbns (isbn, title) VALUES (?, ?)',
+            [(isbn, title) for isbn in isbns])
+        if commit:
+            connection.commit()
+
+    def commit(self):
+        self._connect().commit()
+
+    def revid(self, title):
+        '''登録されているページの版 ID．無ければ None'''
+        row = self._connect().execute(
+            'SELECT revid FROM pages WHERE title = ?', (title,)).fetchone()
+        return None if row is None else row[0]
+
+    def lookup(self, isbn):
+        '''
+        isbn (ISBN10 でも ISBN13 でもよい) を含むページの情報のリストを返す．
+        "〜シリーズ" というタイトルのページを優先する
+        '''
+        isbn = isbn.replace('-', '').upper()
+        if len(isbn) == 10:
+            isbn = isbn10to13(isbn)
+        rows = self._connect().execute(
+            'SELECT pages.title, pages.info FROM isbns'
+            ' JOIN pages ON isbns.title = pages.title'
+            ' WHERE isbns.isbn = ?', (isbn,)).fetchall()
+        rows.sort(key=lambda row: (not row[0].endswith('シリーズ'), row[0]))
+        return [json.loads(info) for _, info in rows]
+
+
+def iter_series_pages_from_dump(source):
+    '''
+    ダンプ (pages-articles の XML) を先頭から読み，
+    Infobox animanga/Novel か Manga を含む標準名前空間のページごとに
+    (タイトル, 版 ID, series_info_from_wikicode の結果, 本文中の ISBN13 のリスト) を返す．
+    読み終えたページは捨てるので，ダンプ全体をメモリに載せることはない
+    '''
+    for _, page in lxml.etree.iterparse(source, events=('end',),
+                                        tag='{*}page', huge_tree=True):
+        ns = page.findtext('{*}ns')
+        title = page.findtext('{*}title')
+        revision = page.find('{*}revision')
+        revid = text = None
+        if revision is not None:
+            revid = revision.findtext('{*}id')
+            text = revision.findtext('{*}text')
+        page.clear()
+        while page.getprevious() is not None:
+            del page.getparent()[0]
+
+        if ns not in (None, '0') or not text:
+            continue
+        # 大半のページは Infobox animanga を含まないので，解析する前に除く
+        if wikipedia.INFOBOX_START_PATTERN.search(text) is None:
+            continue
+        isbns = wikipedia.isbns_from_text(text)
+        if not isbns:
+            continue
+        wikicode = wikipedia.wikicode_from_text(text)
+        if wikicode is None:
+            continue
+        yield (title, int(revid) if revid else None,
+               wikipedia.series_info_from_wikicode(wikicode, title), isbns)
+
+
+def build_index_from_dump(source, index):
+    '''ダンプの各ページを index に登録し，登録したページ数を返す'''
+    count = 0
+    for title, revid, info, isbns in iter_series_pages_from_dump(source):
+        index.add(title, revid, info, isbns, commit=False)
+        count += 1
+        if count % COMMIT_INTERVAL == 0:
+            index.commit()
+    index.commit()
+    return count
+
+
+def main(argv=None):
+    from .ingest import open_dump
+    parser = argparse.ArgumentParser(
+        prog='python -m shoshi build-wikipedia-index',
+        description='build an ISBN to series index from a jawiki '
+                    'pages-articles XML dump')
+    parser.add_argument('path', metavar='DUMP',
+                        help='XML dump (.gz and .bz2 are decompressed, '
+                             '- reads stdin)')
+    parser.add_argument('--output', action="store", dest="output",
+                        required=True, help='SQLite file to write the index to')
+    args = parser.parse_args(argv)
+
+    index = SeriesIndex(args.output)
+    f = open_dump(args.path)
+    try:
+        count = build_index_from_dump(f, index)
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+    print('{0} pages'.format(count), file=sys.stderr)
+    return 0
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+複数のテストで使うデータと，各 API の代わりをする偽物
+(tests/ は pytest や unittest discover で sys.path に入るので，from support import ... で使う)
+'''
+
+import os
+import json
+import threading
+from shoshi import wikipedia
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read_data(name):
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def run_concurrently(func, count):
+    '''func(0) から func(count - 1) を別々のスレッドで同時に呼び，結果のリストを返す'''
+    results = [None] * count
+
+    def target(i):
+        results[i] = func(i)
+
+    threads = [threading.Thread(target=target, args=(i,))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class FakeTransport(object):
+    '''どの URL にも content を返すトランスポート'''
+
+    def __init__(self, content):
+        self.content = content
+        self.params = []
+
+    def get(self, source, url, params=None, credential=None):
+        self.params.append(params)
+        return self.content
+
+
+PAGES = {
+    '涼宮ハルヒシリーズ': '''{{Infobox animanga/Header
+| タイトル = 涼宮ハルヒシリーズ
+| ジャンル = [[学園]]、[[SF]]
+}}
+{{Infobox animanga/Novel
+| 著者 = [[谷川流]]
+| イラスト = [[いとうのいぢ]]
+}}
+* 『涼宮ハルヒの憂鬱』 ISBN 4-04-429201-9
+* 『涼宮ハルヒの消失』 ISBN 4-04-429204-3
+''',
+    '“文学少女”シリーズ': '''{{Infobox animanga/Novel
+| 著者 = [[野村美月]]
+| イラスト = 竹岡美穂
+}}
+* 『“文学少女”と死にたがりの道化』 {{ISBN2|978-4-7577-2806-6}}
+''',
+    'ライトノベル': '''ライトノベルの例: ISBN 4-04-429204-3, ISBN 4-7577-2806-9
+''',
+}
+
+
+class FakeMediaWiki(object):
+    '''list=search と prop=revisions に答えるだけの Wikipedia'''
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, source, url, params=None, credential=None):
+        self.requests.append(params)
+        if params.get('list') == 'search':
+            titles = [title for title, text in sorted(PAGES.items())
+                      if any(wikipedia.make_isbn_pattern(k).search(text)
+                             for k in _isbns_in_query(params['srsearch']))]
+            data = {'query': {'search': [{'title': t} for t in titles]}}
+        else:
+            pages = {}
+            for i, title in enumerate(params['titles'].split('|')):
+                if title in PAGES:
+                    pages[str(i)] = {'title': title, 'revisions': [
+                        {'revid': len(PAGES[title]), '*': PAGES[title]}]}
+                else:
+                    pages[str(-i - 1)] = {'title': title, 'missing': ''}
+            data = {'query': {'pages': pages}}
+        return json.dumps(data).encode('utf-8')
+
+
+def _isbns_in_query(query):
+    return [keyword.strip('"').split(' ')[1]
+            for keyword in query.split(' OR ')]
@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import asyncio
+import unittest
+import aiohttp
+from unittest import mock
+from shoshi import aio, amazon, cache, ndl, rakuten, ratelimit, wikipedia
+from support import FakeMediaWiki, read_data
+
+OPENSEARCH = '''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel>
+<item>
+<link>http://iss.ndl.go.jp/books/R100000002-I000007442470-00</link>
+<guid isPermaLink="true">http://iss.ndl.go.jp/books/R100000002-I000007442470-00</guid>
+</item>
+</channel></rss>
+'''.encode('utf-8')
+
+RAKUTEN = json.dumps({'count': 1, 'Items': [{'Item': {
+    'title': '涼宮ハルヒの消失',
+    'titleKana': 'スズミヤ ハルヒ ノ ショウシツ',
+    'author': '谷川流/いとうのいぢ',
+    'authorKana': 'タニガワ,ナガル/イトウ,ノイジ',
+    'itemPrice': 555,
+    'salesDate': '2004年07月',
+    'publisherName': '角川書店',
+    'itemUrl': 'http://books.rakuten.co.jp/rb/1700633/',
+}}]}).encode('utf-8')
+
+
+class FakeResponse(object):
+    def __init__(self, session, status, body):
+        self.session = session
+        self.status = status
+        self.body = body
+        self.headers = {}
+
+    async def __aenter__(self):
+        if isinstance(self.status, Exception):
+            raise self.status
+        try:
+            await asyncio.sleep(self.session.delays.get(self.status, 0))
+        except asyncio.CancelledError:
+            self.session.cancelled += 1
+            raise
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def read(self):
+        return self.body
+
+
+class FakeSession(object):
+    '''
+    各 API の代わりに記録した応答を返す aiohttp.ClientSession．
+    楽天への応答は rakuten_status で，応答までの時間はステータスコードごとに delays で変えられる．
+    rakuten_status はリストなら 1 回ごとに順に使い，例外なら応答の代わりに送出する
+    '''
+
+    def __init__(self, rakuten_status=200, delays=None):
+        self.rakuten_status = rakuten_status
+        self.delays = delays or {}
+        self.wikipedia = FakeMediaWiki()
+        self.urls = []
+        self.cancelled = 0
+
+    def get(self, url, params=None):
+        self.urls.append(url)
+        status, body = self.route(url, params or {})
+        return FakeResponse(self, status, body)
+
+    def route(self, url, params):
+        if url == ndl.OPENSEARCH_URL:
+            return 200, OPENSEARCH
+        if url.startswith('http://iss.ndl.go.jp/books/'):
+            return 200, read_data('ndl_haruhi.rdf')
+        if url == ndl.SRU_URL:
+            return 200, read_data('ndl_sru_batch.xml')
+        if url == rakuten.BOOKS_BOOK_URL:
+            if isinstance(self.rakuten_status, list):
+                return self.rakuten_status.pop(0), RAKUTEN
+            return self.rakuten_status, RAKUTEN
+        if url.startswith('https://webservices.amazon.co.jp/'):
+            return 200, amazon.split_item_lookup_content(
+                read_data('amazon_item_lookup_batch.xml'),
+                ['9784044292041'])['9784044292041']
+        if url == wikipedia.URL:
+            return 200, self.wikipedia.get('wikipedia', url, params)
+        return 404, b''
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        # リクエスト数の制限で待たないようにする
+        for source in ('amazon', 'rakuten'):
+            ratelimit.set_rate(source, None)
+            self.addCleanup(ratelimit.set_rate, source,
+                            *ratelimit.DEFAULT_RATES[source])
+        # リトライの間隔で待たないようにする
+        patcher = mock.patch.object(aio, 'BACKOFF_FACTOR', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_metadata_from_isbn(self):
+        session = FakeSession()
+        metadata = run(aio.metadata_from_isbn(
+            '4-04-429204-3', ('KEY', 'SECRET', 'tag'), 'APP', True,
+            session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertEqual('9784044292041', metadata.identifiers['ISBN13'])
+        self.assertEqual('4044292043', metadata.identifiers['ASIN'])
+        self.assertIn('涼宮ハルヒシリーズ',
+                      [series.title.name for series in metadata.series])
+        self.assertIn('http://books.rakuten.co.jp/rb/1700633/',
+                      metadata.links)
+
+    def test_credential_pool(self):
+        # 認証情報はキャッシュに無かった場合だけ取り出す
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache.set_cache(cache.SQLiteCache(
+            os.path.join(directory, 'cache.sqlite3')))
+        self.addCleanup(cache.set_cache, None)
+        pool = amazon.CredentialPool([('KEY', 'SECRET', 'tag')],
+                                     daily_quota=1)
+        for _ in range(2):
+            session = FakeSession()
+            metadata = run(aio.metadata_from_isbn('4-04-429204-3', pool,
+                                                  session=session))
+            self.assertEqual('4044292043', metadata.identifiers['ASIN'])
+        self.assertEqual({'KEY': 1}, pool.usage)
+        # 使い切った場合は Amazon の結果を空にする
+        metadata = run(aio.metadata_from_isbn('978-4-7577-2806-6', pool,
+                                              session=FakeSession()))
+        self.assertNotIn('ASIN', metadata.identifiers)
+
+    def test_failed_source(self):
+        # 失敗した API の結果は空として統合する
+        session = FakeSession(rakuten_status=500)
+        metadata = run(aio.metadata_from_ean(
+            '978-4-04-429204-1', rakuten_application_id='APP',
+            session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertNotIn('http://books.rakuten.co.jp/rb/1700633/',
+                         metadata.links)
+
+    def test_retry(self):
+        # 5xx や接続エラーはリトライし，間隔は BACKOFF_FACTOR 秒から倍々に空ける
+        session = FakeSession(rakuten_status=[
+            500, aiohttp.ClientConnectionError('connection reset'), 200])
+        started_at = time.monotonic()
+        with mock.patch.object(aio, 'BACKOFF_FACTOR', 0.05):
+            metadata = run(aio.metadata_from_ean(
+                '978-4-04-429204-1', rakuten_application_id='APP',
+                session=session))
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.15)
+        self.assertIn('http://books.rakuten.co.jp/rb/1700633/',
+                      metadata.links)
+        self.assertEqual(3, session.urls.count(rakuten.BOOKS_BOOK_URL))
+
+    def test_no_retry_on_client_error(self):
+        session = FakeSession(rakuten_status=400)
+        metadata = run(aio.metadata_from_ean(
+            '978-4-04-429204-1', rakuten_application_id='APP',
+            session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertEqual(1, session.urls.count(rakuten.BOOKS_BOOK_URL))
+
+    def test_source_timeout(self):
+        # 1つの API の読み込みのタイムアウトは，その API の結果を空にするだけ
+        session = FakeSession(rakuten_status=asyncio.TimeoutError())
+        metadata = run(aio.metadata_from_ean(
+            '978-4-04-429204-1', rakuten_application_id='APP',
+            session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertEqual(3, session.urls.count(rakuten.BOOKS_BOOK_URL))
+
+    def test_metadata_from_jpno(self):
+        session = FakeSession()
+        metadata = run(aio.metadata_from_jpno(
+            '20647414', rakuten_application_id='APP', session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertEqual('20647414', metadata.identifiers['JPNO'])
+        self.assertIn(rakuten.BOOKS_BOOK_URL, session.urls)
+
+    def test_sru(self):
+        ndl.set_api('sru')
+        self.addCleanup(ndl.set_api, 'opensearch')
+        session = FakeSession()
+        metadata = run(aio.metadata_from_isbn('9784044292041',
+                                              session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertEqual([ndl.SRU_URL], session.urls)
+
+    def test_offline_series_index(self):
+        class EmptyIndex(object):
+            def lookup(self, isbn):
+                return []
+
+        wikipedia.set_series_index(EmptyIndex(), offline=True)
+        self.addCleanup(wikipedia.set_series_index, None)
+        session = FakeSession()
+        metadata = run(aio.metadata_from_isbn('9784044292041',
+                                              use_wikipedia=True,
+                                              session=session))
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertNotIn('涼宮ハルヒシリーズ',
+                         [series.title.name for series in metadata.series])
+        self.assertNotIn(wikipedia.URL, session.urls)
+
+    def test_timeout(self):
+        session = FakeSession(delays={200: 1})
+
+        async def lookup():
+            try:
+                await aio.metadata_from_isbn(
+                    '9784044292041', rakuten_application_id='APP',
+                    session=session, timeout=0.1)
+            finally:
+                # キャンセルされたリクエストが後始末を終えるのを待つ
+                await asyncio.sleep(0.01)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            run(lookup())
+        self.assertEqual(2, session.cancelled)
+
+    def test_cancel(self):
+        session = FakeSession(delays={200: 1})
+
+        async def lookup():
+            task = asyncio.ensure_future(aio.metadata_from_isbn(
+                '9784044292041', ('KEY', 'SECRET', 'tag'), 'APP', True,
+                session=session))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            finally:
+                await asyncio.sleep(0.01)
+
+        with self.assertRaises(asyncio.CancelledError):
+            run(lookup())
+        # NDL，Amazon，楽天，Wikipedia の問い合わせがすべてキャンセルされる
+        self.assertEqual(4, session.cancelled)
+
+
+if __name__ == '__main__':
+    unittest.main()
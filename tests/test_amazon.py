@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from shoshi import amazon, cache
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read_data(name):
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class FakeTransport(object):
+    def __init__(self, content):
+        self.content = content
+        self.urls = []
+
+    def get(self, source, url, params=None, credential=None):
+        self.urls.append(url)
+        return self.content
+
+
+class TestBatch(unittest.TestCase):
+    def test_split_item_lookup_content(self):
+        contents = amazon.split_item_lookup_content(
+            read_data('amazon_item_lookup_batch.xml'),
+            ['9784044292041', '9784757728066', '9784000000000'])
+        self.assertEqual(
+            '4044292043',
+            amazon.metadata_from_item_lookup_content(
+                contents['9784044292041']).identifiers['ASIN'])
+        self.assertEqual(
+            '4757728069',
+            amazon.metadata_from_item_lookup_content(
+                contents['9784757728066']).identifiers['ASIN'])
+        self.assertIsNone(amazon.metadata_from_item_lookup_content(
+            contents['9784000000000']).title)
+
+    def test_metadata_from_eans(self):
+        transport = FakeTransport(read_data('amazon_item_lookup_batch.xml'))
+        results = amazon.metadata_from_eans(
+            ['4-04-429204-3', '978-4-7577-2806-6'],
+            [('key', 'secret', 'tag')], transport=transport)
+        self.assertEqual(1, len(transport.urls))
+        self.assertIn('ItemId=9784044292041%2C9784757728066',
+                      transport.urls[0])
+        self.assertEqual('涼宮ハルヒの消失 (角川スニーカー文庫)',
+                         results['4-04-429204-3'].title.name)
+        self.assertEqual('エンターブレイン',
+                         results['978-4-7577-2806-6'].publishers[0].name)
+
+
+class TestCredentialPool(unittest.TestCase):
+    def test_daily_quota(self):
+        pool = amazon.CredentialPool([('a', 'A', 'tag'), ('b', 'B', 'tag')],
+                                     daily_quota=1)
+        with mock.patch.object(pool, '_wait_time', return_value=0):
+            keys = set(pool.acquire()[0] for _ in range(2))
+            self.assertEqual(set(['a', 'b']), keys)
+            self.assertRaises(amazon.QuotaExceededError, pool.acquire)
+
+    def test_cache_hit_does_not_use_quota(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache.set_cache(cache.SQLiteCache(
+            os.path.join(directory, 'cache.sqlite3')))
+        self.addCleanup(cache.set_cache, None)
+        content = amazon.split_item_lookup_content(
+            read_data('amazon_item_lookup_batch.xml'),
+            ['9784044292041'])['9784044292041']
+        transport = FakeTransport(content)
+        pool = amazon.CredentialPool([('a', 'A', 'tag')], daily_quota=1)
+        with mock.patch.object(pool, '_wait_time', return_value=0):
+            for _ in range(3):
+                metadata = amazon.metadata_from_ean_with_pool(
+                    '4-04-429204-3', pool, transport=transport)
+                self.assertEqual('4044292043', metadata.identifiers['ASIN'])
+        # 問い合わせたのは最初の1回だけで，残りはキャッシュから返す
+        self.assertEqual(1, len(transport.urls))
+        self.assertEqual({'a': 1}, pool.usage)
@@ -0,0 +1,29 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import unittest
+from shoshi.amazon_magazine import parse_magazine_title, parse_magazine_titles
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class TestMagazineTitle(unittest.TestCase):
+    def setUp(self):
+        # 期待値は前処理による足切りを入れる前の parse_magazine_title の出力
+        path = os.path.join(DATA_DIR, 'amazon_magazine_titles.jsonl')
+        with open(path, encoding='utf-8') as f:
+            self.records = [json.loads(line) for line in f]
+
+    def test_parse_magazine_titles(self):
+        actual = parse_magazine_titles(r['title'] for r in self.records)
+        for record, metadata in zip(self.records, actual):
+            self.assertEqual(record['expected'], metadata, record['title'])
+
+    def test_parse_magazine_title(self):
+        self.assertEqual(
+            {'title': 'ユリイカ', 'volume': '2013年12月号',
+             'volume_title': '特集=高畑勲「かぐや姫の物語」の世界'},
+            parse_magazine_title('ユリイカ 2013年12月号 特集=高畑勲「かぐや姫の物語」の世界'))
+        self.assertEqual({}, parse_magazine_title('号泣する準備はできていた'))
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import unittest
+from unittest import mock
+from shoshi import batch
+from shoshi.metadata import Metadata
+
+
+class TestBatch(unittest.TestCase):
+    def test_identifier_type(self):
+        self.assertEqual('isbn', batch.identifier_type('4-04-429204-3'))
+        self.assertEqual('isbn', batch.identifier_type('978-4-04-429204-1'))
+        self.assertEqual('ean', batch.identifier_type('4910155950506'))
+        self.assertEqual('jpno', batch.identifier_type('20609090'))
+        self.assertIsNone(batch.identifier_type('4-04-429204-4'))
+        self.assertIsNone(batch.identifier_type('hoge'))
+
+    def test_run_batch(self):
+        def isbn_lookup(isbn, *args):
+            if isbn == '9784000000002':
+                raise IOError('connection reset')
+            return Metadata(identifiers={'ISBN13': isbn})
+
+        def jpno_lookup(jpno, *args):
+            return Metadata(identifiers={'JPNO': jpno})
+
+        lines = ['# comment', '978-4-04-429204-1', '', '20609090',
+                 '9784000000002', 'hoge']
+        output = io.StringIO()
+        with mock.patch.object(batch, 'metadata_from_isbn', isbn_lookup), \
+                mock.patch.object(batch, 'metadata_from_jpno', jpno_lookup):
+            self.assertEqual((4, 2), batch.run_batch(lines, output, jobs=2))
+        records = dict((record['input'], record) for record in
+                       map(json.loads, output.getvalue().splitlines()))
+        self.assertEqual({'ISBN13': '978-4-04-429204-1'},
+                         records['978-4-04-429204-1']['metadata']['identifiers'])
+        self.assertEqual({'JPNO': '20609090'},
+                         records['20609090']['metadata']['identifiers'])
+        self.assertEqual('connection reset', records['9784000000002']['error'])
+        self.assertEqual('unrecognized identifier', records['hoge']['error'])
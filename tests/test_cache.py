@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import asyncio
+import shutil
+import threading
+import time
+import tempfile
+import unittest
+from unittest import mock
+from shoshi import cache, shoshi
+from shoshi.metadata import Metadata
+
+
+class TestSQLiteCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.SQLiteCache(
+            os.path.join(self.directory, 'cache.sqlite3'),
+            ttls={'ndl': 100}, negative_ttls={'ndl': 10})
+        cache.set_cache(self.cache)
+
+    def tearDown(self):
+        cache.set_cache(None)
+        shutil.rmtree(self.directory)
+
+    def test_make_key(self):
+        self.assertEqual(
+            'http://example.com/?a=1&b=2',
+            cache.make_key('http://example.com/',
+                           {'b': '2', 'a': '1', 'id': 'secret', 'c': None},
+                           exclude=('id',)))
+
+    def test_cached(self):
+        fetch = mock.Mock(return_value=b'payload')
+        self.assertEqual(b'payload', cache.cached('ndl', 'key', fetch))
+        self.assertEqual(b'payload', cache.cached('ndl', 'key', fetch))
+        self.assertEqual(1, fetch.call_count)
+
+    def test_ttl(self):
+        now = time.time()
+        self.cache.set('ndl', 'found', b'found')
+        self.cache.set('ndl', 'not found', b'not found', negative=True)
+        with mock.patch('time.time', return_value=now + 50):
+            self.assertEqual(b'found', self.cache.get('ndl', 'found'))
+            self.assertIsNone(self.cache.get('ndl', 'not found'))
+        with mock.patch('time.time', return_value=now + 150):
+            self.assertIsNone(self.cache.get('ndl', 'found'))
+
+    def test_classify(self):
+        fetch = mock.Mock(return_value=b'error')
+        cache.cached('rakuten', 'key', fetch, lambda payload: None)
+        cache.cached('rakuten', 'key', fetch, lambda payload: None)
+        self.assertEqual(2, fetch.call_count)
+
+    def test_cached_async_off_the_event_loop(self):
+        # SQLite の読み書きはイベントループのスレッドでは行わない
+        threads = []
+        get, set_ = self.cache.get, self.cache.set
+
+        def record(func):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return func(*args, **kwargs)
+            return wrapper
+
+        async def fetch():
+            return b'payload'
+
+        async def run():
+            loop_thread = threading.get_ident()
+            payloads = [await cache.cached_async('ndl', 'key', fetch),
+                        await cache.cached_async('ndl', 'key', fetch),
+                        await cache.lookup_async('ndl', 'key')]
+            await cache.store_async('ndl', 'other', b'other')
+            return loop_thread, payloads
+
+        with mock.patch.object(self.cache, 'get', record(get)), \
+                mock.patch.object(self.cache, 'set', record(set_)):
+            loop_thread, payloads = asyncio.run(run())
+        self.assertEqual([b'payload'] * 3, payloads)
+        self.assertEqual(b'other', self.cache.get('ndl', 'other'))
+        self.assertEqual(5, len(threads))
+        self.assertNotIn(loop_thread, threads)
+
+    def test_shared_between_connections(self):
+        self.cache.set('ndl', 'key', b'payload')
+        other = cache.SQLiteCache(self.cache.path)
+        self.assertEqual(b'payload', other.get('ndl', 'key'))
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.metadata_cache = cache.MetadataCache(maxsize=2)
+        cache.set_metadata_cache(self.metadata_cache)
+
+    def tearDown(self):
+        cache.set_metadata_cache(None)
+
+    def test_isbn_forms_share_entry(self):
+        lookup = mock.Mock(return_value=Metadata(tags=['SF']))
+        with mock.patch.object(shoshi, '_metadata_from_ean', lookup):
+            for isbn in ('4-04-429204-3', '4044292043', '978-4-04-429204-1'):
+                shoshi.metadata_from_isbn(isbn)
+        self.assertEqual(1, lookup.call_count)
+        self.assertEqual(2, self.metadata_cache.hits)
+        self.assertEqual(1, self.metadata_cache.misses)
+
+    def test_results_are_copies(self):
+        lookup = mock.Mock(return_value=Metadata(tags=['SF']))
+        with mock.patch.object(shoshi, '_metadata_from_ean', lookup):
+            shoshi.metadata_from_ean('9784044292041').tags.append('ホラー')
+            self.assertEqual(['SF'],
+                             shoshi.metadata_from_ean('9784044292041').tags)
+
+    def test_eviction(self):
+        for i in range(3):
+            self.metadata_cache.set(i, Metadata())
+        self.assertIsNone(self.metadata_cache.get(0))
+        self.assertIsNotNone(self.metadata_cache.get(2))
+        self.assertEqual(1, self.metadata_cache.evictions)
+
+    def test_ttl(self):
+        metadata_cache = cache.MetadataCache(ttl=10)
+        metadata_cache.set('key', Metadata())
+        with mock.patch('time.time', return_value=time.time() + 20):
+            self.assertIsNone(metadata_cache.get('key'))
+        self.assertEqual(1, metadata_cache.evictions)
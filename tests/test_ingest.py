@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from shoshi import ingest
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+NAMES = ['ndl_haruhi', 'ndl_anthology', 'ndl_bungakushoujo']
+
+
+def read_data(name):
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def make_dump(names):
+    '''各書誌の rdf:RDF の中身を 1 つの rdf:RDF にまとめる'''
+    bodies = []
+    for name in names:
+        content = read_data(name + '.rdf').decode('utf-8')
+        body = content[content.index('>', content.index('<rdf:RDF')) + 1:
+                       content.rindex('</rdf:RDF>')]
+        bodies.append(body)
+    header = read_data(NAMES[0] + '.rdf').decode('utf-8')
+    header = header[:header.index('>', header.index('<rdf:RDF')) + 1]
+    return (header + ''.join(bodies) + '</rdf:RDF>\n').encode('utf-8')
+
+
+class TestIngestNDL(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ingest_ndl(self):
+        path = os.path.join(self.directory, 'dump.xml.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(make_dump(NAMES))
+        output = io.StringIO()
+        self.assertEqual(3, ingest.ingest_ndl([path], output, True))
+        actual = [json.loads(line) for line in output.getvalue().splitlines()]
+        expected = [json.loads(read_data(name + '.json').decode('utf-8'))
+                    for name in NAMES]
+        self.assertEqual(expected, actual)
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import copy
+import json
+import unittest
+from shoshi import ndl
+from shoshi.metadata import Metadata, Title, Series, Creator, write_jsonl
+from support import read_data
+
+
+class TestMetadata(unittest.TestCase):
+    def test_defaults_are_not_shared(self):
+        metadata = Metadata()
+        metadata.series.append(Series(Title('ほげ')))
+        metadata.identifiers['ISBN13'] = '9784044292041'
+        self.assertEqual([], Metadata().series)
+        self.assertEqual({}, Metadata().identifiers)
+        self.assertEqual([], Title('ふが').parallels)
+
+    def test_slots(self):
+        metadata = Metadata()
+        self.assertFalse(hasattr(metadata, '__dict__'))
+        with self.assertRaises(AttributeError):
+            metadata.unknown = 1
+
+    def test_equality_and_hash(self):
+        metadata = Metadata(title=Title('ほげ', 'ホゲ', ['HOGE']),
+                            creators=[Creator('近藤せいきち', role='著')],
+                            identifiers={'ISBN13': '9784044292041'})
+        same = copy.deepcopy(metadata)
+        self.assertEqual(metadata, same)
+        self.assertEqual(hash(metadata), hash(same))
+        self.assertEqual(1, len(set([metadata, same])))
+        same.creators[0].role = '訳'
+        self.assertNotEqual(metadata, same)
+        self.assertNotEqual(Title('ほげ'), Series(Title('ほげ')))
+
+
+class TestSerializer(unittest.TestCase):
+    def setUp(self):
+        self.records = [ndl.metadata_from_rdf_content(read_data(name))
+                        for name in ('ndl_haruhi.rdf', 'ndl_bungakushoujo.rdf',
+                                     'ndl_anthology.rdf')]
+        self.records.append(Metadata(
+            identifiers={'ISBN13': None, 'JPNO': '20000000'},
+            thumbnails={'small_url': 'http://example.com/"a".jpg'},
+            page_count=0, missing_sources=['amazon']))
+
+    def test_tojson(self):
+        for metadata in self.records:
+            for include_none_value_field in (True, False):
+                for to_camel_case in (True, False):
+                    expected = metadata.todict(include_none_value_field,
+                                               to_camel_case)
+                    actual = metadata.tojson(include_none_value_field,
+                                             to_camel_case)
+                    self.assertEqual(json.dumps(expected, ensure_ascii=False),
+                                     actual)
+
+    def test_missing_sources_omitted_when_none(self):
+        # 締め切りを指定しなかった書誌の出力には missingSources を含めない
+        metadata = Metadata(page_count=None)
+        self.assertNotIn('missingSources', metadata.todict(True))
+        self.assertIn('pageCount', metadata.todict(True))
+        self.assertNotIn('missingSources', json.loads(metadata.tojson(True)))
+        self.assertEqual(['amazon'], Metadata(
+            missing_sources=['amazon']).todict(False)['missingSources'])
+
+    def test_write_jsonl(self):
+        output = io.StringIO()
+        self.assertEqual(4, write_jsonl(self.records, output, False))
+        self.assertEqual([metadata.todict(False) for metadata in self.records],
+                         [json.loads(line)
+                          for line in output.getvalue().splitlines()])
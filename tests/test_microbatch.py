@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import copy
+import time
+import unittest
+from shoshi import microbatch, ndl, shoshi
+from support import FakeTransport, read_data, run_concurrently
+
+
+class TestBatcher(unittest.TestCase):
+    def test_call(self):
+        batches = []
+
+        def func(keys):
+            batches.append(keys)
+            return dict((key, [key * 2]) for key in keys)
+
+        batcher = microbatch.Batcher(func, max_size=10, window=0.2,
+                                     copy=copy.deepcopy)
+        results = run_concurrently(lambda i: batcher.call(i % 25), 30)
+        self.assertEqual([[i % 25 * 2] for i in range(30)], results)
+        # 同じキーの呼び出し元どうしでも別のオブジェクト
+        self.assertIsNot(results[0], results[25])
+        self.assertEqual(set(range(25)), set(sum(batches, [])))
+        self.assertTrue(all(len(keys) <= 10 for keys in batches))
+        self.assertLess(len(batches), 10)
+        self.assertEqual({'calls': 30, 'batches': len(batches)},
+                         batcher.stats())
+
+    def test_error(self):
+        def func(keys):
+            raise IOError('connection reset')
+
+        batcher = microbatch.Batcher(func, max_size=10, window=0.1)
+        results = run_concurrently(lambda i: self.assertRaises(
+            IOError, batcher.call, i), 3)
+        self.assertEqual(3, len(results))
+
+
+    def test_missing_key(self):
+        # func の結果に無いキーの呼び出し元だけが KeyError になり，他の呼び出し元は待ち続けない
+        def func(keys):
+            return dict((key, key * 2) for key in keys if key != 1)
+
+        batcher = microbatch.Batcher(func, max_size=10, window=0.1)
+
+        def call(i):
+            try:
+                return batcher.call(i)
+            except KeyError as e:
+                return e
+
+        results = run_concurrently(call, 4)
+        self.assertEqual([0, 4, 6], results[0:1] + results[2:])
+        self.assertIsInstance(results[1], KeyError)
+
+    def test_copy_before_first_caller_returns(self):
+        # 最初の呼び出し元が結果を書き換えても，同じキーの他の呼び出し元の結果は変わらない
+        def func(keys):
+            return dict((key, {'key': key}) for key in keys)
+
+        batcher = microbatch.Batcher(func, max_size=10, window=0.1,
+                                     copy=copy.deepcopy)
+
+        def call(i):
+            if i:
+                time.sleep(0.02)
+            result = batcher.call('isbn')
+            if not i:
+                result['key'] = 'changed'
+                result.update(('extra{0}'.format(j), j) for j in range(1000))
+            return result
+
+        first, *others = run_concurrently(call, 4)
+        self.assertEqual('changed', first['key'])
+        self.assertEqual([{'key': 'isbn'}] * 3, others)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        ndl.set_api('sru')
+        microbatch.set_scheduler(microbatch.Scheduler(window=0.2))
+
+    def tearDown(self):
+        ndl.set_api('opensearch')
+        microbatch.set_scheduler(None)
+
+    def test_metadata_from_ean(self):
+        transport = FakeTransport(read_data('ndl_sru_batch.xml'))
+        results = run_concurrently(lambda i: shoshi.metadata_from_ean(
+            ['4-7577-2806-9', '9784044292041', '9784000000002'][i],
+            transport=transport), 3)
+        self.assertEqual(1, len(transport.params))
+        self.assertEqual(['21053377', '20647414', None],
+                         [m.identifiers.get('JPNO') for m in results])
+        self.assertEqual({'ndl': {'calls': 3, 'batches': 1}},
+                         microbatch.get_scheduler().stats())
@@ -1,9 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import json
 import unittest
 from shoshi import ndl
 from shoshi.metadata import Title, TitleElement, Series, Creator
+from support import FakeTransport, read_data
 
 
 class TestNDL(unittest.TestCase):
@@ -72,3 +74,85 @@ class TestNDL(unittest.TestCase):
             Creator('近藤せいきち', 'コンドウ セイキチ', '著', '1989', None),
             Creator('ほげふが太郎', None, '著', None, None)]
         self.assertEqual(expected, actual)
+
+
+class TestRDF(unittest.TestCase):
+    def test_metadata_from_rdf_content(self):
+        # 期待値は lxml.objectify で解析していた頃の出力
+        for name in ['ndl_anthology', 'ndl_haruhi', 'ndl_bungakushoujo']:
+            actual = ndl.metadata_from_rdf_content(read_data(name + '.rdf'))
+            expected = json.loads(read_data(name + '.json').decode('utf-8'))
+            self.assertEqual(expected, actual.todict(True))
+
+
+class TestSRU(unittest.TestCase):
+    def test_rdf_contents_from_sru_content(self):
+        contents, next_position = ndl.rdf_contents_from_sru_content(
+            read_data('ndl_sru_batch.xml'))
+        self.assertIsNone(next_position)
+        self.assertEqual(2, len(contents))
+        self.assertEqual(
+            ndl.metadata_from_rdf_content(read_data('ndl_haruhi.rdf')).todict(),
+            ndl.metadata_from_rdf_content(contents[0]).todict())
+
+    def test_metadata_from_isbns_via_sru(self):
+        transport = FakeTransport(read_data('ndl_sru_batch.xml'))
+        actual = ndl.metadata_from_isbns_via_sru(
+            ['4-7577-2806-9', '9784044292041', '9784000000000'], transport)
+        self.assertEqual(1, len(transport.params))
+        self.assertEqual(
+            '(isbn="9784757728066" OR isbn="9784044292041"'
+            ' OR isbn="9784000000000") AND dpid=iss-ndl-opac',
+            transport.params[0]['query'])
+        self.assertEqual('21053377',
+                         actual['4-7577-2806-9'].identifiers['JPNO'])
+        self.assertEqual('20647414',
+                         actual['9784044292041'].identifiers['JPNO'])
+        self.assertEqual({}, actual['9784000000000'].identifiers)
+
+    def test_metadata_from_isbns_via_sru_with_several_isbns(self):
+        # セットの ISBN と巻の ISBN を持つ書誌は，どちらで問い合わせても見つかる
+        content = read_data('ndl_sru_batch.xml').replace(
+            b'ISBN">4-04-429204-3</dcterms:identifier>',
+            b'ISBN">4-04-429204-3</dcterms:identifier>\n'
+            b'    <dcterms:identifier'
+            b' rdf:datatype="http://ndl.go.jp/dcndl/terms/ISBN">'
+            b'978-4-04-100000-7</dcterms:identifier>')
+        # identifiers['ISBN13'] には最後の ISBN しか入らない
+        self.assertEqual('9784041000007', ndl.metadata_from_rdf_content(
+            ndl.rdf_contents_from_sru_content(content)[0][0]).identifiers[
+                'ISBN13'])
+        actual = ndl.metadata_from_isbns_via_sru(
+            ['9784044292041', '4-04-100000-9', '4-7577-2806-9'],
+            FakeTransport(content))
+        self.assertEqual('20647414',
+                         actual['9784044292041'].identifiers['JPNO'])
+        self.assertEqual('20647414',
+                         actual['4-04-100000-9'].identifiers['JPNO'])
+        self.assertEqual('21053377',
+                         actual['4-7577-2806-9'].identifiers['JPNO'])
+
+    def test_fetch_sru_records_stops_paging(self):
+        def page(next_position):
+            return read_data('ndl_sru_batch.xml').replace(
+                b'<nextRecordPosition>0</nextRecordPosition>',
+                '<nextRecordPosition>{0}</nextRecordPosition>'.format(
+                    next_position).encode('utf-8'))
+
+        # 次の開始位置が進まない
+        transport = FakeTransport(page(1))
+        self.assertEqual(2, len(ndl.fetch_sru_records({}, transport)))
+        self.assertEqual(1, len(transport.params))
+
+        # 次の開始位置が進み続けても MAX_SRU_PAGES ページで止める
+        class PagingTransport(FakeTransport):
+            def get(self, source, url, params=None, credential=None):
+                FakeTransport.get(self, source, url, params, credential)
+                return page(params['startRecord'] + 2)
+
+        transport = PagingTransport(None)
+        contents = ndl.fetch_sru_records({}, transport)
+        self.assertEqual(ndl.MAX_SRU_PAGES, len(transport.params))
+        self.assertEqual(2 * ndl.MAX_SRU_PAGES, len(contents))
+        self.assertEqual([1, 3, 5], [params['startRecord']
+                                     for params in transport.params[:3]])
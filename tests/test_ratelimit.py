@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+from shoshi import ratelimit
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve(self):
+        with mock.patch('time.monotonic', return_value=100.0) as now:
+            bucket = ratelimit.TokenBucket(rate=2, burst=2)
+            self.assertEqual(0, bucket.reserve())
+            self.assertEqual(0, bucket.reserve())
+            self.assertAlmostEqual(0.5, bucket.reserve())
+            self.assertAlmostEqual(1.0, bucket.reserve())
+            now.return_value = 102.0
+            self.assertEqual(0, bucket.reserve())
+
+
+class TestLimiter(unittest.TestCase):
+    def tearDown(self):
+        ratelimit.set_rate('rakuten', *ratelimit.DEFAULT_RATES['rakuten'])
+        ratelimit.set_rate('ndl', None)
+
+    def test_per_credential(self):
+        ratelimit.set_rate('rakuten', rate=1, burst=3)
+        self.assertIs(ratelimit.limiter('rakuten', 'a'),
+                      ratelimit.limiter('rakuten', 'a'))
+        self.assertIsNot(ratelimit.limiter('rakuten', 'a'),
+                         ratelimit.limiter('rakuten', 'b'))
+        self.assertEqual(3, ratelimit.limiter('rakuten', 'a').burst)
+
+    def test_unlimited(self):
+        ratelimit.set_rate('ndl', None)
+        self.assertIsNone(ratelimit.limiter('ndl'))
+        ratelimit.acquire('ndl')
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shoshi import amazon, rakuten, replay, wikipedia
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        status = 404 if self.path.startswith('/missing') else 200
+        body = ('{0} {1}'.format(status, self.path)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestExchangeKey(unittest.TestCase):
+    def test_amazon_signature(self):
+        url = amazon.item_lookup_url('9784044292041', 'KEY1', 'SECRET1',
+                                     'tag1')
+        other = amazon.item_lookup_url('4-04-429204-3', 'KEY2', 'SECRET2',
+                                       'tag2')
+        self.assertNotEqual(url, other)
+        self.assertEqual(replay.exchange_key('amazon', url),
+                         replay.exchange_key('amazon', other))
+        self.assertNotIn('Signature', replay.exchange_key('amazon', url))
+        self.assertNotEqual(
+            replay.exchange_key('amazon', url),
+            replay.exchange_key('amazon', amazon.item_lookup_url(
+                '9784757728066', 'KEY1', 'SECRET1', 'tag1')))
+
+    def test_params(self):
+        url = rakuten.BOOKS_BOOK_URL
+        self.assertEqual(
+            replay.exchange_key('rakuten', url, {'isbn': '9784044292041',
+                                                 'applicationId': 'a'}),
+            replay.exchange_key('rakuten', url + '?applicationId=b',
+                                {'isbn': '9784044292041'}))
+        self.assertEqual(
+            replay.exchange_key('wikipedia', wikipedia.URL,
+                                {'format': 'json', 'srlimit': 20}),
+            replay.exchange_key('wikipedia', wikipedia.URL + '?srlimit=20',
+                                {'format': 'json'}))
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.archive = replay.Archive(os.path.join(directory,
+                                                   'archive.sqlite3'))
+
+    def test_record_and_replay(self):
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        httpd.paths = []
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        base = 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+        recorder = replay.RecordingTransport(self.archive, retries=0)
+        try:
+            self.assertEqual(b'200 /api?a=1&b=2', recorder.get(
+                'ndl', base + '/api', {'a': '1', 'b': '2'}))
+            with self.assertRaises(requests.HTTPError):
+                recorder.get('ndl', base + '/missing')
+        finally:
+            recorder.close()
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        self.assertEqual(2, len(self.archive))
+
+        player = replay.ReplayTransport(self.archive)
+        self.assertEqual(b'200 /api?a=1&b=2', player.get(
+            'ndl', base + '/api?b=2', {'a': '1'}))
+        with self.assertRaises(requests.HTTPError) as cm:
+            player.get('ndl', base + '/missing')
+        self.assertEqual(404, cm.exception.response.status_code)
+        with self.assertRaises(replay.NotRecordedError):
+            player.get('ndl', base + '/api', {'a': '2'})
+        self.assertEqual({'hits': 2, 'misses': 1}, player.stats())
+        self.assertEqual(2, len(httpd.paths))
+
+    def test_amazon_with_other_credentials(self):
+        with open(os.path.join(DATA, 'amazon_item_lookup_batch.xml'),
+                  'rb') as f:
+            content = amazon.split_item_lookup_content(
+                f.read(), ['9784044292041'])['9784044292041']
+        url = amazon.item_lookup_url('9784044292041', 'KEY1', 'SECRET1',
+                                     'tag1')
+        self.archive.add('amazon', replay.exchange_key('amazon', url), 200,
+                         content)
+        metadata = amazon.metadata_from_ean(
+            '4-04-429204-3', 'KEY2', 'SECRET2', 'tag2',
+            transport=replay.ReplayTransport(self.archive))
+        self.assertEqual('9784044292041', metadata.identifiers['ISBN13'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import unittest
+import http.client
+from unittest import mock
+from shoshi import batch, server
+from shoshi.metadata import Metadata, Title
+
+
+def isbn_lookup(isbn, *args):
+    if isbn == '9784000000002':
+        return Metadata()
+    if isbn == '9784757728066':
+        # 締め切りに間に合わなかった API がある
+        return Metadata(title=Title('ハルヒ'), identifiers={'ISBN13': isbn},
+                        missing_sources=['amazon'])
+    return Metadata(title=Title('涼宮ハルヒの消失'),
+                    identifiers={'ISBN13': isbn})
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(batch, 'metadata_from_isbn', isbn_lookup)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = server.make_server(port=0, quiet=True)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.connection = http.client.HTTPConnection(
+            *self.server.server_address[:2])
+        self.addCleanup(self.connection.close)
+
+    def request(self, method, path, body=None, headers={}):
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_get(self):
+        response, body = self.request('GET', '/isbn/978-4-04-429204-1')
+        self.assertEqual(200, response.status)
+        self.assertEqual('涼宮ハルヒの消失', json.loads(body)['title']['name'])
+        self.assertEqual('public, max-age=86400',
+                         response.getheader('Cache-Control'))
+
+        # 同じ接続で ETag を使って確認する
+        response, body = self.request(
+            'GET', '/isbn/978-4-04-429204-1',
+            headers={'If-None-Match': response.getheader('ETag')})
+        self.assertEqual(304, response.status)
+        self.assertEqual(b'', body)
+
+    def test_partial(self):
+        response, body = self.request('GET', '/isbn/9784757728066')
+        self.assertEqual(200, response.status)
+        self.assertEqual(['amazon'], json.loads(body)['missingSources'])
+        self.assertEqual('no-store', response.getheader('Cache-Control'))
+
+    def test_errors(self):
+        response, _ = self.request('GET', '/isbn/9784000000002')
+        self.assertEqual(404, response.status)
+        self.assertEqual('public, max-age=3600',
+                         response.getheader('Cache-Control'))
+        response, _ = self.request('GET', '/jpno/4-04-429204-3')
+        self.assertEqual(400, response.status)
+        response, _ = self.request('GET', '/asin/B000000000')
+        self.assertEqual(404, response.status)
+
+    def test_bulk(self):
+        response, body = self.request('POST', '/bulk', json.dumps(
+            {'identifiers': ['4-04-429204-3', 'hoge']}))
+        self.assertEqual(200, response.status)
+        records = dict((record['input'], record) for record in
+                       map(json.loads, body.decode('utf-8').splitlines()))
+        self.assertEqual('涼宮ハルヒの消失',
+                         records['4-04-429204-3']['metadata']['title']['name'])
+        self.assertEqual('unrecognized identifier', records['hoge']['error'])
+        response, _ = self.request('POST', '/bulk', 'hoge')
+        self.assertEqual(400, response.status)
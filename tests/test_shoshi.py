@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from unittest import mock
+from shoshi import shoshi, ndl, amazon, rakuten
+from shoshi.metadata import Metadata, Title
+
+
+class TestBatch(unittest.TestCase):
+    def test_metadata_from_isbns(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def lookup(isbn, *args):
+            with lock:
+                running.append(isbn)
+                max_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(isbn)
+            return Metadata(identifiers={'ISBN13': isbn})
+
+        isbns = ['978404429204{0}'.format(i) for i in range(10)]
+        with mock.patch.object(shoshi, 'metadata_from_isbn', lookup):
+            results = list(shoshi.metadata_from_isbns(iter(isbns),
+                                                      concurrency=3))
+        self.assertEqual(sorted(isbns), sorted(isbn for isbn, _ in results))
+        for isbn, metadata in results:
+            self.assertEqual(isbn, metadata.identifiers['ISBN13'])
+        self.assertLessEqual(max(max_running), 3)
+
+    def test_metadata_from_isbns_reads_input_lazily(self):
+        consumed = []
+
+        def isbns():
+            for i in range(100):
+                consumed.append(i)
+                yield str(i)
+
+        with mock.patch.object(shoshi, 'metadata_from_isbn',
+                               lambda isbn, *args: Metadata()):
+            results = shoshi.metadata_from_isbns(isbns(), concurrency=2)
+            next(results)
+            results.close()
+        self.assertLessEqual(len(consumed), 3)
+
+    def test_metadata_from_isbns_on_error(self):
+        # 1件が失敗しても残りの結果は失われない
+        def lookup(isbn, *args):
+            if isbn == '9784044292043':
+                raise ValueError(isbn)
+            time.sleep(0.01)
+            return Metadata(identifiers={'ISBN13': isbn})
+
+        isbns = ['978404429204{0}'.format(i) for i in range(10)]
+        errors = []
+        with mock.patch.object(shoshi, 'metadata_from_isbn', lookup):
+            results = list(shoshi.metadata_from_isbns(
+                isbns, concurrency=3,
+                on_error=lambda isbn, e: errors.append((isbn, e))))
+            with self.assertRaises(ValueError):
+                list(shoshi.metadata_from_isbns(isbns, concurrency=3))
+        self.assertEqual(sorted(set(isbns) - {'9784044292043'}),
+                         sorted(isbn for isbn, _ in results))
+        self.assertEqual(['9784044292043'], [isbn for isbn, _ in errors])
+        self.assertIsInstance(errors[0][1], ValueError)
+
+    def test_map_as_completed(self):
+        def lookup(identifier):
+            if identifier == 2:
+                raise ValueError(identifier)
+            return identifier * 10
+
+        results = sorted(shoshi.map_as_completed(lookup, range(4), 2),
+                         key=lambda result: result[0])
+        self.assertEqual([(0, 0), (1, 10), (3, 30)],
+                         [(i, r) for i, r, e in results if e is None])
+        self.assertEqual(2, results[2][0])
+        self.assertIsNone(results[2][1])
+        self.assertIsInstance(results[2][2], ValueError)
+
+
+class TestFanOut(unittest.TestCase):
+    def test_sources_run_concurrently(self):
+        # 各 API を同時に問い合わせていなければ，Barrier を越えられない
+        barrier = threading.Barrier(3, timeout=2)
+        threads = set()
+
+        def lookup(metadata):
+            def func(*args, **kwargs):
+                threads.add(threading.current_thread().name)
+                barrier.wait()
+                return metadata
+            return func
+
+        with mock.patch.object(ndl, 'metadata_from_isbn', lookup(Metadata(
+                    title=Title('涼宮ハルヒの消失')))), \
+                mock.patch.object(amazon, 'metadata_from_ean',
+                                  lookup(Metadata(price='514'))), \
+                mock.patch.object(rakuten, 'metadata_from_isbn', lookup(
+                    Metadata(links=['http://books.rakuten.co.jp/']))):
+            metadata = shoshi.metadata_from_isbn(
+                '9784044292041', ('a', 'b', 'c'), 'APP')
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertEqual('514', metadata.price)
+        self.assertIn('http://books.rakuten.co.jp/', metadata.links)
+        self.assertEqual(3, len(threads))
+        self.assertTrue(all(name.startswith('shoshi-source')
+                            for name in threads))
+
+    def test_failed_source(self):
+        # 1つの API が失敗しても他の API の結果は捨てない
+        def ndl_lookup(isbn, *args):
+            return Metadata(title=Title('涼宮ハルヒの消失'))
+
+        def rakuten_lookup(*args):
+            raise IOError('connection reset')
+
+        with mock.patch.object(ndl, 'metadata_from_isbn', ndl_lookup), \
+                mock.patch.object(rakuten, 'metadata_from_isbn',
+                                  rakuten_lookup):
+            metadata = shoshi.metadata_from_isbn(
+                '9784757728066', rakuten_application_id='APP')
+            partial = shoshi.metadata_from_isbn(
+                '9784757728066', rakuten_application_id='APP', deadline=1)
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertIsNone(metadata.missing_sources)
+        self.assertEqual('涼宮ハルヒの消失', partial.title.name)
+        self.assertEqual(['rakuten'], partial.missing_sources)
+
+
+class TestDeadline(unittest.TestCase):
+    def test_partial_merge(self):
+        def ndl_lookup(isbn, *args):
+            return Metadata(title=Title('涼宮ハルヒの消失'),
+                            identifiers={'ISBN13': '9784044292041'})
+
+        def amazon_lookup(*args, **kwargs):
+            time.sleep(1)
+            return Metadata(price='514')
+
+        with mock.patch.object(ndl, 'metadata_from_isbn', ndl_lookup), \
+                mock.patch.object(amazon, 'metadata_from_ean', amazon_lookup):
+            started_at = time.time()
+            metadata = shoshi.metadata_from_isbn(
+                '9784044292041', amazon_auth_info=('a', 'b', 'c'),
+                deadline=0.1)
+        self.assertLess(time.time() - started_at, 0.5)
+        self.assertEqual('涼宮ハルヒの消失', metadata.title.name)
+        self.assertIsNone(metadata.price)
+        self.assertEqual(['amazon'], metadata.missing_sources)
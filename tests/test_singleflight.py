@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+from unittest import mock
+from shoshi import ndl, shoshi, singleflight, transport
+from shoshi.metadata import Metadata, Title
+from support import run_concurrently
+
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_group(self):
+        group = singleflight.Group()
+        calls = []
+
+        def work(key):
+            calls.append(key)
+            time.sleep(0.2)
+            if key == 'error':
+                raise IOError(key)
+            return key.upper()
+
+        def call(i):
+            key = 'error' if i % 2 else 'ok'
+            try:
+                return group.do(key, work, key)
+            except IOError as e:
+                return e
+
+        results = run_concurrently(call, 8)
+        self.assertEqual(['OK'] * 4, results[0::2])
+        self.assertTrue(all(isinstance(r, IOError) for r in results[1::2]))
+        self.assertEqual(['error', 'ok'], sorted(calls))
+        self.assertEqual({'calls': 2, 'shared': 6, 'in_flight': 0},
+                         group.stats())
+
+    def test_copy_before_leader_returns(self):
+        # 最初の呼び出し元が結果を書き換えても，後から来た呼び出しの結果は変わらない
+        group = singleflight.Group(copy=dict)
+
+        def work():
+            time.sleep(0.2)
+            return {'title': 'original'}
+
+        def call(i):
+            if i:
+                time.sleep(0.05)
+            result = group.do('key', work)
+            if not i:
+                result['title'] = 'changed'
+                result.update(('extra{0}'.format(j), j) for j in range(1000))
+            return result
+
+        leader, *followers = run_concurrently(call, 4)
+        self.assertEqual('changed', leader['title'])
+        self.assertEqual([{'title': 'original'}] * 3, followers)
+
+    def test_metadata_from_ean(self):
+        calls = []
+
+        def lookup(ean, *args):
+            calls.append(ean)
+            time.sleep(0.2)
+            return Metadata(title=Title('涼宮ハルヒの消失'))
+
+        with mock.patch.object(shoshi, '_metadata_from_ean', lookup):
+            results = run_concurrently(
+                lambda i: shoshi.metadata_from_ean(
+                    '4-04-429204-3' if i % 2 else '9784044292041'), 6)
+        self.assertEqual(1, len(calls))
+        # 呼び出し元ごとに別のオブジェクト
+        self.assertEqual(6, len(set(id(metadata) for metadata in results)))
+        self.assertTrue(all(metadata == results[0] for metadata in results))
+
+    def test_metadata_from_ean_with_different_deadlines(self):
+        # 締め切りの短い呼び出しの不完全な結果を，締め切りの無い呼び出しと共有しない
+        def ndl_lookup(isbn, *args):
+            time.sleep(0.3)
+            return Metadata(title=Title('涼宮ハルヒの消失'))
+
+        def call(i):
+            if i == 0:
+                return shoshi.metadata_from_ean('9784044292041', deadline=0.1)
+            time.sleep(0.05)
+            return shoshi.metadata_from_ean('9784044292041')
+
+        with mock.patch.object(ndl, 'metadata_from_isbn', ndl_lookup):
+            partial, complete = run_concurrently(call, 2)
+        self.assertIsNone(partial.title)
+        self.assertEqual(['ndl'], partial.missing_sources)
+        self.assertEqual('涼宮ハルヒの消失', complete.title.name)
+        self.assertIsNone(complete.missing_sources)
+
+    def test_transport(self):
+        t = transport.Transport()
+        response = mock.Mock(content=b'<rdf/>')
+        session = mock.Mock()
+
+        def get(url, params=None, timeout=None):
+            time.sleep(0.2)
+            return response
+
+        session.get.side_effect = get
+        t._sessions['iss.ndl.go.jp'] = session
+        results = run_concurrently(
+            lambda i: t.get('ndl', 'http://iss.ndl.go.jp/books/R1.rdf'), 4)
+        self.assertEqual([b'<rdf/>'] * 4, results)
+        self.assertEqual(1, session.get.call_count)
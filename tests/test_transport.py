@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+import email.utils
+import requests
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shoshi import ratelimit, transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''/{ステータスコード} に，そのステータスコードで応答する'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        status = int(self.path.strip('/'))
+        self.send_response(status)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestTransport(unittest.TestCase):
+    def test_session_per_host(self):
+        t = transport.Transport(pool_maxsize=4, retries=1)
+        ndl = t.session('http://iss.ndl.go.jp/api/opensearch')
+        self.assertIs(ndl, t.session('http://iss.ndl.go.jp/books/R1.rdf'))
+        self.assertIsNot(ndl, t.session('http://ja.wikipedia.org/w/api.php'))
+        adapter = ndl.get_adapter('http://iss.ndl.go.jp/')
+        self.assertEqual(4, adapter._pool_maxsize)
+        # リトライは Transport._get が行う
+        self.assertEqual(0, adapter.max_retries.total)
+        t.close()
+
+    def test_retry_after(self):
+        def response(value):
+            return mock.Mock(headers={} if value is None
+                             else {'Retry-After': value})
+
+        self.assertIsNone(transport.retry_after(response(None)))
+        self.assertEqual(3, transport.retry_after(response('3')))
+        self.assertEqual(transport.MAX_RETRY_AFTER,
+                         transport.retry_after(response('86400')))
+        date = email.utils.formatdate(time.time() + 10, usegmt=True)
+        self.assertAlmostEqual(10, transport.retry_after(response(date)),
+                               delta=1.5)
+        self.assertIsNone(transport.retry_after(response('soon')))
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.requests = 0
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        self.base = 'http://127.0.0.1:{0}'.format(
+            self.httpd.server_address[1])
+        self.transport = transport.Transport(retries=2, backoff_factor=0)
+        self.addCleanup(self.transport.close)
+
+        ratelimit.set_rate('amazon', 1000, 10)
+        self.addCleanup(ratelimit.set_rate, 'amazon',
+                        *ratelimit.DEFAULT_RATES['amazon'])
+        self.tokens = []
+        acquire = ratelimit.acquire
+
+        def count(source, credential=None):
+            self.tokens.append((source, credential))
+            return acquire(source, credential)
+
+        patcher = mock.patch.object(ratelimit, 'acquire', count)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_per_attempt(self):
+        with self.assertRaises(requests.HTTPError):
+            self.transport.get('amazon', self.base + '/500', credential='key')
+        self.assertEqual(3, self.httpd.requests)
+        self.assertEqual([('amazon', 'key')] * 3, self.tokens)
+
+    def test_no_retry_on_throttling(self):
+        # 制限のある API の 503 はリトライしない
+        with self.assertRaises(requests.HTTPError):
+            self.transport.get('amazon', self.base + '/503', credential='key')
+        self.assertEqual(1, self.httpd.requests)
+        self.assertEqual(1, len(self.tokens))
+
+    def test_retry_unlimited_source(self):
+        with self.assertRaises(requests.HTTPError):
+            self.transport.get('wikipedia', self.base + '/503')
+        self.assertEqual(3, self.httpd.requests)
+        self.assertEqual(3, len(self.tokens))
+        self.assertEqual(b'ok', self.transport.get('wikipedia',
+                                                   self.base + '/200'))
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+import mwparserfromhell
+from shoshi import wikipedia
+from support import PAGES, FakeMediaWiki
+
+
+class TestBatch(unittest.TestCase):
+    def test_find_page_about_series(self):
+        transport = FakeMediaWiki()
+        wikicode, title = wikipedia.find_page_about_series(
+            '9784044292041', transport)
+        self.assertEqual('涼宮ハルヒシリーズ', title)
+        # 検索 1 回と，候補のページの本文をまとめて取得する 1 回
+        self.assertEqual(2, len(transport.requests))
+        self.assertEqual('涼宮ハルヒシリーズ|ライトノベル',
+                         transport.requests[1]['titles'])
+
+    def test_find_pages_about_series(self):
+        transport = FakeMediaWiki()
+        pages = wikipedia.find_pages_about_series(
+            ['4-04-429204-3', '4757728069', '9784000000002'], transport)
+        self.assertEqual('涼宮ハルヒシリーズ', pages['4-04-429204-3'][1])
+        self.assertEqual('“文学少女”シリーズ', pages['4757728069'][1])
+        self.assertEqual((None, None), pages['9784000000002'])
+        # 2 つの ISBN をまとめた検索と残り 1 つの検索，本文の取得 1 回
+        self.assertEqual(3, len(transport.requests))
+        self.assertIn(' OR ', transport.requests[0]['srsearch'])
+
+    def test_split_revisions_content(self):
+        content = json.dumps({'query': {
+            'normalized': [{'from': 'ほげ_ふが', 'to': 'ほげ ふが'}],
+            'pages': {'1': {'title': 'ほげ ふが',
+                            'revisions': [{'*': 'text'}]}}}})
+        contents = wikipedia.split_revisions_content(content, ['ほげ_ふが'])
+        self.assertEqual('text', wikipedia.text_from_revisions_content(
+            contents['ほげ_ふが']))
+
+
+SERIES_PAGE = '''{{Otheruses|小説|アニメ|涼宮ハルヒの憂鬱 (アニメ)}}
+<!-- {{Infobox animanga/Novel|著者 = コメントアウトされた著者}} -->
+{{Infobox animanga/Header
+| タイトル = 涼宮ハルヒシリーズ<ref>{{Cite web|title=公式|url=http://example.com/}}</ref>
+| ジャンル = [[学園]]、[[SF]]、経済（商業・商取引 他）
+}}
+{{Infobox animanga/Novel
+| 著者 = [[谷川流]]<!-- }} -->
+| イラスト = [[いとうのいぢ]]（表紙）
+| 出版社 = {{lang|ja|角川書店}}
+| 巻数 = {{{巻数|11}}}}}
+{{Collapsible|{{Infobox animanga/Manga
+| タイトル = 涼宮ハルヒの憂鬱
+| 作者 = ツガノガク
+}}}}
+{{Infobox animanga/TVAnime|監督 = 石原立也}}
+{{Infobox animanga/Footer}}
+== 概要 ==
+{{main|涼宮ハルヒの消失}}
+{| class="wikitable"
+|-
+| 1 || 涼宮ハルヒの憂鬱 || ISBN 4-04-429201-9
+|}
+'''
+
+
+class TestIsbnsFromText(unittest.TestCase):
+    def test_isbns_from_text(self):
+        text = ('''| 1 || ISBN 4-04-429201-9
+| 2 || {{ISBN2|978-4-04-429204-1}}
+| 3 || ISBN 979-10-00000-00-8
+| 4 || ISBN 979-10-00000-00-9
+| 5 || ISBN 977-1-00000-00-0
+| 6 || ISBN 4-04-429201-0''')
+        self.assertEqual(['9784044292010', '9784044292041', '9791000000008'],
+                         wikipedia.isbns_from_text(text))
+
+
+class TestInfobox(unittest.TestCase):
+    def assertSameAsFullParse(self, text, title, authors):
+        full = mwparserfromhell.parse(text)
+        partial = wikipedia.parse_infoboxes(text)
+        self.assertEqual(
+            wikipedia.metadata_from_series_page(
+                full, 'ページ', title, authors).todict(True),
+            wikipedia.metadata_from_series_page(
+                partial, 'ページ', title, authors).todict(True))
+        pattern = r'{{Infobox\s+animanga/(Header|Novel|Manga)'
+        self.assertEqual(
+            [str(t) for t in full.filter_templates(matches=pattern)
+             if str(t.name).strip().startswith('Infobox')],
+            [str(t) for t in partial.filter_templates(matches=pattern)
+             if str(t.name).strip().startswith('Infobox')])
+
+    def test_parse_infoboxes(self):
+        partial = wikipedia.parse_infoboxes(SERIES_PAGE)
+        self.assertNotIn('概要', str(partial))
+        self.assertNotIn('コメントアウト', str(partial))
+        for authors in (['谷川流', 'いとうのいぢ'], ['ツガノガク'], ['誰か']):
+            self.assertSameAsFullParse(SERIES_PAGE, '涼宮ハルヒの憂鬱', authors)
+        for title, text in PAGES.items():
+            self.assertSameAsFullParse(text, title, ['谷川流'])
+
+    def test_fallback(self):
+        # nowiki を含む場合や括弧が閉じていない場合はページ全体を解析する
+        for text in ('<nowiki>{{Infobox animanga/Novel|著者=A}}</nowiki>',
+                     '{{Infobox animanga/Novel|著者=A'):
+            self.assertIsNone(wikipedia.infobox_regions(text))
+            self.assertSameAsFullParse(text, 'A', ['A'])
+
+    def test_fallback_on_ambiguous_braces(self):
+        # タグの中の括弧や，3 個以上続く括弧から始まる Infobox はページ全体を解析する
+        for text in ('{{Infobox animanga/Novel\n| 著者 = X\n'
+                     '| イラスト = <span>Y}}</span>\n}}',
+                     '{{Infobox animanga/Novel\n| 著者 = X\n'
+                     '| イラスト = <span title="}}">Y</span>\n}}',
+                     '{{{{Infobox animanga/Novel\n| 著者 = X}}}}'):
+            self.assertIsNone(wikipedia.infobox_regions(text))
+            self.assertSameAsFullParse(text, 'X', ['X'])
+        # タグがあっても中に括弧が無ければ範囲だけを解析する
+        text = '{{Infobox animanga/Novel\n| 著者 = X<br />Y\n| 巻数 = <small>2</small>\n}}'
+        self.assertEqual([(0, len(text))], wikipedia.infobox_regions(text))
+        self.assertSameAsFullParse(text, 'X', ['X'])
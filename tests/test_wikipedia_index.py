@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import io
+import shutil
+import tempfile
+import unittest
+from xml.sax.saxutils import escape
+from shoshi import wikipedia
+from shoshi.metadata import Metadata
+from shoshi.wikipedia_index import SeriesIndex, build_index_from_dump
+from support import PAGES, FakeMediaWiki
+
+
+def make_dump(pages):
+    '''pages-articles 形式の XML を作る'''
+    xml = ['<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/">']
+    for i, (title, text) in enumerate(sorted(pages.items())):
+        xml.append('<page><title>{0}</title><ns>0</ns><id>{1}</id>'
+                   '<revision><id>{2}</id><text xml:space="preserve">{3}</text>'
+                   '</revision></page>'.format(escape(title), i + 1,
+                                               100 + i, escape(text)))
+    # 標準名前空間以外のページは無視する
+    xml.append('<page><title>Template:Infobox animanga/Novel</title><ns>10</ns>'
+               '<revision><id>1</id><text>{0}</text></revision></page>'.format(
+                   escape(PAGES['涼宮ハルヒシリーズ'])))
+    xml.append('</mediawiki>')
+    return io.BytesIO('\n'.join(xml).encode('utf-8'))
+
+
+class NoNetwork(object):
+    def get(self, source, url, params=None, credential=None):
+        raise AssertionError('unexpected request: {0}'.format(params))
+
+
+class TestSeriesIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = SeriesIndex(os.path.join(self.directory, 'index.sqlite3'))
+
+    def tearDown(self):
+        wikipedia.set_series_index(None)
+        shutil.rmtree(self.directory)
+
+    def test_build_index_from_dump(self):
+        self.assertEqual(2, build_index_from_dump(make_dump(PAGES), self.index))
+        self.assertEqual(2, len(self.index))
+        self.assertEqual(102, self.index.revid('涼宮ハルヒシリーズ'))
+        self.assertIsNone(self.index.revid('ライトノベル'))
+        self.assertEqual(['“文学少女”シリーズ'], [
+            info['title'] for info in self.index.lookup('4-7577-2806-9')])
+
+    def test_offline_lookup(self):
+        build_index_from_dump(make_dump(PAGES), self.index)
+        online = wikipedia.metadata_from_isbn(
+            '9784044292041', '涼宮ハルヒの消失', ['谷川流'], FakeMediaWiki())
+
+        wikipedia.set_series_index(self.index, offline=True)
+        offline = wikipedia.metadata_from_isbn(
+            '9784044292041', '涼宮ハルヒの消失', ['谷川流'], NoNetwork())
+        self.assertEqual(online.todict(), offline.todict())
+        self.assertEqual('涼宮ハルヒシリーズ', offline.series[0].title.name)
+        # 索引に無い ISBN も問い合わせない
+        self.assertEqual(Metadata().todict(), wikipedia.metadata_from_isbn(
+            '9784000000002', 'x', [], NoNetwork()).todict())
+
+
+class TestHarvest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = SeriesIndex(os.path.join(self.directory, 'index.sqlite3'))
+        wikipedia.set_series_index(self.index)
+
+    def tearDown(self):
+        wikipedia.set_series_index(None)
+        shutil.rmtree(self.directory)
+
+    def test_harvest(self):
+        transport = FakeMediaWiki()
+        first = wikipedia.metadata_from_isbn(
+            '9784044292041', '涼宮ハルヒの消失', ['谷川流'], transport)
+        self.assertEqual(2, len(transport.requests))
+        self.assertEqual(len(PAGES['涼宮ハルヒシリーズ']),
+                         self.index.revid('涼宮ハルヒシリーズ'))
+
+        # 同じページに書かれている他の巻は問い合わせずに答える
+        second = wikipedia.metadata_from_isbn(
+            '4-04-429201-9', '涼宮ハルヒの憂鬱', ['谷川流'], NoNetwork())
+        self.assertEqual(first.todict(), second.todict())
+        self.assertEqual('涼宮ハルヒシリーズ', second.series[0].title.name)